@@ -16,26 +16,30 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from apirest import views
+from apirest.AsyncViews import aws_view, streaming_view
 
 
 urlpatterns = [
 path('', views.health_check),  # Root path for health check
 path('health/', views.health_check),
 path('lists/', views.restric.as_view()),
-path('ocr/', views.ocr2.as_view()),
-path('ocr-raw/', views.ocrRaw.as_view()),
-path('batch-ocr-raw/', views.BatchOCRRawView.as_view()),
-path('batch-ocr-acta/', views.BatchBirthCertificateOCRView.as_view()),  # Endpoint para Actas de Nacimiento
-path('batch-ocr-passport/', views.BatchPassportOCRView.as_view()),  # Endpoint para Pasaportes
-path('batch-ocr-certificado/', views.BatchCertificadoOCRView.as_view()),  # Endpoint para Certificados de Notas
-path('batch-ocr-titulo/', views.BatchTituloOCRView.as_view()),  # Endpoint para Títulos Universitarios/Licenciaturas
+path('lists/bulk/', streaming_view(views.restricBulk.as_view())),  # Screening masivo (respuesta NDJSON)
+path('ocr/', aws_view(views.ocr2)),
+path('ocr-raw/', aws_view(views.ocrRaw)),
+path('batch-ocr-raw/', aws_view(views.BatchOCRRawView)),
+path('batch-ocr-acta/', aws_view(views.BatchBirthCertificateOCRView)),  # Endpoint para Actas de Nacimiento
+path('batch-ocr-passport/', aws_view(views.BatchPassportOCRView)),  # Endpoint para Pasaportes
+path('batch-ocr-certificado/', aws_view(views.BatchCertificadoOCRView)),  # Endpoint para Certificados de Notas
+path('batch-ocr-titulo/', aws_view(views.BatchTituloOCRView)),  # Endpoint para Títulos Universitarios/Licenciaturas
+path('batch-jobs/<uuid:job_id>/', views.batch_job_detail),  # Estado/resultado de un batch en modo job ("async": true)
+path('batch-jobs/<uuid:job_id>/events/', streaming_view(views.batch_job_events)),  # Progreso del job en NDJSON
 path('html-to-pdf/', views.HTMLToPDFView.as_view()),  # Endpoint para convertir HTML a PDF
-path('upload/', views.FileUploadView.as_view()),
-path('textract-id/', views.TextractIDAnalysisView.as_view()),
-path('textract-general/', views.TextractGeneralAnalysisView.as_view()),
-path('face/', views.Compare3.as_view()),
-path('qr-read/', views.QRCodeReaderView.as_view()),
-path('qr-batch/', views.QRCodeBatchView.as_view()),
+path('upload/', aws_view(views.FileUploadView)),
+path('textract-id/', aws_view(views.TextractIDAnalysisView)),
+path('textract-general/', aws_view(views.TextractGeneralAnalysisView)),
+path('face/', aws_view(views.Compare3)),
+path('qr-read/', aws_view(views.QRCodeReaderView)),
+path('qr-batch/', aws_view(views.QRCodeBatchView)),
 path('admin/', admin.site.urls),
 path('login/', views.login),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'apibase.settings')
 
 application = get_wsgi_application()
+
+# Load the score thresholds once per worker instead of on the first request
+from apirest.ThresholdCache import warm_thresholds  # noqa: E402
+
+warm_thresholds()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Per-process registry of boto3 clients
+Clients are created once per (service, credentials, region) and shared by
+every analyzer and request of the worker. boto3 clients are thread-safe, so
+sharing them keeps their HTTP connection pools (and keep-alive connections)
+instead of rebuilding them on every call.
+"""
+
+import logging
+import threading
+
+import boto3
+from botocore.config import Config
+from decouple import config
+
+logger = logging.getLogger('apirest.aws')
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=config('AWS_MAX_POOL_CONNECTIONS', default=50, cast=int),
+    retries={
+        'max_attempts': config('AWS_MAX_ATTEMPTS', default=5, cast=int),
+        'mode': config('AWS_RETRY_MODE', default='adaptive'),
+    },
+    connect_timeout=config('AWS_CONNECT_TIMEOUT', default=5, cast=int),
+    read_timeout=config('AWS_READ_TIMEOUT', default=60, cast=int),
+    tcp_keepalive=True,
+)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_client(service_name, aws_access_key_id=None, aws_secret_access_key=None,
+               region_name=None, aws_session_token=None):
+    """
+    Shared client for an AWS service
+
+    Args:
+        service_name: 's3', 'rekognition', 'textract', ...
+        aws_access_key_id, aws_secret_access_key, aws_session_token: Credentials
+            (None uses the default boto3 credential chain)
+        region_name: AWS region (default AWS_DEFAULT_REGION or us-east-1)
+
+    Returns:
+        botocore client
+    """
+    region_name = region_name or config('AWS_DEFAULT_REGION', default='us-east-1')
+    key = (service_name, aws_access_key_id, aws_secret_access_key, aws_session_token, region_name)
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            # The default boto3 session is not thread-safe, use a private one
+            session = boto3.session.Session(
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                aws_session_token=aws_session_token,
+                region_name=region_name,
+            )
+            client = session.client(service_name, config=CLIENT_CONFIG)
+            _clients[key] = client
+            logger.debug(f"Created shared {service_name} client for region {region_name}")
+    return client
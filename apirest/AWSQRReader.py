@@ -1,22 +1,143 @@
 # -*- coding: utf-8 -*-
 """
 QR Code Reader Service
-Reads QR codes from images stored in S3 or uploaded directly
+Reads QR codes from images and PDFs stored in S3 or uploaded directly
 Supports multiple QR codes in a single image
+
+PDFs are scanned locally, without rasterizing every page to S3: each page
+is rendered as a low-DPI grayscale preview to locate the codes, and only
+those regions are rendered again at QR_PDF_DETAIL_DPI (PyMuPDF clip) and
+decoded. Pages are scanned in parallel on the PDF process pool.
 """
 
-import boto3
+from apirest.AWSClients import get_client
+from apirest.AWSUpload import PDF_CONVERSION_AVAILABLE, PDF_RENDER_WORKERS, worker_document
+from apirest.BatchExecutor import get_process_pool, reset_process_pool
+from apirest.ImageLoader import load_image, read_header
 import logging
-from PIL import Image
-import io
+import os
+import tempfile
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from decouple import config
-from pyzbar import pyzbar
-import cv2
+from apirest.QRDecoder import QR_DECODE_TIMEOUT, decode_qr, locate_qr
 import numpy as np
 
+if PDF_CONVERSION_AVAILABLE:
+    import fitz
+
 # Configure logger for QR operations
 logger = logging.getLogger('apirest.qr')
 
+# Longest side QR images are decoded at; larger uploads are reduced by the
+# JPEG decoder and the detected positions scaled back to the original
+QR_MAX_DECODE_SIDE = config('QR_MAX_DECODE_SIDE', default=4000, cast=int)
+# PDF pages: resolution of the preview that locates the codes and of the
+# regions re-rendered for decoding (page points are 1/72 inch)
+QR_PDF_PREVIEW_DPI = config('QR_PDF_PREVIEW_DPI', default=100, cast=int)
+QR_PDF_DETAIL_DPI = config('QR_PDF_DETAIL_DPI', default=300, cast=int)
+# Decoding budget of one page (all its regions and the full-page fallback)
+# and of a whole document; pages not scanned in time are reported as such
+QR_PDF_PAGE_TIMEOUT = config('QR_PDF_PAGE_TIMEOUT', default=QR_DECODE_TIMEOUT, cast=float)
+QR_PDF_TIMEOUT = config('QR_PDF_TIMEOUT', default=60.0, cast=float)
+
+
+def _is_pdf(content, filename):
+    return content[:5] == b'%PDF-' or filename.lower().endswith('.pdf')
+
+
+def _qr_code_data(index, qr, scale=1.0):
+    """Response entry of a decoded QRSymbol, coordinates multiplied by scale"""
+    return {
+        'index': index + 1,
+        'type': qr.type,
+        'data': qr.data.decode('utf-8'),
+        'raw_data': qr.data.hex(),
+        'quality': qr.quality,
+        'orientation': qr.orientation,
+        'rect': {
+            'left': round(qr.rect[0] * scale),
+            'top': round(qr.rect[1] * scale),
+            'width': round(qr.rect[2] * scale),
+            'height': round(qr.rect[3] * scale)
+        },
+        'polygon': [{'x': round(x * scale), 'y': round(y * scale)}
+                    for x, y in qr.polygon]
+    }
+
+
+def _render_gray(page, dpi, clip=None):
+    """Grayscale render of a page (or of the clip rectangle), returns (array, origin)"""
+    zoom = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return gray, (pix.x, pix.y)
+
+
+def _scan_pdf_page(pdf_document, page_num):
+    """
+    Locate the QR codes of a page on a low-DPI preview and decode them on
+    high-DPI renders of their regions
+
+    Returns:
+        dict: page_number, width/height of the page at QR_PDF_DETAIL_DPI,
+              decoded symbols (in that page frame), strategy and regions
+    """
+    deadline = time.perf_counter() + QR_PDF_PAGE_TIMEOUT
+    page = pdf_document.load_page(page_num)
+    preview, _ = _render_gray(page, QR_PDF_PREVIEW_DPI)
+    to_points = 72 / QR_PDF_PREVIEW_DPI
+    detail_zoom = QR_PDF_DETAIL_DPI / 72
+    regions = locate_qr(preview)
+
+    symbols = []
+    strategies = set()
+    timed_out = False
+    for x0, y0, x1, y1 in regions:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            timed_out = True
+            break
+        clip = fitz.Rect(x0 * to_points, y0 * to_points, x1 * to_points, y1 * to_points)
+        gray, (left, top) = _render_gray(page, QR_PDF_DETAIL_DPI, clip)
+        found, strategy = decode_qr(gray, timeout=remaining)
+        for symbol in found:
+            symbol = symbol.mapped(lambda x, y: (x + left, y + top))
+            # Overlapping regions can decode the same code twice
+            if not any(other.data == symbol.data and abs(other.rect[0] - symbol.rect[0]) < symbol.rect[2]
+                       and abs(other.rect[1] - symbol.rect[1]) < symbol.rect[3] for other in symbols):
+                symbols.append(symbol)
+                strategies.add(strategy)
+
+    # Size of the full page pixmap at that resolution
+    detail_rect = (page.rect * fitz.Matrix(detail_zoom, detail_zoom)).irect
+    width, height = detail_rect.width, detail_rect.height
+    if not symbols and not timed_out:
+        # Nothing located (or the regions did not decode): whole page at
+        # full detail, with what is left of the page budget
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            gray, _ = _render_gray(page, QR_PDF_DETAIL_DPI)
+            symbols, strategy = decode_qr(gray, timeout=remaining)
+            strategies = {f'page_{strategy}'} if strategy else set()
+        timed_out = not symbols and time.perf_counter() >= deadline
+
+    return {
+        'page_number': page_num + 1,
+        'width': width,
+        'height': height,
+        'symbols': symbols,
+        'strategy': ','.join(sorted(strategies)) or None,
+        'regions': len(regions),
+        'timed_out': timed_out,
+    }
+
+
+def _scan_pdf_file_page(path, page_num):
+    """Process pool task: scan a page, keeping the document open between pages"""
+    return _scan_pdf_page(worker_document(path), page_num)
+
 
 class QRCodeReader:
     """
@@ -53,7 +174,7 @@ class QRCodeReader:
         
         try:
             # Initialize S3 client
-            s3_client = boto3.client('s3',
+            s3_client = get_client('s3',
                                     aws_access_key_id=self.aws_access_key_id,
                                     aws_secret_access_key=self.aws_secret_access_key,
                                     region_name=self.region_name)
@@ -63,7 +184,9 @@ class QRCodeReader:
             response = s3_client.get_object(Bucket=self.bucket, Key=filename)
             image_content = response['Body'].read()
             
-            # Process image for QR detection
+            # Process image (or PDF, scanned locally) for QR detection
+            if _is_pdf(image_content, filename):
+                return self.read_qr_from_pdf(image_content, filename)
             result = self._process_qr_image(image_content, filename)
             
             return result
@@ -110,7 +233,9 @@ class QRCodeReader:
         logger.info(f"Reading QR codes from uploaded file: {filename}")
         
         try:
-            # Process image for QR detection
+            # Process image (or PDF, scanned locally) for QR detection
+            if _is_pdf(file_content, filename):
+                return self.read_qr_from_pdf(file_content, filename)
             result = self._process_qr_image(file_content, filename)
             return result
             
@@ -127,6 +252,165 @@ class QRCodeReader:
                 }
             }
 
+    def read_qr_from_pdf(self, pdf_content, filename, pdf_path=None):
+        """
+        Lee códigos QR de todas las páginas de un PDF sin subirlas a S3
+        
+        Args:
+            pdf_content (bytes): Contenido del PDF (None si se da pdf_path)
+            filename (str): Nombre del archivo
+            pdf_path (str): PDF en disco, abierto por ruta en lugar de memoria
+            
+        Returns:
+            dict: Resultado con códigos QR detectados; cada código indica su
+                  'page_number' y sus coordenadas en la página a QR_PDF_DETAIL_DPI
+        """
+        logger.info(f"Reading QR codes from PDF: {filename}")
+        
+        if not PDF_CONVERSION_AVAILABLE:
+            logger.error("PyMuPDF not available for PDF QR reading")
+            return {
+                'success': False,
+                'error': 'PDF support not available. Install with: pip install PyMuPDF',
+                'error_code': '500_PDF_Support_Unavailable',
+                'qr_codes': [],
+                'metadata': {
+                    'filename': filename,
+                    'total_qr_codes': 0
+                }
+            }
+        
+        try:
+            pages = self._scan_pdf_pages(pdf_content, filename, pdf_path)
+            
+            qr_results = []
+            page_results = []
+            for page in pages:
+                for qr in page['symbols']:
+                    qr_data = _qr_code_data(len(qr_results), qr)
+                    qr_data['page_number'] = page['page_number']
+                    qr_results.append(qr_data)
+                page_results.append({
+                    'page_number': page['page_number'],
+                    'width': page['width'],
+                    'height': page['height'],
+                    'total_qr_codes': len(page['symbols']),
+                    'located_regions': page['regions'],
+                    'decode_strategy': page['strategy'],
+                    'timed_out': page['timed_out']
+                })
+            
+            logger.info(f"Detected {len(qr_results)} QR code(s) in {len(pages)} PDF page(s)")
+            
+            result = {
+                'success': True,
+                'error': None,
+                'error_code': None,
+                'qr_codes': qr_results,
+                'metadata': {
+                    'filename': filename,
+                    'total_pages': len(pages),
+                    'pages': page_results,
+                    'dpi': QR_PDF_DETAIL_DPI,
+                    'total_qr_codes': len(qr_results),
+                    'processing_type': 'pdf_qr_code_detection'
+                }
+            }
+            
+            if not qr_results:
+                logger.warning(f"No QR codes detected in PDF: {filename}")
+                result['success'] = False
+                result['error'] = 'No QR codes detected in PDF'
+                result['error_code'] = '404_No_QR_Found'
+            
+            return result
+            
+        except Exception as e:
+            logger.error(f"Error processing QR PDF: {str(e)}")
+            logger.error(f"Exception type: {type(e).__name__}")
+            return {
+                'success': False,
+                'error': f'Error processing PDF for QR detection: {str(e)}',
+                'error_code': '500_PDF_Processing_Error',
+                'qr_codes': [],
+                'metadata': {
+                    'filename': filename,
+                    'total_qr_codes': 0
+                }
+            }
+
+    def _scan_pdf_pages(self, pdf_content, filename, pdf_path=None):
+        """
+        Scan every page of a PDF, in parallel on the PDF process pool when
+        it has more than one page (same pool and fallback as the upload
+        rasterization), returns the page scans in page order
+
+        Pages not scanned within QR_PDF_TIMEOUT are returned without
+        symbols and with 'timed_out' set
+        """
+        deadline = time.perf_counter() + QR_PDF_TIMEOUT
+        def open_document():
+            if pdf_path is not None:
+                return fitz.open(pdf_path)
+            return fitz.open(stream=pdf_content, filetype="pdf")
+        
+        pdf_document = open_document()
+        page_count = len(pdf_document)
+        logger.debug(f"PDF {filename} has {page_count} pages")
+        
+        scans = {}
+        if page_count > 1 and PDF_RENDER_WORKERS > 0:
+            pdf_document.close()
+            pdf_document = None
+            path = pdf_path
+            futures = {}
+            try:
+                if path is None:
+                    # Workers open the document from a file instead of
+                    # receiving the PDF with every page task
+                    fd, path = tempfile.mkstemp(suffix='.pdf', prefix='qr_')
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(pdf_content)
+                pool = get_process_pool('pdf', PDF_RENDER_WORKERS)
+                futures = {pool.submit(_scan_pdf_file_page, path, page_num): page_num
+                           for page_num in range(page_count)}
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, timeout=max(0, deadline - time.perf_counter()),
+                                         return_when=FIRST_COMPLETED)
+                    if not done:
+                        logger.warning(f"PDF QR scan of {filename} timed out, {len(pending)} pages not scanned")
+                        break
+                    for future in done:
+                        scans[futures[future]] = future.result()
+            except BrokenProcessPool as e:
+                logger.warning(f"PDF pool broken, scanning {page_count - len(scans)} pages in thread: {str(e)}")
+                reset_process_pool('pdf')
+            finally:
+                for future in futures:
+                    future.cancel()
+                if path is not None and path != pdf_path:
+                    try:
+                        os.remove(path)
+                    except OSError as cleanup_error:
+                        logger.warning(f"Error cleaning up temp file {path}: {cleanup_error}")
+        
+        if len(scans) < page_count and time.perf_counter() < deadline:
+            if pdf_document is None:
+                pdf_document = open_document()
+            try:
+                for page_num in range(page_count):
+                    if page_num not in scans and time.perf_counter() < deadline:
+                        scans[page_num] = _scan_pdf_page(pdf_document, page_num)
+            finally:
+                pdf_document.close()
+        elif pdf_document is not None:
+            pdf_document.close()
+        
+        return [scans.get(page_num) or {'page_number': page_num + 1, 'width': None, 'height': None,
+                                        'symbols': [], 'strategy': None, 'regions': 0, 'timed_out': True}
+                for page_num in range(page_count)]
+
     def _process_qr_image(self, image_content, filename):
         """
         Procesa una imagen para detectar códigos QR
@@ -139,40 +423,23 @@ class QRCodeReader:
             dict: Resultado con códigos QR detectados
         """
         try:
-            # Convert bytes to PIL Image
-            image = Image.open(io.BytesIO(image_content))
-            logger.debug(f"Image loaded - Size: {image.size}, Mode: {image.mode}")
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Convert PIL Image to OpenCV format
-            opencv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+            # Convert bytes to PIL Image (upright, 8-bit grayscale straight
+            # from the JPEG decoder)
+            _, original_size, _ = read_header(image_content)
+            image = load_image(image_content, max_size=(QR_MAX_DECODE_SIDE, QR_MAX_DECODE_SIDE), mode='L')
+            logger.debug(f"Image loaded - Size: {original_size}, decoded at {image.size}, Mode: {image.mode}")
+            # Decoded -> original coordinates
+            to_original = original_size[0] / image.size[0]
             
-            # Detect QR codes using pyzbar
-            qr_codes = pyzbar.decode(opencv_image)
+            # Fast pass first, concurrent strategies only when it misses
+            qr_codes, strategy = decode_qr(np.asarray(image))
             
-            logger.info(f"Detected {len(qr_codes)} QR code(s) in image")
+            logger.info(f"Detected {len(qr_codes)} QR code(s) in image (strategy: {strategy})")
             
             # Process detected QR codes
             qr_results = []
             for index, qr in enumerate(qr_codes):
-                qr_data = {
-                    'index': index + 1,
-                    'type': qr.type,
-                    'data': qr.data.decode('utf-8'),
-                    'raw_data': qr.data.hex(),
-                    'quality': qr.quality if hasattr(qr, 'quality') else None,
-                    'orientation': qr.orientation if hasattr(qr, 'orientation') else None,
-                    'rect': {
-                        'left': qr.rect.left,
-                        'top': qr.rect.top,
-                        'width': qr.rect.width,
-                        'height': qr.rect.height
-                    },
-                    'polygon': [{'x': point.x, 'y': point.y} for point in qr.polygon]
-                }
+                qr_data = _qr_code_data(index, qr, to_original)
                 qr_results.append(qr_data)
                 logger.debug(f"QR Code {index + 1}: Type={qr.type}, Data={qr_data['data'][:50]}...")
             
@@ -185,11 +452,12 @@ class QRCodeReader:
                 'metadata': {
                     'filename': filename,
                     'image_size': {
-                        'width': image.size[0],
-                        'height': image.size[1]
+                        'width': original_size[0],
+                        'height': original_size[1]
                     },
                     'image_mode': image.mode,
                     'total_qr_codes': len(qr_codes),
+                    'decode_strategy': strategy,
                     'processing_type': 'qr_code_detection'
                 }
             }
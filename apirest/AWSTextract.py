@@ -3,10 +3,11 @@ AWS Textract ID Analysis Module
 Extracts text from identity documents using Amazon Textract's analyze_id feature
 """
 
-import boto3
+from apirest.AWSClients import get_client
 import json
-import pandas as pd
 from decouple import config
+from apirest.BatchExecutor import call_aws
+from apirest.ResultCache import cached_call, s3_digest
 import logging
 
 # Configure logger
@@ -31,7 +32,7 @@ class TextractIDAnalyzer:
             logger.debug(f"Region: {self.region_name}, Bucket: {self.bucket_name}")
             
             # Initialize Textract client
-            self.textract_client = boto3.client(
+            self.textract_client = get_client(
                 'textract',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -64,15 +65,25 @@ class TextractIDAnalyzer:
         try:
             # Call Textract analyze_id
             logger.debug("Calling Textract analyze_id API")
-            response = self.textract_client.analyze_id(
-                DocumentPages=[
-                    {
-                        'S3Object': {
-                            'Bucket': bucket_name,
-                            'Name': document_name
-                        }
-                    }
-                ]
+            s3_client = get_client('s3',
+                                   aws_access_key_id=self.aws_access_key,
+                                   aws_secret_access_key=self.aws_secret_key,
+                                   region_name=self.region_name)
+            # Textract reads the object from S3 itself; the cache key only
+            # needs its ETag
+            response = cached_call(
+                'textract.analyze_id',
+                s3_digest(s3_client, bucket_name, document_name),
+                None,
+                lambda: call_aws('textract', self.textract_client.analyze_id,
+                                 DocumentPages=[
+                                     {
+                                         'S3Object': {
+                                             'Bucket': bucket_name,
+                                             'Name': document_name
+                                         }
+                                     }
+                                 ])
             )
             
             logger.info("Textract analyze_id completed successfully")
@@ -151,6 +162,8 @@ class TextractIDAnalyzer:
                 processed_data['identity_documents'].append(doc_info)
             
             # Create pandas DataFrame for consistency with other modules
+            # (imported here so web workers do not load pandas at startup)
+            import pandas as pd
             if processed_data['extracted_fields']:
                 df_data = []
                 for field in processed_data['extracted_fields']:
@@ -297,6 +310,7 @@ class TextractIDAnalyzer:
             }
             
             # Create pandas DataFrame for consistency
+            import pandas as pd
             if text_blocks:
                 df_data = []
                 for i, block in enumerate(text_blocks):
@@ -5,14 +5,13 @@ Specialized module for extracting text from Mexican birth certificates (Actas de
 Uses Textract's detect_document_text with optimized image preprocessing for OCR quality
 """
 
-import boto3
-import json
-import pandas as pd
-from PIL import Image, ImageEnhance, ImageFilter
+from apirest.AWSClients import get_client
 from decouple import config
+from apirest.ResultCache import cached_call, content_digest
+from apirest.BatchExecutor import call_aws
+from apirest.TextractBatch import run_document_batch, preprocessor
+from apirest.ImagePipeline import preprocess_document, get_profile
 import logging
-import io
-import os
 from datetime import datetime
 
 # Configure logger
@@ -38,7 +37,7 @@ class TextractBirthCertificateAnalyzer:
             logger.debug(f"Region: {self.region_name}, Bucket: {self.bucket_name}")
             
             # Initialize Textract client
-            self.textract_client = boto3.client(
+            self.textract_client = get_client(
                 'textract',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -46,7 +45,7 @@ class TextractBirthCertificateAnalyzer:
             )
             
             # Initialize S3 client
-            self.s3_client = boto3.client(
+            self.s3_client = get_client(
                 's3',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -62,6 +61,7 @@ class TextractBirthCertificateAnalyzer:
     def _preprocess_image_for_ocr(self, image_bytes, filename):
         """
         Preprocess image to optimize OCR quality for birth certificates
+        (ImagePipeline profile 'acta', variant from TEXTRACT_PREPROCESS_MODE)
         
         Args:
             image_bytes: Raw image bytes
@@ -73,89 +73,7 @@ class TextractBirthCertificateAnalyzer:
         logger.info(f"Starting image preprocessing for birth certificate: {filename}")
         
         try:
-            # Open image from bytes
-            image = Image.open(io.BytesIO(image_bytes))
-            original_size = image.size
-            original_mode = image.mode
-            logger.debug(f"Original image: {original_size}, mode: {original_mode}")
-            
-            # Convert to RGB if necessary (Textract works best with RGB)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-                logger.debug(f"Converted image mode from {original_mode} to RGB")
-            
-            # Step 1: Enhance contrast for better text visibility
-            contrast_enhancer = ImageEnhance.Contrast(image)
-            image = contrast_enhancer.enhance(1.3)  # Increase contrast by 30%
-            logger.debug("Applied contrast enhancement (1.3x)")
-            
-            # Step 2: Enhance sharpness for clearer text edges
-            sharpness_enhancer = ImageEnhance.Sharpness(image)
-            image = sharpness_enhancer.enhance(1.5)  # Increase sharpness by 50%
-            logger.debug("Applied sharpness enhancement (1.5x)")
-            
-            # Step 3: Slight brightness adjustment for washed-out documents
-            brightness_enhancer = ImageEnhance.Brightness(image)
-            image = brightness_enhancer.enhance(1.05)  # Slight brightness increase
-            logger.debug("Applied brightness enhancement (1.05x)")
-            
-            # Step 4: Apply unsharp mask for text edge enhancement
-            image = image.filter(ImageFilter.UnsharpMask(radius=1.5, percent=100, threshold=2))
-            logger.debug("Applied UnsharpMask filter")
-            
-            # Step 5: Ensure minimum resolution for OCR (Textract works best with high resolution)
-            min_dimension = 1500  # Minimum pixels for smallest dimension
-            width, height = image.size
-            
-            if width < min_dimension or height < min_dimension:
-                # Scale up while maintaining aspect ratio
-                scale_factor = max(min_dimension / width, min_dimension / height)
-                new_width = int(width * scale_factor)
-                new_height = int(height * scale_factor)
-                image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                logger.debug(f"Scaled up image from {(width, height)} to {(new_width, new_height)}")
-            
-            # Step 6: Ensure maximum size for Textract (5MB limit for synchronous operations)
-            max_size_bytes = 4.5 * 1024 * 1024  # 4.5MB to leave margin
-            
-            # Save to bytes and check size
-            output_buffer = io.BytesIO()
-            quality = 95
-            image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-            
-            # Reduce quality if necessary to meet size limit
-            while output_buffer.tell() > max_size_bytes and quality > 60:
-                output_buffer = io.BytesIO()
-                quality -= 5
-                image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-                logger.debug(f"Reduced JPEG quality to {quality}%, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-            
-            # If still too large, reduce dimensions
-            if output_buffer.tell() > max_size_bytes:
-                current_width, current_height = image.size
-                scale = 0.9
-                while output_buffer.tell() > max_size_bytes and scale > 0.5:
-                    new_width = int(current_width * scale)
-                    new_height = int(current_height * scale)
-                    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    
-                    # Apply sharpening after resize
-                    resized_image = resized_image.filter(
-                        ImageFilter.UnsharpMask(radius=1.0, percent=80, threshold=2)
-                    )
-                    
-                    output_buffer = io.BytesIO()
-                    resized_image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-                    scale -= 0.05
-                    logger.debug(f"Reduced dimensions to {(new_width, new_height)}, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-            
-            final_size = output_buffer.tell()
-            output_buffer.seek(0)
-            
-            logger.info(f"Image preprocessing completed for {filename}: "
-                       f"Original {original_size} -> Final size {final_size / (1024*1024):.2f}MB")
-            
-            return output_buffer.getvalue()
+            return preprocess_document(image_bytes, get_profile('acta'), filename)
             
         except Exception as e:
             logger.error(f"Error preprocessing image {filename}: {str(e)}")
@@ -181,27 +99,61 @@ class TextractBirthCertificateAnalyzer:
         logger.info(f"Starting Textract birth certificate analysis for: {document_name}")
         logger.debug(f"Using bucket: {bucket_name}, preprocess: {preprocess}")
         
+        image_bytes = self._fetch_document(document_name, bucket_name)
+        if isinstance(image_bytes, dict):
+            return image_bytes
+        
+        return self._analyze_document_bytes(document_name, bucket_name, image_bytes, preprocess=preprocess)
+    
+    def _fetch_document(self, document_name, bucket_name):
+        """
+        Download a page from S3 into memory
+        
+        Returns:
+            bytes: Image bytes, or the error result dict when S3 fails
+        """
         try:
             # Download image from S3
             logger.debug(f"Downloading image from S3: {bucket_name}/{document_name}")
-            response = self.s3_client.get_object(Bucket=bucket_name, Key=document_name)
+            response = call_aws('s3', self.s3_client.get_object, Bucket=bucket_name, Key=document_name)
             image_bytes = response['Body'].read()
             original_size = len(image_bytes)
             logger.debug(f"Downloaded image size: {original_size / (1024*1024):.2f}MB")
+            return image_bytes
             
-            # Preprocess image if enabled
-            if preprocess:
-                image_bytes = self._preprocess_image_for_ocr(image_bytes, document_name)
-                processed_size = len(image_bytes)
-                logger.debug(f"Preprocessed image size: {processed_size / (1024*1024):.2f}MB")
-            
-            # Call Textract detect_document_text with bytes
-            logger.debug("Calling Textract detect_document_text API with preprocessed image")
-            textract_response = self.textract_client.detect_document_text(
-                Document={
-                    'Bytes': image_bytes
-                }
-            )
+        except Exception as e:
+            logger.error(f"Error in analyze_birth_certificate: {str(e)}")
+            return self._error_result(document_name, bucket_name, e)
+    
+    def _analyze_document_bytes(self, document_name, bucket_name, image_bytes, preprocess_page=None, preprocess=True):
+        """
+        Preprocess (with preprocess_page when given), call Textract and build
+        the birth certificate result for one page
+        """
+        try:
+            def preprocess_and_detect():
+                document_bytes = image_bytes
+                # Preprocess image if enabled
+                if preprocess:
+                    processed_bytes = preprocess_page() if preprocess_page is not None else None
+                    if processed_bytes is None:
+                        processed_bytes = self._preprocess_image_for_ocr(image_bytes, document_name)
+                    document_bytes = processed_bytes
+                    processed_size = len(document_bytes)
+                    logger.debug(f"Preprocessed image size: {processed_size / (1024*1024):.2f}MB")
+                
+                # Call Textract detect_document_text with bytes
+                logger.debug("Calling Textract detect_document_text API with preprocessed image")
+                return call_aws('textract', self.textract_client.detect_document_text,
+                                Document={
+                                    'Bytes': document_bytes
+                                })
+            
+            # A cached response for the same content skips preprocessing too
+            textract_response = cached_call('textract.detect_document_text.birth_certificate',
+                                            content_digest(image_bytes),
+                                            {'preprocess': get_profile('acta').name if preprocess else False},
+                                            preprocess_and_detect)
             
             logger.info("Textract detect_document_text completed successfully")
             logger.debug(f"Response contains {len(textract_response.get('Blocks', []))} blocks")
@@ -221,19 +173,21 @@ class TextractBirthCertificateAnalyzer:
             
         except Exception as e:
             logger.error(f"Error in analyze_birth_certificate: {str(e)}")
-            error_result = {
-                'success': False,
-                'error': str(e),
-                'error_code': 'TEXTRACT_BIRTH_CERTIFICATE_ERROR',
-                'document_name': document_name,
-                'bucket_name': bucket_name,
-                'text_blocks': [],
-                'lines': [],
-                'words': [],
-                'full_text': '',
-                'raw_response': None
-            }
-            return error_result
+            return self._error_result(document_name, bucket_name, e)
+    
+    def _error_result(self, document_name, bucket_name, e):
+        return {
+            'success': False,
+            'error': str(e),
+            'error_code': 'TEXTRACT_BIRTH_CERTIFICATE_ERROR',
+            'document_name': document_name,
+            'bucket_name': bucket_name,
+            'text_blocks': [],
+            'lines': [],
+            'words': [],
+            'full_text': '',
+            'raw_response': None
+        }
     
     def _process_birth_certificate_response(self, response, document_name, preprocessed=True):
         """
@@ -339,7 +293,8 @@ class TextractBirthCertificateAnalyzer:
     
     def analyze_birth_certificate_batch(self, file_list, bucket_name=None, preprocess=True):
         """
-        Process multiple birth certificate files and combine results
+        Process multiple birth certificate files concurrently and combine
+        the results in file order
         Useful for multi-page birth certificates or batches
         
         Args:
@@ -383,16 +338,21 @@ class TextractBirthCertificateAnalyzer:
         full_text_parts = []
         all_confidences = []
         
+        # Pages are downloaded, preprocessed and analyzed concurrently
+        page_results = run_document_batch(
+            file_list,
+            fetch=lambda filename: self._fetch_document(filename, bucket_name),
+            analyze=lambda filename, original, preprocess_page: self._analyze_document_bytes(
+                filename, bucket_name, original, preprocess_page, preprocess=preprocess),
+            preprocess=preprocessor(self, '_preprocess_image_for_ocr') if preprocess else None,
+        )
+        
         for index, filename in enumerate(file_list):
             logger.info(f"Processing birth certificate {index + 1}/{len(file_list)}: {filename}")
             
             try:
-                # Process individual file
-                single_result = self.analyze_birth_certificate(
-                    filename, 
-                    bucket_name, 
-                    preprocess=preprocess
-                )
+                # Result of the individual file
+                single_result = page_results[index]
                 
                 if single_result['success']:
                     # Add lines to combined result with page info
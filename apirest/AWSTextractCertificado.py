@@ -5,14 +5,13 @@ Specialized module for extracting text and tables from academic certificates and
 Uses Textract's analyze_document with TABLES feature for structured data extraction
 """
 
-import boto3
-import json
-import pandas as pd
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from apirest.AWSClients import get_client
 from decouple import config
+from apirest.ResultCache import cached_call, content_digest
+from apirest.BatchExecutor import call_aws
+from apirest.TextractBatch import run_document_batch, preprocessor
+from apirest.ImagePipeline import preprocess_document, get_profile
 import logging
-import io
-import os
 import re
 from datetime import datetime
 
@@ -40,7 +39,7 @@ class TextractCertificadoAnalyzer:
             logger.debug(f"Region: {self.region_name}, Bucket: {self.bucket_name}")
             
             # Initialize Textract client
-            self.textract_client = boto3.client(
+            self.textract_client = get_client(
                 'textract',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -48,7 +47,7 @@ class TextractCertificadoAnalyzer:
             )
             
             # Initialize S3 client
-            self.s3_client = boto3.client(
+            self.s3_client = get_client(
                 's3',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -61,126 +60,9 @@ class TextractCertificadoAnalyzer:
             logger.error(f"Failed to initialize TextractCertificadoAnalyzer: {str(e)}")
             raise
     
-    def _enhance_for_document_ocr(self, image):
-        """
-        Apply enhancements specifically optimized for printed documents with tables
-        
-        Args:
-            image: PIL Image object
-            
-        Returns:
-            PIL Image: Enhanced image
-        """
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            logger.debug("Converted image mode to RGB")
-        
-        # Step 1: Auto-contrast to normalize lighting
-        image = ImageOps.autocontrast(image, cutoff=0.5)
-        logger.debug("Applied auto-contrast")
-        
-        # Step 2: Increase contrast for better text visibility
-        contrast_enhancer = ImageEnhance.Contrast(image)
-        image = contrast_enhancer.enhance(1.3)
-        logger.debug("Applied contrast enhancement (1.3x)")
-        
-        # Step 3: Increase sharpness for clear text
-        sharpness_enhancer = ImageEnhance.Sharpness(image)
-        image = sharpness_enhancer.enhance(1.8)
-        logger.debug("Applied sharpness enhancement (1.8x)")
-        
-        # Step 4: Slight brightness adjustment for white backgrounds
-        brightness_enhancer = ImageEnhance.Brightness(image)
-        image = brightness_enhancer.enhance(1.02)
-        logger.debug("Applied brightness enhancement (1.02x)")
-        
-        # Step 5: Apply unsharp mask for crisp text
-        image = image.filter(ImageFilter.UnsharpMask(radius=1.5, percent=120, threshold=2))
-        logger.debug("Applied UnsharpMask filter")
-        
-        return image
-    
-    def _ensure_optimal_resolution(self, image):
-        """
-        Ensure the image has optimal resolution for Textract table detection
-        
-        Args:
-            image: PIL Image object
-            
-        Returns:
-            PIL Image: Image with optimal resolution
-        """
-        width, height = image.size
-        
-        # For documents with tables, we need good resolution
-        min_long_side = 2000
-        max_long_side = 4000
-        
-        long_side = max(width, height)
-        
-        if long_side < min_long_side:
-            scale_factor = min_long_side / long_side
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.debug(f"Scaled up from ({width}, {height}) to ({new_width}, {new_height})")
-            
-            # Re-apply sharpening after upscale
-            image = image.filter(ImageFilter.UnsharpMask(radius=1.0, percent=100, threshold=2))
-            
-        elif long_side > max_long_side:
-            scale_factor = max_long_side / long_side
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.debug(f"Scaled down from ({width}, {height}) to ({new_width}, {new_height})")
-        
-        return image
-    
-    def _compress_to_size_limit(self, image, max_size_mb=4.5):
-        """
-        Compress image to meet Textract size limit while preserving quality
-        
-        Args:
-            image: PIL Image object
-            max_size_mb: Maximum size in megabytes
-            
-        Returns:
-            bytes: Compressed image bytes
-        """
-        max_size_bytes = max_size_mb * 1024 * 1024
-        
-        output_buffer = io.BytesIO()
-        quality = 95
-        image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-        
-        while output_buffer.tell() > max_size_bytes and quality > 70:
-            output_buffer = io.BytesIO()
-            quality -= 5
-            image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-            logger.debug(f"Reduced quality to {quality}%, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-        
-        if output_buffer.tell() > max_size_bytes:
-            width, height = image.size
-            scale = 0.9
-            while output_buffer.tell() > max_size_bytes and scale > 0.6:
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                resized = resized.filter(ImageFilter.UnsharpMask(radius=1.0, percent=100, threshold=2))
-                
-                output_buffer = io.BytesIO()
-                resized.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-                scale -= 0.05
-                logger.debug(f"Reduced dimensions, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-        
-        output_buffer.seek(0)
-        return output_buffer.getvalue()
-    
     def _preprocess_image(self, image_bytes, filename):
         """
-        Complete preprocessing pipeline for certificate/transcript images
+        Complete preprocessing pipeline for certificate/transcript images (ImagePipeline profile 'certificado', variant from TEXTRACT_PREPROCESS_MODE)
         
         Args:
             image_bytes: Raw image bytes
@@ -192,23 +74,7 @@ class TextractCertificadoAnalyzer:
         logger.info(f"Starting certificate image preprocessing: {filename}")
         
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            original_size = image.size
-            logger.debug(f"Original image: {original_size}, mode: {image.mode}")
-            
-            # Apply enhancements
-            image = self._enhance_for_document_ocr(image)
-            
-            # Ensure optimal resolution
-            image = self._ensure_optimal_resolution(image)
-            
-            # Compress to size limit
-            processed_bytes = self._compress_to_size_limit(image)
-            
-            final_size = len(processed_bytes) / (1024 * 1024)
-            logger.info(f"Preprocessing complete. Final size: {final_size:.2f}MB")
-            
-            return processed_bytes
+            return preprocess_document(image_bytes, get_profile('certificado'), filename)
             
         except Exception as e:
             logger.error(f"Error preprocessing certificate image: {str(e)}")
@@ -401,6 +267,19 @@ class TextractCertificadoAnalyzer:
             
         logger.info(f"Starting certificate analysis for: {photo} in bucket: {bucket}")
         
+        original_bytes = self._fetch_document(photo, bucket)
+        if isinstance(original_bytes, dict):
+            return original_bytes
+        
+        return self._analyze_document_bytes(photo, bucket, original_bytes)
+    
+    def _fetch_document(self, photo, bucket):
+        """
+        Download a page from S3 into memory
+        
+        Returns:
+            bytes: Image bytes, or the error result dict when S3 fails
+        """
         if not photo or not isinstance(photo, str):
             return {
                 'success': False,
@@ -408,19 +287,14 @@ class TextractCertificadoAnalyzer:
                 'error_code': '400_Invalid_Parameters'
             }
         
-        temp_file = None
-        
         try:
             # Download file from S3
-            temp_file = f'temp_cert_{datetime.now().strftime("%Y%m%d%H%M%S%f")}.tmp'
             logger.debug(f"Downloading from S3: {bucket}/{photo}")
             
-            self.s3_client.download_file(bucket, photo, temp_file)
-            
-            with open(temp_file, 'rb') as f:
-                original_bytes = f.read()
+            original_bytes = call_aws('s3', self.s3_client.get_object, Bucket=bucket, Key=photo)['Body'].read()
             
             logger.info(f"Downloaded certificate image: {len(original_bytes) / (1024*1024):.2f}MB")
+            return original_bytes
             
         except Exception as e:
             logger.error(f"Error accessing S3: {str(e)}")
@@ -429,24 +303,30 @@ class TextractCertificadoAnalyzer:
                 'error': f'Error accessing S3 file: {str(e)}',
                 'error_code': '400_S3_Access_Error'
             }
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
-        
+    
+    def _analyze_document_bytes(self, photo, bucket, original_bytes, preprocess_page=None):
+        """
+        Preprocess (with preprocess_page when given), call Textract and build
+        the certificate result for one page
+        """
         try:
-            # Preprocess the image
-            processed_bytes = self._preprocess_image(original_bytes, photo)
-            
-            # Call Textract with TABLES and FORMS features
-            logger.info("Calling AWS Textract analyze_document with TABLES feature")
+            def preprocess_and_analyze():
+                document_bytes = preprocess_page() if preprocess_page is not None else None
+                if document_bytes is None:
+                    # Preprocess the image
+                    document_bytes = self._preprocess_image(original_bytes, photo)
+                
+                # Call Textract with TABLES and FORMS features
+                logger.info("Calling AWS Textract analyze_document with TABLES feature")
+                
+                return call_aws('textract', self.textract_client.analyze_document,
+                                Document={'Bytes': document_bytes},
+                                FeatureTypes=['TABLES', 'FORMS'])
             
-            response = self.textract_client.analyze_document(
-                Document={'Bytes': processed_bytes},
-                FeatureTypes=['TABLES', 'FORMS']
-            )
+            # A cached response for the same content skips preprocessing too
+            response = cached_call('textract.analyze_document.certificado', content_digest(original_bytes),
+                                   {'preprocess': get_profile('certificado').name, 'FeatureTypes': ['TABLES', 'FORMS']},
+                                   preprocess_and_analyze)
             
             blocks = response.get('Blocks', [])
             logger.info(f"Textract response received with {len(blocks)} blocks")
@@ -544,7 +424,7 @@ class TextractCertificadoAnalyzer:
     
     def batch_analyze(self, photos, bucket=None):
         """
-        Analyze multiple certificate images
+        Analyze multiple certificate images concurrently, results in page order
         
         Args:
             photos: List of S3 keys
@@ -563,8 +443,16 @@ class TextractCertificadoAnalyzer:
         error_count = 0
         all_grades = []
         
-        for photo in photos:
-            result = self.analyze_certificado(photo, bucket)
+        # Pages are downloaded, preprocessed and analyzed concurrently
+        page_results = run_document_batch(
+            photos,
+            fetch=lambda photo: self._fetch_document(photo, bucket),
+            analyze=lambda photo, original, preprocess_page: self._analyze_document_bytes(
+                photo, bucket, original, preprocess_page),
+            preprocess=preprocessor(self, '_preprocess_image'),
+        )
+        
+        for photo, result in zip(photos, page_results):
             results.append({
                 'photo': photo,
                 'result': result
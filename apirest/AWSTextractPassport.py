@@ -6,14 +6,13 @@ Uses Textract's detect_document_text with optimized image preprocessing for pass
 Handles rotated images and MRZ (Machine Readable Zone) detection
 """
 
-import boto3
-import json
-import pandas as pd
-from PIL import Image, ImageEnhance, ImageFilter, ImageOps
+from apirest.AWSClients import get_client
 from decouple import config
+from apirest.ResultCache import cached_call, content_digest
+from apirest.BatchExecutor import call_aws
+from apirest.TextractBatch import run_document_batch, preprocessor
+from apirest.ImagePipeline import preprocess_document, get_profile
 import logging
-import io
-import os
 import re
 from datetime import datetime
 
@@ -41,7 +40,7 @@ class TextractPassportAnalyzer:
             logger.debug(f"Region: {self.region_name}, Bucket: {self.bucket_name}")
             
             # Initialize Textract client
-            self.textract_client = boto3.client(
+            self.textract_client = get_client(
                 'textract',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -49,7 +48,7 @@ class TextractPassportAnalyzer:
             )
             
             # Initialize S3 client
-            self.s3_client = boto3.client(
+            self.s3_client = get_client(
                 's3',
                 aws_access_key_id=self.aws_access_key,
                 aws_secret_access_key=self.aws_secret_key,
@@ -62,154 +61,9 @@ class TextractPassportAnalyzer:
             logger.error(f"Failed to initialize TextractPassportAnalyzer: {str(e)}")
             raise
     
-    def _detect_and_fix_rotation(self, image):
-        """
-        Detect if the image is rotated and correct it
-        Passports should be horizontal with text readable left-to-right
-        
-        Args:
-            image: PIL Image object
-            
-        Returns:
-            PIL Image: Correctly oriented image
-        """
-        width, height = image.size
-        
-        # If image is portrait (taller than wide), it's likely rotated 90 degrees
-        if height > width * 1.2:
-            logger.info(f"Image appears to be portrait ({width}x{height}), rotating 90° clockwise")
-            image = image.rotate(-90, expand=True)
-            logger.debug(f"New dimensions after rotation: {image.size}")
-        
-        return image
-    
-    def _enhance_for_passport_ocr(self, image):
-        """
-        Apply enhancements specifically optimized for passport text extraction
-        
-        Args:
-            image: PIL Image object
-            
-        Returns:
-            PIL Image: Enhanced image
-        """
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-            logger.debug(f"Converted image mode to RGB")
-        
-        # Step 1: Auto-contrast to normalize lighting
-        image = ImageOps.autocontrast(image, cutoff=1)
-        logger.debug("Applied auto-contrast")
-        
-        # Step 2: Increase contrast for better text visibility (passports often have subtle text)
-        contrast_enhancer = ImageEnhance.Contrast(image)
-        image = contrast_enhancer.enhance(1.4)  # Stronger contrast for passport
-        logger.debug("Applied contrast enhancement (1.4x)")
-        
-        # Step 3: Increase sharpness significantly for small text
-        sharpness_enhancer = ImageEnhance.Sharpness(image)
-        image = sharpness_enhancer.enhance(2.0)  # Strong sharpening for MRZ
-        logger.debug("Applied sharpness enhancement (2.0x)")
-        
-        # Step 4: Slight brightness adjustment 
-        brightness_enhancer = ImageEnhance.Brightness(image)
-        image = brightness_enhancer.enhance(1.02)
-        logger.debug("Applied brightness enhancement (1.02x)")
-        
-        # Step 5: Apply unsharp mask for crisp text edges
-        image = image.filter(ImageFilter.UnsharpMask(radius=2.0, percent=150, threshold=2))
-        logger.debug("Applied UnsharpMask filter for text edges")
-        
-        return image
-    
-    def _ensure_optimal_resolution(self, image):
-        """
-        Ensure the image has optimal resolution for Textract OCR
-        
-        Args:
-            image: PIL Image object
-            
-        Returns:
-            PIL Image: Image with optimal resolution
-        """
-        width, height = image.size
-        
-        # Passports need good resolution - minimum 2000px on the longer side
-        min_long_side = 2000
-        max_long_side = 4000  # Don't go too high to avoid memory issues
-        
-        long_side = max(width, height)
-        short_side = min(width, height)
-        
-        if long_side < min_long_side:
-            # Scale up
-            scale_factor = min_long_side / long_side
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.debug(f"Scaled up from ({width}, {height}) to ({new_width}, {new_height})")
-            
-            # Re-apply sharpening after upscale
-            image = image.filter(ImageFilter.UnsharpMask(radius=1.0, percent=100, threshold=2))
-            
-        elif long_side > max_long_side:
-            # Scale down slightly
-            scale_factor = max_long_side / long_side
-            new_width = int(width * scale_factor)
-            new_height = int(height * scale_factor)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            logger.debug(f"Scaled down from ({width}, {height}) to ({new_width}, {new_height})")
-        
-        return image
-    
-    def _compress_to_size_limit(self, image, max_size_mb=4.5):
-        """
-        Compress image to meet Textract size limit while preserving quality
-        
-        Args:
-            image: PIL Image object
-            max_size_mb: Maximum size in megabytes
-            
-        Returns:
-            bytes: Compressed image bytes
-        """
-        max_size_bytes = max_size_mb * 1024 * 1024
-        
-        output_buffer = io.BytesIO()
-        quality = 95
-        image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-        
-        # Reduce quality if necessary
-        while output_buffer.tell() > max_size_bytes and quality > 70:
-            output_buffer = io.BytesIO()
-            quality -= 5
-            image.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-            logger.debug(f"Reduced quality to {quality}%, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-        
-        # If still too large, reduce dimensions
-        if output_buffer.tell() > max_size_bytes:
-            width, height = image.size
-            scale = 0.9
-            while output_buffer.tell() > max_size_bytes and scale > 0.6:
-                new_width = int(width * scale)
-                new_height = int(height * scale)
-                resized = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                
-                # Re-sharpen after resize
-                resized = resized.filter(ImageFilter.UnsharpMask(radius=1.0, percent=100, threshold=2))
-                
-                output_buffer = io.BytesIO()
-                resized.save(output_buffer, format='JPEG', quality=quality, optimize=True)
-                scale -= 0.05
-                logger.debug(f"Reduced dimensions by {int((1-scale)*100)}%, size: {output_buffer.tell() / (1024*1024):.2f}MB")
-        
-        output_buffer.seek(0)
-        return output_buffer.getvalue()
-    
     def _preprocess_image_for_passport(self, image_bytes, filename):
         """
-        Complete preprocessing pipeline for passport images
+        Complete preprocessing pipeline for passport images (ImagePipeline profile 'passport', variant from TEXTRACT_PREPROCESS_MODE)
         
         Args:
             image_bytes: Raw image bytes
@@ -221,27 +75,7 @@ class TextractPassportAnalyzer:
         logger.info(f"Starting passport image preprocessing: {filename}")
         
         try:
-            # Open image
-            image = Image.open(io.BytesIO(image_bytes))
-            original_size = image.size
-            logger.debug(f"Original image: {original_size}, mode: {image.mode}")
-            
-            # Step 1: Detect and fix rotation
-            image = self._detect_and_fix_rotation(image)
-            
-            # Step 2: Apply passport-specific enhancements
-            image = self._enhance_for_passport_ocr(image)
-            
-            # Step 3: Ensure optimal resolution
-            image = self._ensure_optimal_resolution(image)
-            
-            # Step 4: Compress to size limit
-            processed_bytes = self._compress_to_size_limit(image)
-            
-            final_size = len(processed_bytes) / (1024 * 1024)
-            logger.info(f"Preprocessing complete. Final size: {final_size:.2f}MB")
-            
-            return processed_bytes
+            return preprocess_document(image_bytes, get_profile('passport'), filename)
             
         except Exception as e:
             logger.error(f"Error preprocessing passport image: {str(e)}")
@@ -292,6 +126,19 @@ class TextractPassportAnalyzer:
             
         logger.info(f"Starting passport analysis for: {photo} in bucket: {bucket}")
         
+        original_bytes = self._fetch_document(photo, bucket)
+        if isinstance(original_bytes, dict):
+            return original_bytes
+        
+        return self._analyze_document_bytes(photo, bucket, original_bytes)
+    
+    def _fetch_document(self, photo, bucket):
+        """
+        Download a page from S3 into memory
+        
+        Returns:
+            bytes: Image bytes, or the error result dict when S3 fails
+        """
         # Validate parameters
         if not photo or not isinstance(photo, str):
             return {
@@ -300,19 +147,14 @@ class TextractPassportAnalyzer:
                 'error_code': '400_Invalid_Parameters'
             }
         
-        temp_file = None
-        
         try:
             # Download file from S3
-            temp_file = f'temp_passport_{datetime.now().strftime("%Y%m%d%H%M%S%f")}.tmp'
             logger.debug(f"Downloading from S3: {bucket}/{photo}")
             
-            self.s3_client.download_file(bucket, photo, temp_file)
-            
-            with open(temp_file, 'rb') as f:
-                original_bytes = f.read()
+            original_bytes = call_aws('s3', self.s3_client.get_object, Bucket=bucket, Key=photo)['Body'].read()
             
             logger.info(f"Downloaded passport image: {len(original_bytes) / (1024*1024):.2f}MB")
+            return original_bytes
             
         except Exception as e:
             logger.error(f"Error accessing S3: {str(e)}")
@@ -321,23 +163,28 @@ class TextractPassportAnalyzer:
                 'error': f'Error accessing S3 file: {str(e)}',
                 'error_code': '400_S3_Access_Error'
             }
-        finally:
-            if temp_file and os.path.exists(temp_file):
-                try:
-                    os.remove(temp_file)
-                except:
-                    pass
-        
+    
+    def _analyze_document_bytes(self, photo, bucket, original_bytes, preprocess_page=None):
+        """
+        Preprocess (with preprocess_page when given), call Textract and build
+        the passport result for one page
+        """
         try:
-            # Preprocess the image for passport OCR
-            processed_bytes = self._preprocess_image_for_passport(original_bytes, photo)
-            
-            # Call Textract
-            logger.info("Calling AWS Textract detect_document_text for passport")
+            def preprocess_and_detect():
+                document_bytes = preprocess_page() if preprocess_page is not None else None
+                if document_bytes is None:
+                    # Preprocess the image for passport OCR
+                    document_bytes = self._preprocess_image_for_passport(original_bytes, photo)
+                
+                # Call Textract
+                logger.info("Calling AWS Textract detect_document_text for passport")
+                
+                return call_aws('textract', self.textract_client.detect_document_text,
+                                Document={'Bytes': document_bytes})
             
-            response = self.textract_client.detect_document_text(
-                Document={'Bytes': processed_bytes}
-            )
+            # A cached response for the same content skips preprocessing too
+            response = cached_call('textract.detect_document_text.passport', content_digest(original_bytes),
+                                   {'preprocess': get_profile('passport').name}, preprocess_and_detect)
             
             logger.info(f"Textract response received with {len(response.get('Blocks', []))} blocks")
             
@@ -422,7 +269,7 @@ class TextractPassportAnalyzer:
     
     def batch_analyze(self, photos, bucket=None):
         """
-        Analyze multiple passport images
+        Analyze multiple passport images concurrently, results in page order
         
         Args:
             photos: List of S3 keys
@@ -440,8 +287,16 @@ class TextractPassportAnalyzer:
         success_count = 0
         error_count = 0
         
-        for photo in photos:
-            result = self.analyze_passport(photo, bucket)
+        # Pages are downloaded, preprocessed and analyzed concurrently
+        page_results = run_document_batch(
+            photos,
+            fetch=lambda photo: self._fetch_document(photo, bucket),
+            analyze=lambda photo, original, preprocess_page: self._analyze_document_bytes(
+                photo, bucket, original, preprocess_page),
+            preprocess=preprocessor(self, '_preprocess_image_for_passport'),
+        )
+        
+        for photo, result in zip(photos, page_results):
             results.append({
                 'photo': photo,
                 'result': result
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
-import boto3
+from apirest.AWSClients import get_client
+from apirest.BatchExecutor import call_aws, get_process_pool, reset_process_pool
+from apirest.ImageEncoder import MAX_DOCUMENT_BYTES
+from apirest.ImagePipeline import process_image, PROFILES
+from apirest.ImageLoader import load_image
 import os
 import io
 import uuid
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from PIL import Image
 from decouple import config
+from boto3.s3.transfer import TransferConfig
 import logging
 import mimetypes
 
@@ -40,6 +49,64 @@ else:
 # Configure logger for file upload operations
 logger = logging.getLogger('apirest.upload')
 
+# Processes rendering PDF pages (0 = render in the request thread)
+PDF_RENDER_WORKERS = config('PDF_RENDER_WORKERS', default=min(4, os.cpu_count() or 1), cast=int)
+# Concurrent S3 uploads of the converted pages of one file
+UPLOAD_WORKERS = config('UPLOAD_S3_WORKERS', default=8, cast=int)
+
+# Multipart upload of originals spooled to disk: parts of
+# UPLOAD_MULTIPART_CHUNK_MB sent UPLOAD_MULTIPART_CONCURRENCY at a time
+MULTIPART_CHUNK_SIZE = config('UPLOAD_MULTIPART_CHUNK_MB', default=8, cast=int) * 1024 * 1024
+MULTIPART_CONFIG = TransferConfig(
+    multipart_threshold=MULTIPART_CHUNK_SIZE,
+    multipart_chunksize=MULTIPART_CHUNK_SIZE,
+    max_concurrency=config('UPLOAD_MULTIPART_CONCURRENCY', default=4, cast=int),
+    use_threads=True
+)
+
+# Maximum image size in bytes (4.5MB)
+MAX_IMAGE_SIZE = MAX_DOCUMENT_BYTES
+
+# ((path, inode, mtime), document) opened by this render worker process,
+# one at a time
+_worker_document = None
+
+
+def _render_page(pdf_document, page_num, max_size_bytes):
+    """Render one page as an OCR-ready JPEG, returns (bytes, quality)"""
+    page = pdf_document.load_page(page_num)
+
+    # Matrix(3.0, 3.0) = 3x zoom = ~300 DPI (optimal for OCR)
+    # alpha=False removes transparency for smaller file size
+    pix = page.get_pixmap(matrix=fitz.Matrix(3.0, 3.0), alpha=False)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    pix = None
+
+    # Slight sharpening for better OCR, then quality 95-70 at full resolution
+    # and quality 80 down to 50% of the size (ImagePipeline profile 'pdf_page')
+    img_data, quality, _ = process_image(img, PROFILES['pdf_page'], f"page {page_num + 1}",
+                                         max_size_bytes=max_size_bytes)
+    return img_data, quality
+
+
+def worker_document(path):
+    """PDF `path` opened in this pool worker, kept open between its page tasks"""
+    global _worker_document
+    # Temp paths are reused once deleted: the file identity is part of the key
+    stat = os.stat(path)
+    key = (path, stat.st_ino, stat.st_mtime_ns)
+    if _worker_document is None or _worker_document[0] != key:
+        if _worker_document is not None:
+            _worker_document[1].close()
+        _worker_document = (key, fitz.open(path))
+    return _worker_document[1]
+
+
+def _render_pdf_file_page(path, page_num, max_size_bytes):
+    """Process pool task: render a page, keeping the document open between pages"""
+    return _render_page(worker_document(path), page_num, max_size_bytes)
+
+
 class FileUploadS3:
     """
     Clase para manejar subida de archivos a S3 con conversión automática
@@ -73,7 +140,7 @@ class FileUploadS3:
     def _get_s3_client(self):
         """Get configured S3 client"""
         try:
-            s3_client = boto3.client(
+            s3_client = get_client(
                 's3',
                 aws_access_key_id=self.aws_access_key_id,
                 aws_secret_access_key=self.aws_secret_access_key,
@@ -119,163 +186,109 @@ class FileUploadS3:
         else:
             raise ValueError(f"Unknown file category for: {file_ext}")
 
-    def _compress_image_to_max_size(self, img, max_size_bytes=4.5 * 1024 * 1024, min_quality=70):
-        """
-        Compress image to ensure it doesn't exceed max_size_bytes (default 4.5MB).
-        Optimized for OCR: prioritizes text readability over file size.
-        Uses adaptive quality reduction and smart resizing.
-        
-        For documents with small text (like birth certificates), we:
-        1. First try reducing JPEG quality (down to min_quality=70)
-        2. Then resize while maintaining aspect ratio
-        3. Apply sharpening to preserve text edges
+    def _page_info(self, original_filename, page_num, img_data, final_quality):
+        # Generate filename for this page
+        page_filename = f"{os.path.splitext(original_filename)[0]}_page_{page_num + 1}.jpg"
+        logger.debug(f"Converted page {page_num + 1} to {len(img_data) / 1024 / 1024:.2f}MB at quality={final_quality}")
+        return {
+            'filename': self._generate_unique_filename(page_filename),
+            'content': img_data,
+            'page_number': page_num + 1,
+            'size': len(img_data)
+        }
+
+    def _iter_pdf_pages(self, pdf_content, original_filename, pdf_path=None):
         """
-        from PIL import Image, ImageEnhance, ImageFilter
-        import io
-        
-        # Start with high quality
-        quality = 95
-        current_img = img.copy()
-        original_width = current_img.width
-        original_height = current_img.height
-        
-        logger.debug(f"Starting compression - Original size: {original_width}x{original_height}")
-        
-        # Phase 1: Try quality reduction only (preserves resolution for OCR)
-        while quality >= min_quality:
-            output = io.BytesIO()
-            current_img.save(output, format='JPEG', quality=quality, optimize=True, dpi=(300, 300))
-            img_data = output.getvalue()
-            
-            if len(img_data) <= max_size_bytes:
-                logger.debug(f"Image compressed to {len(img_data) / 1024 / 1024:.2f}MB at quality={quality} (no resize needed)")
-                return img_data, quality
-            
-            # Reduce quality in smaller steps to find optimal point
-            quality -= 5
-            logger.debug(f"Image too large ({len(img_data) / 1024 / 1024:.2f}MB), reducing quality to {quality}")
-        
-        # Phase 2: Smart resize - reduce dimensions while keeping text readable
-        # For OCR, minimum recommended is ~150 DPI, so we limit resize to 70% minimum
-        logger.info("Quality reduction insufficient, applying smart resize for OCR optimization")
-        
-        # Reset quality to 80 for resized images (good balance for text)
-        resize_quality = 80
-        scale_factor = 0.95  # Start with minimal reduction
-        min_scale = 0.70  # Don't go below 70% to maintain OCR readability
-        
-        while scale_factor >= min_scale:
-            new_width = int(original_width * scale_factor)
-            new_height = int(original_height * scale_factor)
-            
-            # Use LANCZOS for best quality downscaling
-            resized_img = current_img.resize((new_width, new_height), Image.LANCZOS)
-            
-            # Apply slight sharpening to compensate for resize blur (helps OCR)
-            enhancer = ImageEnhance.Sharpness(resized_img)
-            sharpened_img = enhancer.enhance(1.3)  # Moderate sharpening
-            
-            output = io.BytesIO()
-            sharpened_img.save(output, format='JPEG', quality=resize_quality, optimize=True, dpi=(300, 300))
-            img_data = output.getvalue()
-            
-            if len(img_data) <= max_size_bytes:
-                logger.debug(f"Image resized to {new_width}x{new_height} ({scale_factor*100:.0f}%) and compressed to {len(img_data) / 1024 / 1024:.2f}MB")
-                return img_data, resize_quality
-            
-            scale_factor -= 0.05
-            logger.debug(f"Image still too large ({len(img_data) / 1024 / 1024:.2f}MB), reducing scale to {scale_factor:.2f}")
-        
-        # Phase 3: Final fallback - more aggressive but still OCR-friendly
-        logger.warning("Applying final compression strategy for large document")
-        
-        # Calculate the scale needed to approximate target size
-        # Estimate: if current is X MB at 70% scale, target scale = sqrt(4.5/X) * 0.7
-        current_size_mb = len(img_data) / 1024 / 1024
-        estimated_scale = min_scale * (max_size_bytes / 1024 / 1024 / current_size_mb) ** 0.5
-        estimated_scale = max(0.5, min(estimated_scale, min_scale))  # Keep between 50-70%
-        
-        final_width = int(original_width * estimated_scale)
-        final_height = int(original_height * estimated_scale)
-        
-        final_img = current_img.resize((final_width, final_height), Image.LANCZOS)
-        
-        # Apply unsharp mask for better text edge definition
-        final_img = final_img.filter(ImageFilter.UnsharpMask(radius=1, percent=100, threshold=2))
-        
-        output = io.BytesIO()
-        final_img.save(output, format='JPEG', quality=min_quality, optimize=True, dpi=(300, 300))
-        img_data = output.getvalue()
-        
-        logger.info(f"Final image: {final_width}x{final_height} ({estimated_scale*100:.0f}%), {len(img_data) / 1024 / 1024:.2f}MB at quality={min_quality}")
-        return img_data, min_quality
+        Convert PDF pages to high-quality JPG images optimized for OCR (max 4.5MB)
+        Pages are rendered in parallel on the PDF process pool, each worker
+        keeping one open document, and yielded as soon as each one is
+        encoded (completion order, see 'page_number'). Only a few pages are
+        rendered ahead of the consumer, so memory does not grow with the
+        page count.
 
-    def _convert_pdf_to_images(self, pdf_content, original_filename):
-        """Convert PDF to high-quality JPG images optimized for OCR with max 4.5MB size limit"""
+        Args:
+            pdf_content: PDF bytes (None when pdf_path is given)
+            original_filename: Name used for the page files
+            pdf_path: PDF on disk, opened by path instead of from memory
+        """
         if not PDF_CONVERSION_AVAILABLE:
             raise ImportError("PyMuPDF not available for PDF conversion. Install with: pip install PyMuPDF")
-        
-        # Maximum image size in bytes (4.5MB)
-        MAX_IMAGE_SIZE = 4.5 * 1024 * 1024
-        
+
         logger.info(f"Starting PDF to image conversion for: {original_filename} (max size: {MAX_IMAGE_SIZE / 1024 / 1024}MB)")
-        
-        try:
-            # Open PDF from memory
-            pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
-            converted_images = []
-            
-            logger.info(f"PDF has {len(pdf_document)} pages")
-            
-            for page_num in range(len(pdf_document)):
-                # Get page
-                page = pdf_document.load_page(page_num)
-                
-                # Convert to high-quality image for better OCR
-                # Matrix(3.0, 3.0) = 3x zoom = ~300 DPI (optimal for OCR)
-                # Higher DPI = better text recognition
-                mat = fitz.Matrix(3.0, 3.0)  # 300 DPI - optimal balance
-                
-                # Get pixmap with high quality settings
-                # alpha=False removes transparency for smaller file size
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                
-                # Convert to PIL Image for additional optimization
-                from PIL import Image
-                import io
-                
-                # Create PIL Image from pixmap
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                
-                # Apply sharpening for better OCR (optional but recommended)
-                from PIL import ImageEnhance
-                enhancer = ImageEnhance.Sharpness(img)
-                img = enhancer.enhance(1.2)  # Slight sharpening (1.0 = original)
-                
-                # Compress image to ensure it doesn't exceed 4.5MB
-                img_data, final_quality = self._compress_image_to_max_size(img, MAX_IMAGE_SIZE)
-                
-                # Generate filename for this page
-                page_filename = f"{os.path.splitext(original_filename)[0]}_page_{page_num + 1}.jpg"
-                unique_filename = self._generate_unique_filename(page_filename)
-                
-                converted_images.append({
-                    'filename': unique_filename,
-                    'content': img_data,
-                    'page_number': page_num + 1,
-                    'size': len(img_data)
-                })
-                
-                logger.debug(f"Converted page {page_num + 1} to {len(img_data) / 1024 / 1024:.2f}MB at quality={final_quality}")
-            
+
+        def open_document():
+            if pdf_path is not None:
+                return fitz.open(pdf_path)
+            return fitz.open(stream=pdf_content, filetype="pdf")
+
+        pdf_document = open_document()
+        page_count = len(pdf_document)
+        logger.info(f"PDF has {page_count} pages")
+
+        pending = list(range(page_count))
+        if page_count > 1 and PDF_RENDER_WORKERS > 0:
             pdf_document.close()
-            logger.info(f"PDF conversion completed - {len(converted_images)} images generated (max 4.5MB each)")
-            
-            return converted_images
-            
+            pdf_document = None
+            path = pdf_path
+            futures = {}
+            try:
+                if path is None:
+                    # Workers open the document from a file: the PDF is written
+                    # once instead of being pickled with every page task
+                    fd, path = tempfile.mkstemp(suffix='.pdf', prefix='upload_')
+                    with os.fdopen(fd, 'wb') as f:
+                        f.write(pdf_content)
+                pool = get_process_pool('pdf', PDF_RENDER_WORKERS)
+                to_submit = iter(list(pending))
+
+                def submit_next():
+                    page_num = next(to_submit, None)
+                    if page_num is not None:
+                        futures[pool.submit(_render_pdf_file_page, path, page_num, MAX_IMAGE_SIZE)] = page_num
+
+                for _ in range(PDF_RENDER_WORKERS * 2):
+                    submit_next()
+                while futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        page_num = futures.pop(future)
+                        img_data, final_quality = future.result()
+                        pending.remove(page_num)
+                        submit_next()
+                        yield self._page_info(original_filename, page_num, img_data, final_quality)
+            except BrokenProcessPool as e:
+                logger.warning(f"PDF render pool broken, rendering {len(pending)} pages in thread: {str(e)}")
+                reset_process_pool('pdf')
+            finally:
+                for future in futures:
+                    future.cancel()
+                if path is not None and path != pdf_path:
+                    try:
+                        os.remove(path)
+                    except OSError as cleanup_error:
+                        logger.warning(f"Error cleaning up temp file {path}: {cleanup_error}")
+
+        if pending:
+            if pdf_document is None:
+                pdf_document = open_document()
+            try:
+                for page_num in list(pending):
+                    img_data, final_quality = _render_page(pdf_document, page_num, MAX_IMAGE_SIZE)
+                    pending.remove(page_num)
+                    yield self._page_info(original_filename, page_num, img_data, final_quality)
+            finally:
+                pdf_document.close()
+
+        logger.info(f"PDF conversion completed - {page_count} images generated (max 4.5MB each)")
+
+    def _convert_pdf_to_images(self, pdf_content, original_filename):
+        """Convert PDF to high-quality JPG images optimized for OCR with max 4.5MB size limit"""
+        try:
+            converted_images = list(self._iter_pdf_pages(pdf_content, original_filename))
         except Exception as e:
             logger.error(f"Error converting PDF to images: {str(e)}")
             raise
+        return sorted(converted_images, key=lambda image_info: image_info['page_number'])
 
     def _convert_docx_to_images(self, docx_content, original_filename):
         """Convert DOCX to images via PDF intermediate"""
@@ -340,24 +353,26 @@ class FileUploadS3:
             logger.error(f"Error converting DOCX to images: {str(e)}")
             raise
 
-    def _optimize_image(self, image_content, original_filename):
+    def _optimize_image(self, image_content, original_filename, image_path=None):
         """Optimize image for better performance while maintaining quality"""
         try:
             logger.debug(f"Optimizing image: {original_filename}")
             
-            # Open image
-            image = Image.open(io.BytesIO(image_content))
+            # Resize if too large (max 2048px on longest side); decoded upright
+            # and already reduced by the JPEG decoder, straight from disk for
+            # spooled uploads
+            max_dimension = 2048
+            image = load_image(image_path if image_path is not None else image_content,
+                               max_size=(max_dimension, max_dimension))
             
             # Convert to RGB if necessary
             if image.mode in ('RGBA', 'P'):
                 image = image.convert('RGB')
             
-            # Get original dimensions
+            # Get decoded dimensions
             original_size = image.size
-            logger.debug(f"Original image size: {original_size}")
+            logger.debug(f"Decoded image size: {original_size}")
             
-            # Resize if too large (max 2048px on longest side)
-            max_dimension = 2048
             if max(original_size) > max_dimension:
                 ratio = max_dimension / max(original_size)
                 new_size = tuple(int(dim * ratio) for dim in original_size)
@@ -369,12 +384,16 @@ class FileUploadS3:
             image.save(output, format='JPEG', quality=85, optimize=True)
             optimized_content = output.getvalue()
             
-            logger.debug(f"Image optimization: {len(image_content)} -> {len(optimized_content)} bytes")
+            original_bytes = os.path.getsize(image_path) if image_path is not None else len(image_content)
+            logger.debug(f"Image optimization: {original_bytes} -> {len(optimized_content)} bytes")
             
             return optimized_content
             
         except Exception as e:
             logger.warning(f"Error optimizing image, using original: {str(e)}")
+            if image_path is not None:
+                with open(image_path, 'rb') as f:
+                    return f.read()
             return image_content
 
     def upload_file(self, file_content, filename, upload_original=True):
@@ -387,6 +406,33 @@ class FileUploadS3:
             filename: Original filename
             upload_original: If True, also uploads the original file (PDF/image) to S3
         """
+        return self._upload(filename, upload_original, file_content=file_content)
+
+    def upload_file_from_path(self, file_path, filename, upload_original=True):
+        """
+        Same as upload_file() for a file on disk (upload spooled by Django):
+        the original goes to S3 as a parallel multipart upload and the PDF is
+        opened by path, so the file is never held in memory as a whole
+
+        Args:
+            file_path: Path of the file
+            filename: Original filename
+            upload_original: If True, also uploads the original file (PDF/image) to S3
+        """
+        return self._upload(filename, upload_original, file_path=file_path)
+
+    def _upload_original(self, s3_client, key, content_type, file_content=None, file_path=None):
+        """Upload the original file, returns its size"""
+        if file_path is None:
+            call_aws('s3', s3_client.put_object,
+                     Bucket=self.bucket_name, Key=key, Body=file_content, ContentType=content_type)
+            return len(file_content)
+        # Parts of MULTIPART_CHUNK_SIZE read from disk and sent concurrently
+        call_aws('s3', s3_client.upload_file, file_path, self.bucket_name, key,
+                 ExtraArgs={'ContentType': content_type}, Config=MULTIPART_CONFIG)
+        return os.path.getsize(file_path)
+
+    def _upload(self, filename, upload_original, file_content=None, file_path=None):
         logger.info(f"Starting file upload process for: {filename} (upload_original={upload_original})")
         
         try:
@@ -405,18 +451,14 @@ class FileUploadS3:
                 original_unique_filename = self._generate_unique_filename(filename)
                 content_type = mime_type or 'application/octet-stream'
                 
-                s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=original_unique_filename,
-                    Body=file_content,
-                    ContentType=content_type
-                )
+                original_size = self._upload_original(s3_client, original_unique_filename, content_type,
+                                                      file_content=file_content, file_path=file_path)
                 
                 original_file_info = {
                     'original_filename': filename,
                     's3_filename': original_unique_filename,
                     'file_type': 'original',
-                    'size': len(file_content),
+                    'size': original_size,
                     'content_type': content_type,
                     'url': f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{original_unique_filename}"
                 }
@@ -429,18 +471,17 @@ class FileUploadS3:
                 logger.info("Processing image file")
                 
                 # Optimize image
-                optimized_content = self._optimize_image(file_content, filename)
+                optimized_content = self._optimize_image(file_content, filename, image_path=file_path)
                 
                 # Generate unique filename
                 unique_filename = self._generate_unique_filename(filename, '.jpg')
                 
                 # Upload to S3
-                s3_client.put_object(
-                    Bucket=self.bucket_name,
-                    Key=unique_filename,
-                    Body=optimized_content,
-                    ContentType='image/jpeg'
-                )
+                call_aws('s3', s3_client.put_object,
+                         Bucket=self.bucket_name,
+                         Key=unique_filename,
+                         Body=optimized_content,
+                         ContentType='image/jpeg')
                 
                 upload_results.append({
                     'original_filename': filename,
@@ -457,12 +498,15 @@ class FileUploadS3:
                 logger.info(f"Processing document file: {file_ext}")
                 
                 if file_ext == '.pdf':
-                    # Convert PDF to images
-                    converted_images = self._convert_pdf_to_images(file_content, filename)
+                    # Pages are uploaded as they come out of the render pool
+                    converted_images = self._iter_pdf_pages(file_content, filename, pdf_path=file_path)
                     
                 elif file_ext in ['.docx', '.doc']:
                     # Convert DOCX to images (Windows only)
                     if RUNNING_ON_WINDOWS:
+                        if file_content is None:
+                            with open(file_path, 'rb') as f:
+                                file_content = f.read()
                         converted_images = self._convert_docx_to_images(file_content, filename)
                     else:
                         # On Linux, DOCX conversion is not supported
@@ -477,25 +521,39 @@ class FileUploadS3:
                 else:
                     raise ValueError(f"Unsupported document type: {file_ext}")
                 
-                # Upload all converted images
-                for image_info in converted_images:
-                    s3_client.put_object(
-                        Bucket=self.bucket_name,
-                        Key=image_info['filename'],
-                        Body=image_info['content'],
-                        ContentType='image/jpeg'
-                    )
-                    
-                    upload_results.append({
-                        'original_filename': filename,
-                        's3_filename': image_info['filename'],
-                        'file_type': 'converted_image',
-                        'page_number': image_info['page_number'],
-                        'size': image_info['size'],
-                        'url': f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{image_info['filename']}"
-                    })
-                    
-                    logger.info(f"Converted image uploaded: {image_info['filename']}")
+                # Upload each converted image as soon as it is available; at
+                # most 2 x UPLOAD_WORKERS pages wait in memory for their upload
+                page_results = []
+                in_flight = threading.BoundedSemaphore(UPLOAD_WORKERS * 2)
+                with ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload') as uploader:
+                    uploads = []
+                    for image_info in converted_images:
+                        in_flight.acquire()
+                        # The upload task holds the only reference to the bytes
+                        content = image_info.pop('content')
+                        upload = uploader.submit(
+                            call_aws, 's3', s3_client.put_object,
+                            Bucket=self.bucket_name,
+                            Key=image_info['filename'],
+                            Body=content,
+                            ContentType='image/jpeg'
+                        )
+                        content = None
+                        upload.add_done_callback(lambda _: in_flight.release())
+                        uploads.append((image_info, upload))
+                    for image_info, upload in uploads:
+                        upload.result()
+                        page_results.append({
+                            'original_filename': filename,
+                            's3_filename': image_info['filename'],
+                            'file_type': 'converted_image',
+                            'page_number': image_info['page_number'],
+                            'size': image_info['size'],
+                            'url': f"https://{self.bucket_name}.s3.{self.region_name}.amazonaws.com/{image_info['filename']}"
+                        })
+                        logger.info(f"Converted image uploaded: {image_info['filename']}")
+
+                upload_results.extend(sorted(page_results, key=lambda result: result['page_number']))
             
             logger.info(f"Upload process completed - {len(upload_results)} files uploaded")
             
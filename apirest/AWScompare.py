@@ -1,12 +1,32 @@
-import boto3
-import pandas as pd
+from apirest.AWSClients import get_client
+from concurrent.futures import ThreadPoolExecutor
 from decouple import config
 from apirest.models import puntaje_face
+from apirest.ThresholdCache import get_threshold
+from apirest.Results import FaceResult, ResultList, replace_no_match
 import logging
+import threading
 
 # Configure logger for AWS Face operations
 logger = logging.getLogger('apirest.face')
 
+# Opt-in: run the mask, eyewear and comparison calls at the same time. The
+# comparison is speculative, so a selfie rejected by the checks still pays
+# a billed CompareFaces call
+CONCURRENT_COMPARE = config('FACE_COMPARE_CONCURRENT', default=False, cast=bool)
+# Three calls per request, four requests at once; more wait in the queue
+COMPARE_WORKERS = config('FACE_COMPARE_WORKERS', default=12, cast=int)
+_compare_executor = None
+_compare_executor_lock = threading.Lock()
+
+
+def _get_compare_executor():
+    global _compare_executor
+    with _compare_executor_lock:
+        if _compare_executor is None:
+            _compare_executor = ThreadPoolExecutor(max_workers=COMPARE_WORKERS, thread_name_prefix='face-compare')
+        return _compare_executor
+
 class consult46:
 
     source_file = ''
@@ -42,34 +62,70 @@ class consult46:
             logger.debug(f"Configuring Rekognition client for region: {region_name}, bucket: {bucket}")
             
             # Initialize Rekognition client
-            client = boto3.client('rekognition',
+            client = get_client('rekognition',
                                   aws_access_key_id=aws_access_key_id,
                                   aws_secret_access_key=aws_secret_access_key,
                                   region_name=region_name)
             
-            # Initialize response dataframe
-            indices = [0]
+            # Initialize response rows
             comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "No Match"}
             
-            logger.debug("Fetching face comparison threshold from database")
-            puntos = int(puntaje_face.objects.get(pk=1).puntaje_Max)
+            logger.debug("Fetching face comparison threshold")
+            puntos = get_threshold(puntaje_face)
             logger.debug(f"Face comparison threshold: {puntos}")
             
-            df = pd.DataFrame(data=comparar, index=indices)
+            rows = ResultList([FaceResult(**comparar)])
             error = False
 
             # OPTIMIZACIÓN: Usar imágenes directamente del bucket S3 sin descargar
             logger.info("Processing images directly from S3 bucket (no local downloads)")
-            
-            # 1. Detectar equipos de protección (mascarillas) usando S3Object
-            logger.debug(f"Checking for face masks in source image: {sourceFile}")
-            response2 = client.detect_protective_equipment(
-                Image={"S3Object": {"Bucket": bucket, "Name": sourceFile}},
-                SummarizationAttributes={
-                    'MinConfidence': 80,
-                    'RequiredEquipmentTypes': ['FACE_COVER']
-                }
-            )
+            source_image = {"S3Object": {"Bucket": bucket, "Name": sourceFile}}
+            target_image = {"S3Object": {"Bucket": bucket, "Name": targetFile}}
+
+            def detect_masks():
+                return client.detect_protective_equipment(
+                    Image=source_image,
+                    SummarizationAttributes={
+                        'MinConfidence': 80,
+                        'RequiredEquipmentTypes': ['FACE_COVER']
+                    }
+                )
+
+            def detect_faces():
+                return client.detect_faces(Image=source_image, Attributes=['ALL'])
+
+            def compare():
+                return client.compare_faces(
+                    SimilarityThreshold=80,
+                    SourceImage=source_image,
+                    TargetImage=target_image
+                )
+
+            compare_future = None
+            if CONCURRENT_COMPARE:
+                # The three calls go out together; the comparison is only
+                # read when the mask and eyewear checks pass
+                logger.debug(f"Running mask, eyewear and comparison calls concurrently for {sourceFile}")
+                executor = _get_compare_executor()
+                masks_future = executor.submit(detect_masks)
+                faces_future = executor.submit(detect_faces)
+                compare_future = executor.submit(compare)
+                try:
+                    response2 = masks_future.result()
+                    response3 = faces_future.result()
+                except Exception:
+                    # Only a comparison still queued is cancelled; one
+                    # already started runs to the end and is ignored
+                    compare_future.cancel()
+                    raise
+            else:
+                # 1. Detectar equipos de protección (mascarillas) usando S3Object
+                logger.debug(f"Checking for face masks in source image: {sourceFile}")
+                response2 = detect_masks()
+
+                # 2. Detectar accesorios faciales (lentes) usando S3Object
+                logger.debug(f"Checking for eyewear in source image: {sourceFile}")
+                response3 = detect_faces()
 
             # Verificar si hay mascarillas
             for person in response2['Persons']:
@@ -80,34 +136,25 @@ class consult46:
                             logger.warning(f"Face mask detected in {sourceFile}")
                             error = True
                             comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "Mascarillas"}
-                            df = df[(df['coincidencia'] != 'No Match')]
-                            df = pd.concat([df, pd.DataFrame([comparar])], ignore_index=True)
+                            rows = replace_no_match(rows, FaceResult(**comparar))
                             break
 
-            # 2. Detectar accesorios faciales (lentes) usando S3Object
-            logger.debug(f"Checking for eyewear in source image: {sourceFile}")
-            response3 = client.detect_faces(
-                Image={"S3Object": {"Bucket": bucket, "Name": sourceFile}},
-                Attributes=['ALL']
-            )
-            
             for faceDetail in response3['FaceDetails']:
                 if faceDetail['Eyeglasses']['Value'] is True or faceDetail['Sunglasses']['Value'] is True:
                     logger.warning(f"Eyewear detected in {sourceFile}")
                     error = True
                     comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "Lentes"}
-                    df = df[(df['coincidencia'] != 'No Match')]
-                    df = pd.concat([df, pd.DataFrame([comparar])], ignore_index=True)
+                    rows = replace_no_match(rows, FaceResult(**comparar))
                     break
 
             # 3. Si no hay errores, realizar comparación facial usando S3Objects
-            if not error:
+            if error and compare_future is not None:
+                # Speculative comparison not needed: cancelled if still
+                # queued, otherwise its (billed) result is ignored
+                compare_future.cancel()
+            elif not error:
                 logger.info(f"Performing face comparison between {sourceFile} and {targetFile}")
-                response = client.compare_faces(
-                    SimilarityThreshold=80,
-                    SourceImage={"S3Object": {"Bucket": bucket, "Name": sourceFile}},
-                    TargetImage={"S3Object": {"Bucket": bucket, "Name": targetFile}}
-                )
+                response = compare_future.result() if compare_future is not None else compare()
 
                 # Procesar resultados de comparación
                 matches_found = False
@@ -118,8 +165,7 @@ class consult46:
                     if int(similarity) >= puntos:
                         logger.info(f"Face match above threshold: {similarity}% >= {puntos}%")
                         nuevo_registro = {'cod': "200_OK", 'coincidencia': f"{similarity:.2f}% confidence"}
-                        df = pd.concat([df, pd.DataFrame([nuevo_registro])], ignore_index=True)
-                        df = df[(df['coincidencia'] != 'No Match')]
+                        rows = replace_no_match(rows, FaceResult(**nuevo_registro))
                         matches_found = True
                         break
 
@@ -127,9 +173,8 @@ class consult46:
                     logger.info("No face matches found above threshold")
                     # Mantener el resultado "No Match" original
             
-            # Limpiar DataFrame final
-            self.comparar = df
-            logger.info(f"Face comparison completed - Final result: {df.iloc[-1]['coincidencia'] if not df.empty else 'No results'}")
+            self.comparar = rows
+            logger.info(f"Face comparison completed - Final result: {rows[-1].coincidencia if rows else 'No results'}")
             
             return comparar
 
@@ -142,8 +187,6 @@ class consult46:
                 'cod': '500_AWS_Error',
                 'coincidencia': f'Error: {str(e)}'
             }
-            indices = [0]
-            df_error = pd.DataFrame([error_response], index=indices)
-            self.comparar = df_error
+            self.comparar = ResultList([FaceResult(**error_response)])
             return error_response
 
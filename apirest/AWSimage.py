@@ -1,12 +1,60 @@
-import boto3
-import pandas as pd
+from apirest.AWSClients import get_client
 from decouple import config
 from apirest.models import puntaje_face
+from apirest.ThresholdCache import get_threshold
+from apirest.Results import FaceResult, ResultList, replace_no_match
 import logging
 
 # Configure logger for AWS Image operations
 logger = logging.getLogger('apirest.image')
 
+# Fast mode: one DetectFaces call per selfie, the PPE call only runs when the
+# face may be covered (FaceOccluded true or not confident enough)
+FAST_VALIDATION = config('SELFIE_FAST_VALIDATION', default=False, cast=bool)
+OCCLUSION_CONFIDENCE = config('SELFIE_OCCLUSION_CONFIDENCE', default=90, cast=float)
+
+NO_SELFIE_ERROR = {'cod': "400_Bad_Quality_image", 'coincidencia': "no es una Selfie válida"}
+MASK_ERROR = {'cod': "400_Bad_Quality_image", 'coincidencia': "No debe usar mascarillas en la selfie"}
+
+
+def _face_covers(response):
+    """FACE_COVER detections covering the face (>95%), first one per body part"""
+    for person in response['Persons']:
+        for body_part in person['BodyParts']:
+            for ppe_item in body_part['EquipmentDetections']:
+                if (ppe_item['Type'] == 'FACE_COVER' and
+                    ppe_item['CoversBodyPart']['Value'] is True and
+                    ppe_item['Confidence'] > 95):
+                    yield ppe_item
+                    break
+
+
+def _face_quality_error(face_details):
+    """Error row for the first face that is too dark, unsure or wears glasses"""
+    for faceDetail in face_details:
+        if faceDetail['Quality']['Brightness'] < 40:
+            logger.warning(f"Low brightness detected: {faceDetail['Quality']['Brightness']}")
+            return {'cod': "400_Bad_Quality_image",
+                    'coincidencia': "Tome a selfie en un lugar mas iluminado"}
+        if faceDetail['Confidence'] < 95:
+            logger.warning(f"Low face confidence: {faceDetail['Confidence']}%")
+            return {'cod': "400_Bad_Quality_image",
+                    'coincidencia': "debe ser una foto de un rostro"}
+        if faceDetail['Eyeglasses']['Value'] or faceDetail['Sunglasses']['Value']:
+            logger.warning("Eyewear detected in selfie")
+            return {'cod': "400_Bad_Quality_image",
+                    'coincidencia': "No se acepta Selfie con Lentes"}
+    return None
+
+
+def _occlusion_ambiguous(faceDetail):
+    """True unless DetectFaces is confident the face is not occluded"""
+    occluded = faceDetail.get('FaceOccluded')
+    if not occluded:
+        return True
+    return occluded['Value'] or occluded['Confidence'] < OCCLUSION_CONFIDENCE
+
+
 class consult47:
 
 
@@ -34,100 +82,36 @@ class consult47:
         try:
             # Initialize Rekognition client
             logger.debug("Configuring AWS Rekognition client")
-            client = boto3.client('rekognition',
+            client = get_client('rekognition',
                                   aws_access_key_id=self.aws_access_key_id,
                                   aws_secret_access_key=self.aws_secret_access_key,
                                   region_name=self.region_name)
 
-            # Initialize response dataframe
-            indices = [0]
+            # Initialize response rows
             comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "No Match"}
             
-            logger.debug("Fetching validation threshold from database")
-            puntos = int(puntaje_face.objects.get(pk=1).puntaje_Max)
+            logger.debug("Fetching validation threshold")
+            puntos = get_threshold(puntaje_face)
             logger.debug(f"Image validation threshold: {puntos}")
             
-            df = pd.DataFrame(data=comparar, index=indices)
-            error = False
+            rows = ResultList([FaceResult(**comparar)])
 
             # OPTIMIZACIÓN: Usar imagen directamente del bucket S3 sin descargar
             logger.info(f"Processing image directly from S3 bucket: {self.bucket}/{sourceFile}")
             
-            # 1. Detectar equipos de protección (mascarillas) usando S3Object
-            logger.debug("Checking for face masks and protective equipment")
-            response2 = client.detect_protective_equipment(
-                Image={"S3Object": {"Bucket": self.bucket, "Name": sourceFile}},
-                SummarizationAttributes={
-                    'MinConfidence': 20,
-                    'RequiredEquipmentTypes': ['FACE_COVER']
-                }
-            )
-
-            # Verificar si hay personas detectadas
-            if len(response2['Persons']) < 1:
-                logger.warning(f"No persons detected in image: {sourceFile}")
-                comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "no es una Selfie válida"}
-                df = df[(df['coincidencia'] != 'No Match')]
-                df = pd.concat([df, pd.DataFrame([comparar])], ignore_index=True)
-                error = True
+            if FAST_VALIDATION:
+                rows, comparar, error = self._validate_fast(client, sourceFile, rows, comparar)
             else:
-                # Verificar mascarillas en personas detectadas
-                for person in response2['Persons']:
-                    for body_part in person['BodyParts']:
-                        ppe_items = body_part['EquipmentDetections']
-                        for ppe_item in ppe_items:
-                            if (ppe_item['Type'] == 'FACE_COVER' and 
-                                ppe_item['CoversBodyPart']['Value'] is True and 
-                                ppe_item['Confidence'] > 95):
-                                logger.warning(f"Face mask detected in {sourceFile} with confidence {ppe_item['Confidence']}%")
-                                error = True
-                                comparar = {'cod': "400_Bad_Quality_image", 'coincidencia': "No debe usar mascarillas en la selfie"}
-                                df = df[(df['coincidencia'] != 'No Match')]
-                                df = pd.concat([df, pd.DataFrame([comparar])], ignore_index=True)
-                                break
-
-                # 2. Detectar características faciales y calidad usando S3Object
-                logger.debug("Analyzing face details and image quality")
-                response3 = client.detect_faces(
-                    Image={"S3Object": {"Bucket": self.bucket, "Name": sourceFile}},
-                    Attributes=['ALL']
-                )
-                
-                for faceDetail in response3['FaceDetails']:
-                    has_eyewear = faceDetail['Eyeglasses']['Value'] or faceDetail['Sunglasses']['Value']
-                    low_brightness = faceDetail['Quality']['Brightness'] < 40
-                    low_confidence = faceDetail['Confidence'] < 95
-                    
-                    if has_eyewear or low_brightness or low_confidence:
-                        error = True
-                        
-                        if low_brightness:
-                            logger.warning(f"Low brightness detected: {faceDetail['Quality']['Brightness']}")
-                            comparar = {'cod': "400_Bad_Quality_image",
-                                      'coincidencia': "Tome a selfie en un lugar mas iluminado"}
-                        elif low_confidence:
-                            logger.warning(f"Low face confidence: {faceDetail['Confidence']}%")
-                            comparar = {'cod': "400_Bad_Quality_image", 
-                                      'coincidencia': "debe ser una foto de un rostro"}
-                        else:  # has_eyewear
-                            logger.warning("Eyewear detected in selfie")
-                            comparar = {'cod': "400_Bad_Quality_image", 
-                                      'coincidencia': "No se acepta Selfie con Lentes"}
-                        
-                        df = df[(df['coincidencia'] != 'No Match')]
-                        df = pd.concat([df, pd.DataFrame([comparar])], ignore_index=True)
-                        break
+                rows, comparar, error = self._validate_full(client, sourceFile, rows, comparar)
 
             # 3. Si no hay errores, marcar como válida
             if not error:
                 logger.info(f"Image validation successful for: {sourceFile}")
                 nuevo_registro = {'cod': "200_OK", 'coincidencia': 'Selfie Sin Error'}
-                df = pd.concat([df, pd.DataFrame([nuevo_registro])], ignore_index=True)
-                df = df[(df['coincidencia'] != 'No Match')]
+                rows = replace_no_match(rows, FaceResult(**nuevo_registro))
 
-            # Limpiar DataFrame final
-            self.comparar = df
-            logger.info(f"Image validation completed - Result: {df.iloc[-1]['coincidencia'] if not df.empty else 'No results'}")
+            self.comparar = rows
+            logger.info(f"Image validation completed - Result: {rows[-1].coincidencia if rows else 'No results'}")
             
             return comparar
 
@@ -140,7 +124,93 @@ class consult47:
                 'cod': '500_AWS_Error',
                 'coincidencia': f'Error: {str(e)}'
             }
-            indices = [0]
-            df_error = pd.DataFrame([error_response], index=indices)
-            self.comparar = df_error
+            self.comparar = ResultList([FaceResult(**error_response)])
             return error_response
+
+    def _validate_full(self, client, sourceFile, rows, comparar):
+        """PPE call (person and mask) followed by DetectFaces (quality and eyewear)"""
+        error = False
+
+        # 1. Detectar equipos de protección (mascarillas) usando S3Object
+        logger.debug("Checking for face masks and protective equipment")
+        response2 = client.detect_protective_equipment(
+            Image={"S3Object": {"Bucket": self.bucket, "Name": sourceFile}},
+            SummarizationAttributes={
+                'MinConfidence': 20,
+                'RequiredEquipmentTypes': ['FACE_COVER']
+            }
+        )
+
+        # Verificar si hay personas detectadas
+        if len(response2['Persons']) < 1:
+            logger.warning(f"No persons detected in image: {sourceFile}")
+            comparar = NO_SELFIE_ERROR
+            rows = replace_no_match(rows, FaceResult(**comparar))
+            error = True
+        else:
+            # Verificar mascarillas en personas detectadas
+            for ppe_item in _face_covers(response2):
+                logger.warning(f"Face mask detected in {sourceFile} with confidence {ppe_item['Confidence']}%")
+                error = True
+                comparar = MASK_ERROR
+                rows = replace_no_match(rows, FaceResult(**comparar))
+
+            # 2. Detectar características faciales y calidad usando S3Object
+            logger.debug("Analyzing face details and image quality")
+            response3 = client.detect_faces(
+                Image={"S3Object": {"Bucket": self.bucket, "Name": sourceFile}},
+                Attributes=['ALL']
+            )
+            
+            quality_error = _face_quality_error(response3['FaceDetails'])
+            if quality_error:
+                error = True
+                comparar = quality_error
+                rows = replace_no_match(rows, FaceResult(**comparar))
+
+        return rows, comparar, error
+
+    def _validate_fast(self, client, sourceFile, rows, comparar):
+        """
+        Single DetectFaces call answering person, brightness, confidence and
+        eyewear; the PPE call only runs when a face-cover signal is ambiguous
+        """
+        error = False
+        image = {"S3Object": {"Bucket": self.bucket, "Name": sourceFile}}
+
+        logger.debug("Fast validation: analyzing face details and image quality")
+        face_details = client.detect_faces(Image=image, Attributes=['ALL'])['FaceDetails']
+
+        # Cheapest rejections first: no face, then quality from the same response
+        if not face_details:
+            logger.warning(f"No faces detected in image: {sourceFile}")
+            error = True
+            comparar = NO_SELFIE_ERROR
+            rows = replace_no_match(rows, FaceResult(**comparar))
+            return rows, comparar, error
+
+        quality_error = _face_quality_error(face_details)
+        if quality_error:
+            error = True
+            comparar = quality_error
+            rows = replace_no_match(rows, FaceResult(**comparar))
+            return rows, comparar, error
+
+        if any(_occlusion_ambiguous(faceDetail) for faceDetail in face_details):
+            logger.debug("Face occlusion is ambiguous, checking for face masks")
+            response2 = client.detect_protective_equipment(
+                Image=image,
+                SummarizationAttributes={
+                    'MinConfidence': 20,
+                    'RequiredEquipmentTypes': ['FACE_COVER']
+                }
+            )
+            for ppe_item in _face_covers(response2):
+                logger.warning(f"Face mask detected in {sourceFile} with confidence {ppe_item['Confidence']}%")
+                error = True
+                comparar = MASK_ERROR
+                rows = replace_no_match(rows, FaceResult(**comparar))
+        else:
+            logger.debug("Face not occluded, skipping protective equipment check")
+
+        return rows, comparar, error
@@ -1,12 +1,12 @@
 # -*- coding: utf-8 -*-
-import boto3
-import pandas as pd
-from PIL import Image
+from apirest.AWSClients import get_client
 from os import remove
-import io
 from unidecode import unidecode
 from decouple import config
 from apirest.models import puntaje_ocr
+from apirest.ResultCache import cached_call, etag_digest
+from apirest.BatchExecutor import run_ordered, call_aws, PageTimeout
+from apirest.ImageLoader import read_header
 import logging
 import json
 
@@ -69,24 +69,24 @@ class consult45Raw:
         try:
             # Configurar cliente S3 con credenciales
             logger.debug("Configuring S3 client with credentials for Raw OCR")
-            s3_client = boto3.client('s3',
+            s3_client = get_client('s3',
                                     aws_access_key_id=config('AWS_ACCESS_KEY_ID'),
                                     aws_secret_access_key=config('AWS_SECRET_ACCESS_KEY'),
                                     region_name=config('AWS_DEFAULT_REGION', default='us-east-1'))
             
-            photoviene = 'x' + photo
-            photova = 'xx' + photo
-            
-            logger.debug(f"Raw OCR generated temp filenames: {photoviene}, {photova}")
-            
-            # Verificar si el archivo existe en S3
-            logger.debug(f"Raw OCR checking if file exists in S3: {bucket}/{photo}")
-            s3_client.head_object(Bucket=bucket, Key=photo)
-            logger.info(f"Raw OCR file found in S3, downloading: {bucket}/{photo}")
-            
-            # Descargar archivo desde S3
-            s3_client.download_file(bucket, photo, photoviene)
-            logger.info(f"Raw OCR successfully downloaded file to: {photoviene}")
+            # Descargar archivo desde S3 directamente a memoria (sin archivos
+            # temporales, varias páginas pueden procesarse a la vez). El
+            # cuerpo solo se lee si el ETag no está ya en la caché
+            logger.debug(f"Raw OCR fetching file from S3: {bucket}/{photo}")
+            s3_object = call_aws('s3', s3_client.get_object, Bucket=bucket, Key=photo)
+            digest = etag_digest(bucket, s3_object.get('ETag'))
+            downloaded = []
+
+            def read_image():
+                if not downloaded:
+                    downloaded.append(s3_object['Body'].read())
+                    logger.info(f"Raw OCR successfully fetched {len(downloaded[0])} bytes from {bucket}/{photo}")
+                return downloaded[0]
             
         except Exception as e:
             logger.error(f"Raw OCR error accessing S3 file {bucket}/{photo}: {str(e)}")
@@ -105,21 +105,19 @@ class consult45Raw:
             }
         
         try:
-            # Procesar imagen original sin modificaciones
-            logger.debug(f"Raw OCR opening original image file: {photoviene}")
-            image = Image.open(photoviene)
-            ancho = image.size
+            # Procesar imagen original sin modificaciones (solo se lee el
+            # encabezado, guardado en caché junto a la respuesta de Rekognition)
+            logger.debug(f"Raw OCR reading original image header: {photo}")
+            _, ancho, _ = cached_call('image.header', digest, None, lambda: read_header(read_image()))
             logger.debug(f"Raw OCR original image dimensions: {ancho}")
             
             # Usar la imagen original sin redimensionar ni rotar
             logger.debug("Raw OCR using original image without processing")
-            with open(photoviene, 'rb') as image_file:
-                image_binary = image_file.read()
             
             logger.info(f"Raw OCR using original image file: {photo} (no processing applied)")
                 
         except Exception as e:
-            logger.error(f"Raw OCR error processing image {photoviene}: {str(e)}")
+            logger.error(f"Raw OCR error processing image {photo}: {str(e)}")
             logger.error(f"Raw OCR exception type: {type(e).__name__}")
             
             return {
@@ -129,7 +127,7 @@ class consult45Raw:
                 'raw_response': None,
                 'image_info': {
                     'photo': photo,
-                    'temp_file': photoviene,
+                    'temp_file': None,
                     'original_dimensions': str(ancho) if 'ancho' in locals() else 'unknown'
                 }
             }
@@ -137,7 +135,7 @@ class consult45Raw:
         try:
             # Configurar cliente Rekognition con credenciales
             logger.debug("Raw OCR configuring AWS Rekognition client")
-            rekognition_client = boto3.client('rekognition',
+            rekognition_client = get_client('rekognition',
                                             aws_access_key_id=config('AWS_REKOGNITION_ACCESS_KEY_ID'),
                                             aws_secret_access_key=config('AWS_REKOGNITION_SECRET_ACCESS_KEY'),
                                             region_name=config('AWS_DEFAULT_REGION', default='us-east-1'))
@@ -156,18 +154,11 @@ class consult45Raw:
         try:
             # Llamar a AWS Rekognition
             logger.info("Raw OCR starting AWS Rekognition text detection")
-            raw_response = rekognition_client.detect_text(Image={'Bytes': image_binary})
+            # Same S3 object (ETag) already analyzed: reuse its response
+            raw_response = cached_call('rekognition.detect_text', digest, {'image': 'original'},
+                                       lambda: self._detect_text(rekognition_client, read_image()))
             logger.info(f"Raw OCR Rekognition response received with {len(raw_response.get('TextDetections', []))} text detections")
             
-            # Limpiar archivos temporales (opcional)
-            try:
-                import os
-                if os.path.exists(photoviene):
-                    os.remove(photoviene)
-                    logger.debug(f"Raw OCR cleaned up temporary file: {photoviene}")
-            except Exception as cleanup_error:
-                logger.warning(f"Raw OCR could not clean up temp file {photoviene}: {cleanup_error}")
-            
             # Devolver respuesta completa
             result = {
                 'success': True,
@@ -178,7 +169,7 @@ class consult45Raw:
                     'photo': photo,
                     'bucket': bucket,
                     'temp_files': {
-                        'original': photoviene,
+                        'original': None,  # La imagen se procesa en memoria
                         'processed': None  # No se procesó la imagen
                     },
                     'image_dimensions': {
@@ -205,14 +196,21 @@ class consult45Raw:
                 'debug_info': {
                     'photo': photo,
                     'bucket': bucket,
-                    'image_binary_size': len(image_binary) if 'image_binary' in locals() else 0
+                    'image_binary_size': len(downloaded[0]) if downloaded else 0
                 }
             }
+        finally:
+            # Sin leer si todo salió de la caché
+            s3_object['Body'].close()
+
+    def _detect_text(self, rekognition_client, image_binary):
+        return call_aws('rekognition', rekognition_client.detect_text, Image={'Bytes': image_binary})
 
     def detect_text_batch(self, file_list, bucket):
         """
-        Procesa múltiples archivos de forma secuencial y combina los resultados
-        Útil para PDFs divididos en páginas
+        Procesa múltiples archivos en paralelo (BATCH_WORKERS a la vez, con
+        límite de peticiones por servicio AWS) y combina los resultados en
+        el orden de file_list. Útil para PDFs divididos en páginas
         """
         logger.info(f"Starting batch Raw OCR processing for {len(file_list)} files")
         
@@ -238,12 +236,18 @@ class consult45Raw:
             }
         }
         
-        for index, filename in enumerate(file_list):
+        def process_page(index, filename):
             logger.info(f"Processing file {index + 1}/{len(file_list)}: {filename}")
+            return self.detect_text_raw(filename, bucket)
+        
+        outcomes = run_ordered(process_page, file_list)
+        
+        for index, filename in enumerate(file_list):
+            single_result, page_error = outcomes[index]
             
             try:
-                # Procesar archivo individual
-                single_result = self.detect_text_raw(filename, bucket)
+                if page_error is not None:
+                    raise page_error
                 
                 if single_result['success']:
                     # Agregar texto detectado al resultado combinado
@@ -303,7 +307,7 @@ class consult45Raw:
                     'filename': filename,
                     'page_number': index + 1,
                     'error': str(e),
-                    'error_code': '500_Processing_Error'
+                    'error_code': '504_Page_Timeout' if isinstance(e, PageTimeout) else '500_Processing_Error'
                 }
                 batch_results['errors'].append(error_info)
                 batch_results['metadata']['processed_files'].append({
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Async variants of the AWS-bound views for ASGI deployments
+
+Under ASGI, Django runs every sync view on one shared thread, so a slow
+Rekognition/Textract call would stall all traffic of the process. The async
+variants hand the existing DRF view (validation, AWS calls, response) to a
+dedicated thread pool and await it, leaving the event loop free: one worker
+process holds up to AWS_ASYNC_WORKERS in-flight AWS requests.
+
+Enabled with ASYNC_AWS_VIEWS=True, to be used with an ASGI server:
+    gunicorn -k uvicorn.workers.UvicornWorker apibase.asgi:application
+Streaming (NDJSON) views go through streaming_view(): their generators are
+consumed as async iterators, each step on the executor, so a stream is
+sent as it is produced instead of being buffered by Django's sync
+iteration on the shared thread.
+Raise AWS_MAX_POOL_CONNECTIONS to AWS_ASYNC_WORKERS so the shared boto3
+clients keep one connection per in-flight call.
+"""
+
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from decouple import config
+from django.db import close_old_connections
+
+logger = logging.getLogger('apirest.aws')
+
+ASYNC_VIEWS = config('ASYNC_AWS_VIEWS', default=False, cast=bool)
+ASYNC_WORKERS = config('AWS_ASYNC_WORKERS', default=200, cast=int)
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='aws-async')
+    return _executor
+
+
+def _run_closing_connections(func, *args, **kwargs):
+    # Executor threads are not covered by the request_started/finished
+    # signals that normally recycle database connections
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Await a blocking (AWS-bound) call run on the dedicated executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(_run_closing_connections, func, *args, **kwargs))
+
+
+async def iterate_blocking(iterable):
+    """Async iterator over a blocking iterable, each step run on the executor"""
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await run_blocking(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def async_view(view_class, **initkwargs):
+    """Async Django view running a DRF view class on the AWS executor"""
+    sync_view = view_class.as_view(**initkwargs)
+
+    def handle(request, *args, **kwargs):
+        response = sync_view(request, *args, **kwargs)
+        # Render in the executor too, not on the event loop thread
+        if hasattr(response, 'render') and not response.is_rendered:
+            response.render()
+        return response
+
+    async def view(request, *args, **kwargs):
+        return await run_blocking(handle, request, *args, **kwargs)
+
+    view.__name__ = view_class.__name__
+    view.__doc__ = view_class.__doc__
+    view.view_class = view_class
+    # DRF views handle CSRF themselves (csrf_exempt() would hide the coroutine)
+    view.csrf_exempt = True
+    return view
+
+
+def aws_view(view_class, **initkwargs):
+    """URL callback of an AWS-bound view: async variant when ASYNC_AWS_VIEWS is set"""
+    if ASYNC_VIEWS:
+        return async_view(view_class, **initkwargs)
+    return view_class.as_view(**initkwargs)
+
+
+def streaming_view(view):
+    """
+    URL callback of a view that returns a StreamingHttpResponse
+
+    With ASYNC_AWS_VIEWS the view runs on the executor and a sync stream is
+    turned into an async one (iterate_blocking); streams the view already
+    made async are served as they are.
+    """
+    if not ASYNC_VIEWS:
+        return view
+
+    async def async_streaming(request, *args, **kwargs):
+        response = await run_blocking(view, request, *args, **kwargs)
+        if response.streaming:
+            if not response.is_async:
+                response.streaming_content = iterate_blocking(response.streaming_content)
+        elif hasattr(response, 'render') and not response.is_rendered:
+            await run_blocking(response.render)
+        return response
+
+    async_streaming.__name__ = getattr(view, '__name__', 'streaming_view')
+    async_streaming.__doc__ = view.__doc__
+    async_streaming.csrf_exempt = True
+    return async_streaming
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded-concurrency execution of batch pages
+
+run_ordered() processes the pages of a batch on a small thread pool and
+hands the results back in page order. Pages still running when the batch
+deadline expires are reported as timed out instead of holding up the
+response, and make no further AWS calls (call_aws raises PageTimeout);
+page_time_left() bounds their other waits, such as process pool results.
+throttle() applies a per-AWS-service request rate shared by every
+batch of the worker process, so parallel batches stay within the account
+quotas (Rekognition/Textract TPS) instead of piling up throttling errors.
+batch_context() lets a background job follow the progress of its pages and
+use its own deadline. get_process_pool() keeps the CPU-bound stages (image
+preprocessing, PDF rendering) on persistent worker processes.
+"""
+
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from concurrent.futures import TimeoutError as FuturesTimeout
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from decouple import config
+
+logger = logging.getLogger('apirest.aws')
+
+BATCH_WORKERS = config('BATCH_WORKERS', default=8, cast=int)
+# Seconds a whole batch may take, kept under the gunicorn timeout (120s)
+BATCH_TIMEOUT = config('BATCH_TIMEOUT', default=100, cast=float)
+
+# Requests per second per service and worker process, 0 = unlimited
+RATE_LIMITS = {
+    's3': config('AWS_RATE_LIMIT_S3', default=0, cast=float),
+    'rekognition': config('AWS_RATE_LIMIT_REKOGNITION', default=25, cast=float),
+    'textract': config('AWS_RATE_LIMIT_TEXTRACT', default=10, cast=float),
+}
+
+
+# (progress callback, timeout) of the batches started by this thread/task
+_context = ContextVar('batch_context', default=(None, None))
+# Set once the batch of the page run by this thread is past its deadline
+_page_expired = ContextVar('page_expired', default=None)
+# time.monotonic() deadline of that batch, None without one
+_page_deadline = ContextVar('page_deadline', default=None)
+
+
+@contextmanager
+def batch_context(progress=None, timeout=None):
+    """
+    Settings for the batches run inside the block
+
+    Args:
+        progress: Called as progress(done, total) in the calling thread
+                  every time a page finishes
+        timeout: Deadline of each batch, replaces BATCH_TIMEOUT
+    """
+    token = _context.set((progress, timeout))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def _wait_reporting(futures, timeout, progress):
+    done = set()
+    try:
+        for future in as_completed(futures, timeout=timeout or None):
+            done.add(future)
+            progress(len(done), len(futures))
+    except FuturesTimeout:
+        pass
+    return done, [future for future in futures if future not in done]
+
+
+class PageTimeout(Exception):
+    """A page did not finish before the batch deadline"""
+
+
+class RateLimiter:
+    """Token bucket: `rate` requests per second with bursts of up to `rate`"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.capacity = max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def throttle(service):
+    """Block until a request to `service` fits in its configured rate"""
+    rate = RATE_LIMITS.get(service, 0)
+    if rate <= 0:
+        return
+    limiter = _limiters.get(service)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.setdefault(service, RateLimiter(rate))
+    limiter.acquire()
+
+
+def call_aws(service, func, *args, **kwargs):
+    """
+    Rate-limited AWS call
+
+    Throttling errors are retried by the client only (AWSClients, adaptive
+    mode with AWS_MAX_ATTEMPTS), so there is a single retry layer. A page
+    whose batch is past its deadline raises PageTimeout instead of calling.
+
+    Args:
+        service: 's3', 'rekognition', 'textract' (rate limit to apply)
+        func: Bound client method, e.g. textract_client.analyze_document
+
+    Returns:
+        The response of func(*args, **kwargs)
+    """
+    expired = _page_expired.get()
+    if expired is not None and expired.is_set():
+        raise PageTimeout(f'{service} call skipped, the batch deadline has passed')
+    throttle(service)
+    if expired is not None and expired.is_set():
+        raise PageTimeout(f'{service} call skipped, the batch deadline has passed')
+    return func(*args, **kwargs)
+
+
+def page_time_left():
+    """
+    Seconds left before the deadline of the batch running this page, None
+    outside a batch or without a deadline; raises PageTimeout once expired
+    """
+    expired = _page_expired.get()
+    if expired is not None and expired.is_set():
+        raise PageTimeout('The batch deadline has passed')
+    deadline = _page_deadline.get()
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise PageTimeout('The batch deadline has passed')
+    return left
+
+
+_process_pools = {}
+_process_pools_lock = threading.Lock()
+
+
+def get_process_pool(name, workers, initializer=None):
+    """Persistent process pool `name` of this worker process, created on first use"""
+    pool = _process_pools.get(name)
+    if pool is None:
+        with _process_pools_lock:
+            pool = _process_pools.get(name)
+            if pool is None:
+                # spawn: forking a worker that already runs request threads
+                # could copy locks held by those threads
+                pool = _process_pools[name] = ProcessPoolExecutor(
+                    max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=initializer)
+    return pool
+
+
+def reset_process_pool(name):
+    """Drop a broken pool, the next get_process_pool() starts a new one"""
+    with _process_pools_lock:
+        pool = _process_pools.pop(name, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def run_ordered(func, items, workers=None, timeout=None):
+    """
+    Run func(index, item) for every item on a bounded thread pool
+
+    Args:
+        func: Called as func(index, item) for each page
+        items: Pages of the batch
+        workers: Maximum concurrent pages (default BATCH_WORKERS)
+        timeout: Seconds for the whole batch (default BATCH_TIMEOUT or the
+                 batch_context() one, 0 = none)
+
+    Returns:
+        list: (result, exception) per item, in the order of `items`;
+              unfinished pages get a PageTimeout exception
+    """
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(workers or BATCH_WORKERS, len(items)))
+    progress, context_timeout = _context.get()
+    if timeout is None:
+        timeout = BATCH_TIMEOUT if context_timeout is None else context_timeout
+
+    if workers == 1 and not timeout:
+        outcomes = []
+        for index, item in enumerate(items):
+            try:
+                outcomes.append((func(index, item), None))
+            except Exception as e:
+                outcomes.append((None, e))
+            if progress is not None:
+                progress(index + 1, len(items))
+        return outcomes
+
+    expired = threading.Event()
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def run_page(index, item):
+        token = _page_expired.set(expired)
+        deadline_token = _page_deadline.set(deadline)
+        try:
+            return func(index, item)
+        finally:
+            _page_deadline.reset(deadline_token)
+            _page_expired.reset(token)
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='batch')
+    try:
+        futures = [executor.submit(run_page, index, item) for index, item in enumerate(items)]
+        if progress is None:
+            done, pending = wait(futures, timeout=timeout or None)
+        else:
+            done, pending = _wait_reporting(futures, timeout, progress)
+        if pending:
+            # Running pages stop at their next AWS call
+            expired.set()
+            logger.warning(f"Batch deadline of {timeout}s reached with {len(pending)}/{len(items)} pages pending")
+        outcomes = []
+        for future in futures:
+            if future in pending:
+                future.cancel()
+                outcomes.append((None, PageTimeout(f'Page not processed within {timeout}s')))
+            elif future.exception() is not None:
+                outcomes.append((None, future.exception()))
+            else:
+                outcomes.append((future.result(), None))
+        return outcomes
+    finally:
+        # Do not wait for pages past the deadline: queued ones are cancelled,
+        # running ones end at their next call_aws
+        executor.shutdown(wait=False, cancel_futures=True)
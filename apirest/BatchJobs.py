@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+Background job queue for the batch OCR endpoints
+
+In job mode ("async": true in the body, or ?async=1) the batch-ocr-*
+endpoints store the request as a batch_job row and answer 202 with its id
+right away; the pages are processed by job workers and the client polls
+batch-jobs/<id>/ or follows batch-jobs/<id>/events/ (NDJSON progress).
+
+The queue is the batch_job table of the existing database: workers claim
+the oldest queued job with a conditional UPDATE, so any number of workers
+(`manage.py run_batch_jobs`, or opt-in threads of the web processes) can
+share it without a broker. A running job gets a heartbeat every
+HEARTBEAT_INTERVAL seconds, independent of page progress; idle workers
+requeue a job whose heartbeat stopped (worker killed) for
+BATCH_JOB_STALE_AFTER seconds, up to BATCH_JOB_MAX_ATTEMPTS.
+
+Each claim increments `intentos`, which then fences the worker's writes:
+progress, heartbeat and result only apply while the job is still running
+under that attempt, so a worker whose job was requeued and claimed again
+elsewhere cannot overwrite the new attempt.
+"""
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from decouple import config
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from apirest.BatchExecutor import batch_context
+from apirest.models import batch_job
+
+logger = logging.getLogger('apirest.aws')
+
+# Job worker threads started in each web process (opt-in), 0 = only
+# dedicated workers (python manage.py run_batch_jobs) process jobs
+INPROCESS_WORKERS = config('BATCH_JOB_WORKERS', default=0, cast=int)
+POLL_INTERVAL = config('BATCH_JOB_POLL_INTERVAL', default=2.0, cast=float)
+# Deadline of a whole job, no longer bound to the gunicorn/nginx timeouts
+JOB_TIMEOUT = config('BATCH_JOB_TIMEOUT', default=900, cast=float)
+STALE_AFTER = config('BATCH_JOB_STALE_AFTER', default=300, cast=int)
+MAX_ATTEMPTS = config('BATCH_JOB_MAX_ATTEMPTS', default=2, cast=int)
+RETENTION_DAYS = config('BATCH_JOB_RETENTION_DAYS', default=7, cast=int)
+# Seconds between progress writes of a running job
+PROGRESS_INTERVAL = 1.0
+# Seconds between heartbeats of a running job, well under STALE_AFTER
+HEARTBEAT_INTERVAL = max(1.0, min(30.0, STALE_AFTER / 5))
+
+# Job type -> view whose process_batch(file_list, bucket_name, options)
+# does the work, the same code the synchronous endpoint runs
+JOB_TYPES = {
+    'raw': 'apirest.views.BatchOCRRawView',
+    'acta': 'apirest.views.BatchBirthCertificateOCRView',
+    'passport': 'apirest.views.BatchPassportOCRView',
+    'certificado': 'apirest.views.BatchCertificadoOCRView',
+    'titulo': 'apirest.views.BatchTituloOCRView',
+}
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def submit_job(tipo, file_list, bucket_name, options=None):
+    """Queue a batch and return its batch_job row"""
+    if tipo not in JOB_TYPES:
+        raise ValueError(f'Unknown batch job type: {tipo}')
+    job = batch_job.objects.create(
+        tipo=tipo,
+        parametros={'file_list': list(file_list), 'bucket_name': bucket_name, 'options': options or {}},
+        paginas_total=len(file_list),
+    )
+    logger.info(f"Batch job {job.id} queued: {tipo}, {len(file_list)} files")
+    start_workers()
+    _wakeup.set()
+    return job
+
+
+def job_status(job, include_result=True):
+    """API representation of a job"""
+    data = {
+        'job_id': str(job.id),
+        'type': job.tipo,
+        'status': job.estado,
+        'pages_total': job.paginas_total,
+        'pages_done': job.paginas_procesadas,
+        'attempts': job.intentos,
+        'created': job.creado,
+        'started': job.iniciado,
+        'finished': job.terminado,
+    }
+    if job.estado == 'failed':
+        data['error'] = job.error
+    if include_result and job.estado == 'done':
+        data['result_status'] = job.codigo_http
+        data['result'] = job.resultado
+    return data
+
+
+def requeue_stale():
+    """Requeue (or fail, after MAX_ATTEMPTS) running jobs without a recent heartbeat"""
+    limit = timezone.now() - timedelta(seconds=STALE_AFTER)
+    stale = batch_job.objects.filter(estado='running').filter(Q(actualizado__lt=limit) | Q(actualizado__isnull=True))
+    failed = stale.filter(intentos__gte=MAX_ATTEMPTS).update(
+        estado='failed', error='Worker stopped while processing the job', terminado=timezone.now())
+    requeued = stale.filter(intentos__lt=MAX_ATTEMPTS).update(estado='queued', paginas_procesadas=0)
+    if failed or requeued:
+        logger.warning(f"Stale batch jobs: {requeued} requeued, {failed} failed")
+
+
+def purge_finished():
+    """Delete finished jobs older than BATCH_JOB_RETENTION_DAYS"""
+    if RETENTION_DAYS <= 0:
+        return 0
+    limit = timezone.now() - timedelta(days=RETENTION_DAYS)
+    deleted, _ = batch_job.objects.filter(estado__in=('done', 'failed'), terminado__lt=limit).delete()
+    return deleted
+
+
+def claim_next_job():
+    """Take the oldest queued job, or None; safe with concurrent workers"""
+    candidates = batch_job.objects.filter(estado='queued').order_by('creado').values_list('pk', 'intentos')[:10]
+    for pk, intentos in candidates:
+        now = timezone.now()
+        # Conditional on the attempt seen, so one requeue is claimed once
+        claimed = batch_job.objects.filter(pk=pk, estado='queued', intentos=intentos).update(
+            estado='running', iniciado=now, actualizado=now, intentos=intentos + 1)
+        if claimed:
+            return batch_job.objects.get(pk=pk)
+    return None
+
+
+def _attempt(job):
+    """Rows of the job while it is still running under this worker's attempt"""
+    return batch_job.objects.filter(pk=job.pk, estado='running', intentos=job.intentos)
+
+
+def _heartbeat(job, stop_event):
+    while not stop_event.wait(HEARTBEAT_INTERVAL):
+        try:
+            if not _attempt(job).update(actualizado=timezone.now()):
+                logger.warning(f"Batch job {job.id} attempt {job.intentos} is no longer ours, heartbeat stopped")
+                return
+        except Exception as e:
+            logger.warning(f"Could not record heartbeat of batch job {job.id}: {str(e)}")
+        finally:
+            close_old_connections()
+
+
+def run_job(job):
+    """Process a claimed job and store its result"""
+    logger.info(f"Batch job {job.id} started: {job.tipo}, {job.paginas_total} files, attempt {job.intentos}")
+    last_write = [0.0]
+
+    def progress(done, total):
+        now = timezone.now()
+        if done < total and now.timestamp() - last_write[0] < PROGRESS_INTERVAL:
+            return
+        last_write[0] = now.timestamp()
+        try:
+            _attempt(job).update(paginas_procesadas=done, actualizado=now)
+        except Exception as e:
+            logger.warning(f"Could not record progress of batch job {job.id}: {str(e)}")
+
+    params = job.parametros
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop_heartbeat),
+                                 name=f'batch-job-heartbeat-{job.pk}', daemon=True)
+    heartbeat.start()
+    try:
+        view = import_string(JOB_TYPES[job.tipo])()
+        with batch_context(progress=progress, timeout=JOB_TIMEOUT):
+            result, result_status = view.process_batch(params['file_list'], params['bucket_name'],
+                                                       params.get('options', {}))
+    except Exception as e:
+        logger.error(f"Batch job {job.id} failed: {type(e).__name__}: {str(e)}")
+        _attempt(job).update(estado='failed', error=f'{type(e).__name__}: {str(e)}', terminado=timezone.now())
+        return
+    finally:
+        stop_heartbeat.set()
+        heartbeat.join()
+
+    now = timezone.now()
+    stored = _attempt(job).update(estado='done', resultado=result, codigo_http=result_status,
+                                  paginas_procesadas=job.paginas_total, terminado=now, actualizado=now)
+    if not stored:
+        logger.warning(f"Batch job {job.id} attempt {job.intentos} was requeued meanwhile, result discarded")
+        return
+    logger.info(f"Batch job {job.id} done with status {result_status} "
+                f"in {(now - job.iniciado).total_seconds():.1f}s")
+
+
+def worker_loop(stop_event):
+    """Process jobs until stop_event is set"""
+    idle_polls = 0
+    next_requeue = 0.0
+    while not stop_event.is_set():
+        job = None
+        try:
+            job = claim_next_job()
+            if job is not None:
+                run_job(job)
+            else:
+                # Every worker, in-process or dedicated, recovers jobs of
+                # dead workers while it has nothing else to do
+                if time.monotonic() >= next_requeue:
+                    next_requeue = time.monotonic() + HEARTBEAT_INTERVAL
+                    requeue_stale()
+                if idle_polls % 1800 == 0:
+                    purge_finished()
+        except Exception as e:
+            logger.error(f"Batch job worker error: {type(e).__name__}: {str(e)}")
+        finally:
+            close_old_connections()
+        if job is None:
+            idle_polls += 1
+            _wakeup.wait(POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def start_workers(count=None):
+    """Start the in-process job worker threads once per process"""
+    count = INPROCESS_WORKERS if count is None else count
+    with _workers_lock:
+        if _workers or count <= 0:
+            return
+        stop_event = threading.Event()
+        for number in range(count):
+            thread = threading.Thread(target=worker_loop, args=(stop_event,),
+                                      name=f'batch-job-{number}', daemon=True)
+            thread.start()
+            _workers.append(thread)
+        logger.info(f"Started {count} in-process batch job workers")
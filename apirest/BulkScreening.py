@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk sanctions screening
+Screens many prospects against one snapshot of the screening index, spreading
+the scoring over a process pool and yielding results as chunks finish
+
+The pool is the persistent (spawn) 'screening' pool of BatchExecutor. The
+snapshot reaches its workers as a pickle file written once per index
+generation, which each worker loads once and keeps for the next chunks.
+"""
+
+import atexit
+import logging
+import os
+import pickle
+import tempfile
+import threading
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from decouple import config
+
+from apirest.BatchExecutor import get_process_pool, reset_process_pool
+from apirest.FuzzyScorer import score_many
+
+# Configure logger for screening operations
+logger = logging.getLogger('apirest.screening')
+
+# Every pool process loads Django and its own copy of the index snapshot,
+# per web worker: keep it small
+BULK_WORKERS = config('SCREENING_BULK_WORKERS', default=2, cast=int)
+BULK_CHUNK_SIZE = config('SCREENING_BULK_CHUNK_SIZE', default=200, cast=int)
+
+# Snapshot files published by this process: generation -> [path, users]
+_published = {}
+_published_lock = threading.Lock()
+# ((path, generation), snapshot) loaded by this pool worker
+_worker_snapshot = None
+
+
+def screen_prospects(index, prospects, threshold, workers=None):
+    """
+    Screen a list of prospects against an index
+
+    Candidates of all prospects are merged so the whole list is scored in a
+    single score matrix; each prospect keeps only hits among its own
+    candidates, so results match consult2.comparar regardless of how the
+    list is split. A listed entry matched through several names/aliases is
+    reported once, with its best score. Does not touch the database.
+
+    Args:
+        index: Built ScreeningIndex (or a snapshot of it)
+        prospects: List of prospect names
+        threshold: Minimum score (0-100)
+        workers: rapidfuzz threads, see FuzzyScorer.score_many
+
+    Returns:
+        list: One list of hit dicts (id, nombres, Puntos, Base_de_Datos,
+              Prospecto, Coincidencia) per prospect, in the same order
+    """
+    textos = {}
+    propios = []
+    for n1 in prospects:
+        seleccion = index.candidates(str(n1), threshold)
+        propios.append(seleccion)
+        for _, texto, _, _ in seleccion:
+            textos.setdefault(texto, len(textos))
+    nombres = list(textos)
+
+    resultados = []
+    hits = score_many([str(n1).upper() for n1 in prospects], nombres, threshold, workers=workers)
+    for n1, seleccion, prospect_hits in zip(prospects, propios, hits):
+        puntos = dict(prospect_hits)
+        mejores = {}
+        for rid, texto, listas, nombre in seleccion:
+            result = puntos.get(textos[texto])
+            if result is None or (rid in mejores and mejores[rid]['Puntos'] >= result):
+                continue
+            mejores[rid] = {'id': int(rid), 'nombres': nombre, 'Puntos': result,
+                            'Base_de_Datos': listas, 'Prospecto': n1, 'Coincidencia': texto}
+        resultados.append(list(mejores.values()))
+    return resultados
+
+
+def _init_worker():
+    # Unpickling the snapshot imports apirest.models
+    import django
+    django.setup()
+
+
+def _screen_chunk(path, generation, start, prospects, threshold):
+    """Process pool task: screen a chunk against the published snapshot"""
+    global _worker_snapshot
+    key = (path, generation)
+    if _worker_snapshot is None or _worker_snapshot[0] != key:
+        with open(path, 'rb') as f:
+            _worker_snapshot = (key, pickle.load(f))
+    # One core per process, the pool already spreads the work
+    return start, screen_prospects(_worker_snapshot[1], prospects, threshold, workers=1)
+
+
+def _acquire_snapshot_file(snapshot):
+    """Path of the pickled snapshot, written once per generation"""
+    with _published_lock:
+        entry = _published.get(snapshot.generation)
+        if entry is None:
+            fd, path = tempfile.mkstemp(suffix='.pickle', prefix='screening_')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            entry = _published[snapshot.generation] = [path, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_snapshot_file(generation):
+    """Delete snapshot files of older generations nobody is reading"""
+    with _published_lock:
+        _published[generation][1] -= 1
+        latest = max(_published)
+        for old in [old for old, (_, users) in _published.items() if old != latest and users == 0]:
+            path, _ = _published.pop(old)
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Error cleaning up screening snapshot {path}: {e}")
+
+
+@atexit.register
+def _remove_snapshot_files():
+    for path, _ in _published.values():
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def iter_screening(index, prospects, threshold):
+    """
+    Screen prospects and yield each result as soon as its chunk is done
+
+    Args:
+        index: Snapshot of the screening index (ScreeningIndex.snapshot()),
+               the same for the whole run
+        prospects: List of prospect names
+        threshold: Minimum score (0-100)
+
+    Yields:
+        tuple: (position in prospects, prospect, list of hit dicts)
+    """
+    started = time.time()
+    chunks = [(start, prospects[start:start + BULK_CHUNK_SIZE])
+              for start in range(0, len(prospects), BULK_CHUNK_SIZE)]
+    workers = min(BULK_WORKERS, len(chunks))
+
+    pending = dict(chunks)
+    if workers > 1:
+        path = _acquire_snapshot_file(index)
+        futures = {}
+        try:
+            pool = get_process_pool('screening', BULK_WORKERS, initializer=_init_worker)
+            futures = {pool.submit(_screen_chunk, path, index.generation, start, chunk, threshold): start
+                       for start, chunk in chunks}
+            remaining = set(futures)
+            while remaining:
+                done, remaining = wait(remaining, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, chunk_results = future.result()
+                    chunk = pending.pop(start)
+                    for offset, hits in enumerate(chunk_results):
+                        yield start + offset, chunk[offset], hits
+        except BrokenProcessPool as e:
+            logger.warning(f"Screening pool broken, screening {len(pending)} chunks in thread: {str(e)}")
+            reset_process_pool('screening')
+        finally:
+            for future in futures:
+                future.cancel()
+            _release_snapshot_file(index.generation)
+
+    for start, chunk in list(pending.items()):
+        for offset, hits in enumerate(screen_prospects(index, chunk, threshold)):
+            yield start + offset, chunk[offset], hits
+        del pending[start]
+
+    logger.info(f"Bulk screening of {len(prospects)} prospects finished in "
+                f"{time.time() - started:.2f}s with {workers} worker(s)")
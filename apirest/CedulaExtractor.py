@@ -0,0 +1,370 @@
+# -*- coding: utf-8 -*-
+"""
+Field extraction for Panamanian cédulas and carnés de residente
+Turns Rekognition TextDetections into the consult45 response fields in a
+single pass over the detections, driven by an ordered rule table.
+Confidence is kept as a running sum, no DataFrames involved.
+"""
+
+from dataclasses import dataclass, asdict
+
+from unidecode import unidecode
+
+CEDULA_PANAMENA = 'CEDULA PANAMEÑA'
+COD_OK = '200_OK'
+COD_BAD_QUALITY = '400_Bad Quality_image'
+
+# Letters Rekognition reads for the gender mark (I/l are a misread F, N/H a misread M)
+GENDER_MARKS = {'F': 'F', 'M': 'M', 'I': 'F', 'l': 'F', 'N': 'M', 'H': 'M'}
+
+
+@dataclass(slots=True)
+class CedulaResult:
+    """consult45 response fields, same keys and order as the API response"""
+    cod: str = ''
+    Numero_de_Documento: str = ''
+    Expedicion: str = ''
+    Expira: str = ''
+    Pais_de_Residencia: str = ''
+    Nombres: str = ''
+    Apellidos: str = ''
+    Fecha_de_Nacimiento: str = ''
+    Lugar_de_Nacimiento: str = ''
+    Genero: str = ''
+    Nacionalidad: str = ''
+    avg_confidence: float = None
+
+    def to_dict(self):
+        data = asdict(self)
+        del data['avg_confidence']
+        return data
+
+
+@dataclass(slots=True)
+class _State:
+    pais: str = ''
+    tipo_ciudadania: str = ''
+    ciudadania: str = ''
+    nombre: str = ''
+    apellidos: str = ''
+    fecha_nacimiento: str = ''
+    lugar_nacimiento: str = ''
+    id: str = ''
+    expedida: str = ''
+    expira: str = ''
+    sexo: str = ''
+    # Three characters after the first '-' of the last text that had one
+    id_verifica: str = ''
+    # Words seen since the 'LUGAR' label word (4 = the place of birth)
+    id_prox: int = 0
+    # ParentId (line) of the label word whose value comes next in that line
+    parent_nacionalidad_sexo: object = None
+    parent_expedida: object = None
+    parent_expira: object = None
+    conf_sum: int = 0
+    conf_count: int = 0
+
+    def add_confidence(self, detection):
+        confidence = int(detection['Confidence'])
+        if confidence:
+            self.conf_sum += confidence
+            self.conf_count += 1
+
+
+# ---------------------------------------------------------------- LINE rules
+
+def _is_pais(s, d, c):
+    return 'PANAM' in c and not s.pais
+
+
+def _set_pais(s, d, c):
+    s.pais = 'REPUBLICA DE PANAMA'
+    s.add_confidence(d)
+
+
+def _is_carne(s, d, c):
+    return 'CARNE' in c and not s.tipo_ciudadania
+
+
+def _set_carne(s, d, c):
+    s.tipo_ciudadania = 'CEDULA EXTRANJERO'
+    s.ciudadania = ''
+    s.add_confidence(d)
+
+
+def _is_tribunal(s, d, c):
+    return ('TRIBUNA' in c or 'ELECTO' in c) and not s.tipo_ciudadania
+
+
+def _set_tribunal(s, d, c):
+    s.tipo_ciudadania = CEDULA_PANAMENA
+    s.ciudadania = 'PANAMEÑA'
+    s.add_confidence(d)
+
+
+def _is_nombre(s, d, c):
+    # Names are the only mixed-case text printed on the card
+    return c[2:4].islower() and not s.nombre
+
+
+def _set_nombre(s, d, c):
+    s.nombre = ' '.join(c.split(' ')[:4])
+    s.add_confidence(d)
+
+
+def _is_apellidos(s, d, c):
+    return c[2:4].islower() and not s.apellidos
+
+
+def _set_apellidos(s, d, c):
+    s.apellidos = ' '.join(c.split(' ')[:2])
+    s.add_confidence(d)
+
+
+def _is_lugar_line(s, d, c):
+    return 'NACIMIENTO:' in c and not s.lugar_nacimiento
+
+
+def _set_lugar_line(s, d, c):
+    if s.tipo_ciudadania == CEDULA_PANAMENA:
+        s.lugar_nacimiento = 'PANAMA'
+    elif 'DE DE' in c:
+        start = c.index('NACIMIENTO: NACIMIENTO:') + 23
+        s.lugar_nacimiento = c[start + 1:start + 12]
+    elif 'LUGAR DE NACIMIENTO' in c:
+        parts = c.split(' ')
+        if len(parts) > 1 and s.id_verifica.isalpha():
+            s.lugar_nacimiento = parts[3]
+            s.add_confidence(d)
+
+
+def _is_expedida_line(s, d, c):
+    return 'EXPEDIDA' in c and not s.expedida
+
+
+def _set_expedida_line(s, d, c):
+    if ':' in c:
+        parts = c.split(':')
+        s.expedida = parts[1][1:12]
+        if len(parts) > 2:
+            s.expira = parts[2][1:12]
+        s.add_confidence(d)
+
+
+def _is_nacionalidad_line(s, d, c):
+    # Matched so that the line does not fall through to later rules;
+    # nationality is read from the words instead
+    return 'NACIONA' in c and not s.ciudadania
+
+
+def _is_sexo_line(s, d, c):
+    return 'SEX' in c
+
+
+def _set_sexo_line(s, d, c):
+    if 'SEXO' not in c:
+        return
+    parts = c.split(' ')
+    if len(parts) > 1 and len(parts[1]) == 1:
+        sexo = GENDER_MARKS.get(parts[1])
+        if sexo:
+            s.sexo = sexo
+            s.add_confidence(d)
+    elif len(parts) == 1 and parts[0] == 'SEXO:F':
+        s.sexo = 'F'
+
+
+# ---------------------------------------------------------------- WORD rules
+
+def _is_fecha(s, d, c):
+    return '-' in c and not s.fecha_nacimiento and s.id_verifica.isalpha()
+
+
+def _set_fecha(s, d, c):
+    parts = c.split('-')
+    s.id_verifica = parts[1]
+    mes = unidecode(parts[1], errors='preserve')
+    if 'OST' in mes:
+        mes = 'OCT'
+    if s.id_verifica.isalpha():
+        dia = parts[0].split(':')[1] if 'NACIMIENTO:' in parts[0] else parts[0]
+        s.fecha_nacimiento = dia + '-' + mes + '-' + parts[2]
+    s.add_confidence(d)
+
+
+def _is_documento(s, d, c):
+    return '-' in c and not s.id
+
+
+def _set_documento(s, d, c):
+    if not s.id_verifica.isalpha():
+        s.id = c
+        s.add_confidence(d)
+
+
+def _is_expedida_label(s, d, c):
+    return 'EXPEDIDA' in c and not s.expedida
+
+
+def _set_expedida_label(s, d, c):
+    s.parent_expedida = d['ParentId']
+
+
+def _is_expedida_value(s, d, c):
+    return d['ParentId'] == s.parent_expedida and not s.expedida
+
+
+def _set_expedida_value(s, d, c):
+    s.expedida = c[0:11]
+    s.add_confidence(d)
+
+
+def _is_expira_label(s, d, c):
+    return 'EXPIRA' in c and not s.expira
+
+
+def _set_expira_label(s, d, c):
+    s.parent_expira = d['ParentId']
+
+
+def _is_expira_value(s, d, c):
+    return d['ParentId'] == s.parent_expira and not s.expira
+
+
+def _set_expira_value(s, d, c):
+    s.expira = c[0:11]
+    s.add_confidence(d)
+
+
+def _is_lugar_label(s, d, c):
+    return 'LUGAR' in c and not s.lugar_nacimiento
+
+
+def _set_lugar_label(s, d, c):
+    s.id_prox += 1
+
+
+def _is_lugar_value(s, d, c):
+    return s.id_prox == 4 and not s.lugar_nacimiento
+
+
+def _set_lugar_value(s, d, c):
+    if s.tipo_ciudadania == CEDULA_PANAMENA:
+        s.lugar_nacimiento = 'PANAMA'
+    else:
+        s.lugar_nacimiento = c
+        s.id_prox = 0
+
+
+def _is_nacionalidad_label(s, d, c):
+    return 'NACIONALIDAD' in c and not s.ciudadania
+
+
+def _set_parent_label(s, d, c):
+    s.parent_nacionalidad_sexo = d['ParentId']
+
+
+def _is_nacionalidad_value(s, d, c):
+    return d['ParentId'] == s.parent_nacionalidad_sexo and not s.ciudadania
+
+
+def _set_nacionalidad_value(s, d, c):
+    s.ciudadania = c
+    s.tipo_ciudadania = 'CEDULA EXTRANJERA'
+
+
+def _is_sexo_label(s, d, c):
+    return 'SEXO' in c and not s.sexo
+
+
+def _is_sexo_value(s, d, c):
+    return d['ParentId'] == s.parent_nacionalidad_sexo and not s.sexo
+
+
+def _set_sexo_value(s, d, c):
+    sexo = GENDER_MARKS.get(c)
+    if sexo:
+        s.sexo = sexo
+        s.add_confidence(d)
+
+
+# Ordered rule table: the first rule whose type and predicate match consumes
+# the detection. None as type applies to LINE and WORD alike.
+RULES = (
+    ('LINE', _is_pais, _set_pais),
+    ('LINE', _is_carne, _set_carne),
+    ('LINE', _is_tribunal, _set_tribunal),
+    (None, _is_nombre, _set_nombre),
+    (None, _is_apellidos, _set_apellidos),
+    ('LINE', _is_lugar_line, _set_lugar_line),
+    ('LINE', _is_expedida_line, _set_expedida_line),
+    ('LINE', _is_nacionalidad_line, None),
+    ('LINE', _is_sexo_line, _set_sexo_line),
+    ('WORD', _is_fecha, _set_fecha),
+    ('WORD', _is_documento, _set_documento),
+    ('WORD', _is_expedida_label, _set_expedida_label),
+    ('WORD', _is_expedida_value, _set_expedida_value),
+    ('WORD', _is_expira_label, _set_expira_label),
+    ('WORD', _is_expira_value, _set_expira_value),
+    ('WORD', _is_lugar_label, _set_lugar_label),
+    ('WORD', _is_lugar_value, _set_lugar_value),
+    ('WORD', _is_nacionalidad_label, _set_parent_label),
+    ('WORD', _is_nacionalidad_value, _set_nacionalidad_value),
+    ('WORD', _is_sexo_label, _set_parent_label),
+    ('WORD', _is_sexo_value, _set_sexo_value),
+)
+
+# Rules to try per detection type, in table order
+_RULES_BY_TYPE = {
+    tipo: tuple((match, action) for rule_type, match, action in RULES if rule_type in (None, tipo))
+    for tipo in ('LINE', 'WORD')
+}
+
+
+def extract_cedula(text_detections, threshold):
+    """
+    Extract the cédula/carné fields from Rekognition TextDetections
+
+    Args:
+        text_detections: response['TextDetections'] of detect_text
+        threshold: Minimum average confidence (puntaje_ocr)
+
+    Returns:
+        CedulaResult: '200_OK' when every field was found and the average
+                      confidence reaches the threshold
+    """
+    s = _State()
+    for detection in text_detections:
+        c = detection['DetectedText']
+
+        dash = c.find('-')
+        if dash >= 0:
+            s.id_verifica = c[dash + 1:dash + 4]
+        if s.id_prox > 0:
+            s.id_prox += 1
+
+        for match, action in _RULES_BY_TYPE.get(detection['Type'], ()):
+            if match(s, detection, c):
+                if action is not None:
+                    action(s, detection, c)
+                break
+
+    avg = s.conf_sum / s.conf_count if s.conf_count else None
+    complete = all((s.id, s.tipo_ciudadania, s.nombre, s.apellidos, s.fecha_nacimiento,
+                    s.lugar_nacimiento, s.expedida, s.expira, s.sexo, s.ciudadania))
+    cod = COD_OK if complete and (avg is None or avg >= threshold) else COD_BAD_QUALITY
+
+    return CedulaResult(
+        cod=cod,
+        Numero_de_Documento=s.id,
+        Expedicion=s.expedida,
+        Expira=s.expira,
+        Pais_de_Residencia=s.pais,
+        Nombres=s.nombre,
+        Apellidos=s.apellidos,
+        Fecha_de_Nacimiento=s.fecha_nacimiento,
+        Lugar_de_Nacimiento=s.lugar_nacimiento,
+        Genero=s.sexo,
+        Nacionalidad=s.ciudadania,
+        avg_confidence=avg,
+    )
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Batch fuzzy scoring for sanctions screening
+Scores one or many prospects against a column of listed names in a single
+call instead of one fuzz.partial_ratio call per listed name
+"""
+
+import logging
+
+import numpy as np
+from decouple import config
+from fuzzywuzzy import fuzz
+from rapidfuzz import fuzz as rf_fuzz, process
+
+# Configure logger for screening operations
+logger = logging.getLogger('apirest.screening')
+
+# Threads used by rapidfuzz for the N x M matrix (-1 = all cores)
+SCORER_WORKERS = config('SCREENING_SCORER_WORKERS', default=-1, cast=int)
+# Listed names scored per cdist call, bounds the score matrix memory
+SCORER_CHUNK_SIZE = config('SCREENING_SCORER_CHUNK_SIZE', default=50000, cast=int)
+
+
+def _cutoff(threshold):
+    # fuzzywuzzy rounds its scores, so anything that rounds up to the
+    # threshold has to survive the vectorized pass
+    return max(0, threshold - 0.5)
+
+
+def _confirm(prospect, name, threshold):
+    """
+    Final score with the same fuzz.partial_ratio used by the screening
+    since the beginning, so reported points do not change.
+    rapidfuzz searches every alignment and never scores below it, which
+    makes the vectorized pass a lossless filter.
+    """
+    score = fuzz.partial_ratio(prospect, name)
+    return score if score >= threshold else None
+
+
+def score_many(prospects, names, threshold, workers=None):
+    """
+    Score N prospects against M names in one pass across all cores
+
+    Args:
+        prospects: Sequence of upper-cased prospect names
+        names: Sequence of upper-cased listed names
+        threshold: Minimum score (0-100)
+        workers: rapidfuzz threads (default SCREENING_SCORER_WORKERS)
+
+    Returns:
+        list: One list of (position in names, score) tuples per prospect
+    """
+    results = [[] for _ in prospects]
+    if not prospects or not names:
+        return results
+
+    cutoff = _cutoff(threshold)
+    for start in range(0, len(names), SCORER_CHUNK_SIZE):
+        chunk = names[start:start + SCORER_CHUNK_SIZE]
+        matrix = process.cdist(
+            prospects,
+            chunk,
+            scorer=rf_fuzz.partial_ratio,
+            score_cutoff=cutoff,
+            dtype=np.float32,
+            workers=SCORER_WORKERS if workers is None else workers,
+        )
+        rows, cols = np.nonzero(matrix)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            score = _confirm(prospects[row], chunk[col], threshold)
+            if score is not None:
+                results[row].append((start + col, score))
+
+    logger.debug(f"Scored {len(prospects)} prospects against {len(names)} names")
+    return results
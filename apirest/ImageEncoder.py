@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Size-targeted JPEG encoding (Textract/S3 4.5MB page limit)
+
+Instead of re-encoding the full page at quality 95, 90, ... and then at
+smaller and smaller sizes, encode_to_size() encodes a small probe of the
+page to learn its bytes per pixel, binary-searches the quality (and the
+scale, when quality alone is not enough) on the probe, and corrects the
+estimate with the real size after each full encode. The probe is a mosaic
+of full-resolution tiles taken across the page: a downscaled copy packs
+the text of a document into far more detail per pixel and overestimates
+it. A page takes one full encode when it fits at the best quality and
+MAX_FULL_ENCODES at most.
+"""
+
+import io
+import logging
+import math
+
+from PIL import Image
+
+logger = logging.getLogger('apirest.image')
+
+# Textract synchronous limit (5MB) with margin
+MAX_DOCUMENT_BYTES = 4.5 * 1024 * 1024
+# Probe: PROBE_TILES tiles of PROBE_TILE pixels (multiple of the 16px JPEG
+# block, so tile borders add no artifacts)
+PROBE_TILE = 128
+PROBE_TILES = 24
+MAX_FULL_ENCODES = 3
+# Aim slightly under the limit, the estimate is never exact
+SAFETY = 0.97
+
+
+def _encode(image, quality, save_options):
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, **save_options)
+    return output.getvalue()
+
+
+def _probe(image):
+    """Mosaic of tiles spread over the image, the image itself when small"""
+    width, height = image.size
+    if width * height <= 2 * PROBE_TILES * PROBE_TILE * PROBE_TILE or min(width, height) < 2 * PROBE_TILE:
+        return image
+    columns = max(1, round(math.sqrt(PROBE_TILES * width / height)))
+    rows = max(1, math.ceil(PROBE_TILES / columns))
+    probe = Image.new(image.mode, (columns * PROBE_TILE, rows * PROBE_TILE))
+    for row in range(rows):
+        top = int((row + 0.5) * height / rows - PROBE_TILE / 2)
+        top = min(max(0, top), height - PROBE_TILE)
+        for column in range(columns):
+            left = int((column + 0.5) * width / columns - PROBE_TILE / 2)
+            left = min(max(0, left), width - PROBE_TILE)
+            tile = image.crop((left, top, left + PROBE_TILE, top + PROBE_TILE))
+            probe.paste(tile, (column * PROBE_TILE, row * PROBE_TILE))
+    return probe
+
+
+def _best_quality(fits, low, high):
+    """Highest quality in [low, high] for which fits(quality), low if none"""
+    if low > high:
+        return low
+    if fits(high):
+        return high
+    best = low
+    while low <= high:
+        middle = (low + high) // 2
+        if fits(middle):
+            best, low = middle, middle + 1
+        else:
+            high = middle - 1
+    return best
+
+
+def encode_to_size(image, max_size_bytes, min_quality=70, max_quality=95, min_scale=0.6,
+                   resize_quality=None, sharpen=None, **save_options):
+    """
+    JPEG-encode an image under max_size_bytes, keeping as much quality and
+    resolution as possible
+
+    Args:
+        image: PIL Image
+        max_size_bytes: Size limit of the encoded image
+        min_quality, max_quality: Quality range tried at full resolution
+        min_scale: Smallest scale applied when min_quality is still too big
+        resize_quality: Quality used once the image has to be scaled down
+                        (default min_quality)
+        sharpen: Optional function applied to the image after scaling down
+        save_options: Extra JPEG options (optimize, dpi...)
+
+    Returns:
+        tuple: (bytes, quality, scale); the last attempt when even
+               min_scale does not fit
+    """
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    save_options.setdefault('optimize', True)
+    resize_quality = resize_quality or min_quality
+    target = max_size_bytes * SAFETY
+
+    probe = _probe(image)
+    probe_sizes = {}
+    # Full image bytes per probe byte, corrected after every full encode
+    ratio = [(image.width * image.height) / (probe.width * probe.height)]
+
+    def estimate(quality):
+        if quality not in probe_sizes:
+            probe_sizes[quality] = len(_encode(probe, quality, save_options))
+        return probe_sizes[quality] * ratio[0]
+
+    def calibrate(quality, actual_size):
+        ratio[0] *= actual_size / estimate(quality)
+
+    encodes = 0
+    data = None
+    quality = max_quality
+
+    # Phase 1: full resolution, quality chosen on the probe
+    if estimate(min_quality) <= max_size_bytes * 1.1:
+        quality = _best_quality(lambda q: estimate(q) <= target, min_quality, max_quality)
+        while encodes < MAX_FULL_ENCODES - 1:
+            data = _encode(image, quality, save_options)
+            encodes += 1
+            calibrate(quality, len(data))
+            if len(data) <= max_size_bytes:
+                # Far under the limit: the probe was pessimistic, one more
+                # encode at the corrected quality keeps more detail
+                if len(data) < target * 0.7 and quality < max_quality and encodes < MAX_FULL_ENCODES - 1:
+                    better = _best_quality(lambda q: estimate(q) <= target, quality + 1, max_quality)
+                    if better > quality:
+                        candidate = _encode(image, better, save_options)
+                        encodes += 1
+                        if len(candidate) <= max_size_bytes:
+                            data, quality = candidate, better
+                logger.debug(f"Encoded {image.size} at quality={quality} to {len(data) / 1024 / 1024:.2f}MB "
+                             f"({encodes} full encodes)")
+                return data, quality, 1.0
+            if quality == min_quality:
+                break
+            quality = _best_quality(lambda q: estimate(q) <= target, min_quality, quality - 1)
+
+    # Phase 2: scale down, bytes shrink roughly with the pixel count
+    estimated = estimate(resize_quality)
+    scale = 1.0
+    # Whatever phase 1 left of MAX_FULL_ENCODES, at least one attempt
+    for _ in range(max(1, MAX_FULL_ENCODES - encodes)):
+        scale = max(min_scale, min(scale * 0.98, scale * math.sqrt(target / estimated)))
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        resized = image.resize(size, Image.Resampling.LANCZOS)
+        if sharpen is not None:
+            resized = sharpen(resized)
+        data = _encode(resized, resize_quality, save_options)
+        encodes += 1
+        estimated = len(data)
+        if len(data) <= max_size_bytes or scale <= min_scale:
+            break
+
+    if len(data) > max_size_bytes:
+        logger.warning(f"Image still {len(data) / 1024 / 1024:.2f}MB at {scale * 100:.0f}% and quality={resize_quality}")
+    logger.debug(f"Encoded {image.size} at {scale * 100:.0f}% and quality={resize_quality} to "
+                 f"{len(data) / 1024 / 1024:.2f}MB ({encodes} full encodes)")
+    return data, resize_quality, scale
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+Dimension-aware image decoding shared by the preprocessing paths
+
+Phone-camera uploads are usually far larger than what OCR preprocessing
+keeps, and a full decode of a 12MP JPEG costs ~36MB of RGB before the first
+resize. load_image() reads the header first (size, format, EXIF
+orientation) and, when the caller only needs a smaller image, lets the JPEG
+decoder scale down in the DCT domain (Image.draft, 1/2 to 1/8) or reduces
+other formats by an integer factor. The EXIF orientation is applied once,
+so every caller works on the upright image.
+"""
+
+import io
+import logging
+
+from PIL import Image, ImageOps
+
+logger = logging.getLogger('apirest.image')
+
+EXIF_ORIENTATION = 0x0112
+# Orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def _open(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return Image.open(io.BytesIO(source))
+    # Path or file object
+    return Image.open(source)
+
+
+def _orientation(image):
+    try:
+        return image.getexif().get(EXIF_ORIENTATION, 1) or 1
+    except Exception:
+        return 1
+
+
+def _displayed_size(size, orientation):
+    return (size[1], size[0]) if orientation in TRANSPOSED_ORIENTATIONS else size
+
+
+def read_header(source):
+    """
+    Format and upright size of an image without decoding its pixels
+
+    Returns:
+        tuple: (format, (width, height) with the EXIF orientation applied, orientation)
+    """
+    with _open(source) as image:
+        orientation = _orientation(image)
+        return image.format, _displayed_size(image.size, orientation), orientation
+
+
+def target_size(size, max_size=None, scale=None):
+    """Size the image will be resized to, None when it is not reduced"""
+    factor = 1.0
+    if scale is not None:
+        factor = min(factor, scale)
+    if max_size is not None:
+        factor = min(factor, max_size[0] / size[0], max_size[1] / size[1])
+    if factor >= 1.0:
+        return None
+    return max(1, int(size[0] * factor)), max(1, int(size[1] * factor))
+
+
+def load_image(source, max_size=None, scale=None, mode=None, resample=None):
+    """
+    Decode an image upright and no larger than the caller needs
+
+    Args:
+        source: Image bytes, path or file object
+        max_size: (width, height) box the caller fits the image into
+        scale: Factor the caller resizes the image by
+        mode: Mode to decode to ('L' or 'RGB' is decoded directly from JPEG)
+        resample: Resampling filter of an exact resize to the target; None
+                  returns the image at the cheap decoder scale, never below
+                  the target, for the caller's own resize
+
+    Returns:
+        PIL Image: Upright image; .format is the format of the source
+    """
+    image = _open(source)
+    image_format = image.format
+    orientation = _orientation(image)
+    stored_size = image.size
+
+    target = target_size(_displayed_size(stored_size, orientation), max_size, scale)
+    stored_target = _displayed_size(target, orientation) if target is not None else None
+
+    if image_format == 'JPEG' and (stored_target is not None or mode in ('L', 'RGB')):
+        image.draft(mode if mode in ('L', 'RGB') else image.mode, stored_target)
+    elif stored_target is not None:
+        factor = min(stored_size[0] // stored_target[0], stored_size[1] // stored_target[1])
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    if image.size != stored_size:
+        logger.debug(f"Decoded {image_format} {stored_size} at {image.size}")
+
+    if orientation != 1:
+        image = ImageOps.exif_transpose(image)
+    if mode is not None and image.mode != mode:
+        image = image.convert(mode)
+    if resample is not None and target is not None and image.size != target:
+        image = image.resize(target, resample)
+
+    image.format = image_format
+    return image
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+"""
+Image preprocessing pipeline shared by the Textract analyzers and the upload
+
+Every document type has a profile in PROFILES: the ordered stages applied
+to its pages (rotation, point operations, sharpening, resolution) and the
+options of the final encode under the Textract size limit. Tune a document
+type here, not in the analyzers.
+
+Consecutive point operations (AutoContrast, Contrast, Brightness) are
+fused: their lookup tables are composed on the image histogram, so the
+whole run costs one histogram and one Image.point pass instead of a
+histogram, a degenerate image and a blend per operation. The tables
+reproduce Pillow's own arithmetic, so the result is the same as running
+ImageOps/ImageEnhance one after the other (RGB contrast means within one
+grey level). Sharpness is a single 3x3 kernel pass instead of a smooth
+filter plus a blend (same result within one grey level).
+
+Profiles with grayscale=True decode JPEGs straight to 8-bit L and run
+every stage on one channel. The time of each stage is logged per page
+(and returned to callers that pass a timings list).
+
+Textract only needs the text, so every document profile can also run as
+a variant (get_profile, TEXTRACT_PREPROCESS_MODE[_<TYPE>]):
+- color: the RGB profile as tuned
+- gray: same stages on 8-bit L, a grayscale JPEG of quality 85 at most
+- binary: gray plus an OpenCV adaptive threshold, sent as a bilevel PNG
+  (a fraction of the JPEG size for printed documents)
+Compare them on real pages with `python manage.py benchmark_preprocessing`.
+"""
+
+import functools
+import io
+import logging
+import time
+
+import numpy as np
+from decouple import config
+from PIL import Image, ImageFilter
+
+from apirest.ImageEncoder import encode_to_size, MAX_DOCUMENT_BYTES
+from apirest.ImageLoader import load_image
+
+try:
+    import cv2
+    OPENCV_AVAILABLE = True
+except ImportError:
+    OPENCV_AVAILABLE = False
+
+logger = logging.getLogger('apirest.image')
+
+PREPROCESS_MODES = ('color', 'gray', 'binary')
+# Variant used by every analyzer, overridable per document type with
+# TEXTRACT_PREPROCESS_MODE_PASSPORT, _CERTIFICADO, _TITULO, _ACTA
+DEFAULT_PREPROCESS_MODE = config('TEXTRACT_PREPROCESS_MODE', default='color')
+# Best JPEG quality of the gray variants: encode_to_size() otherwise fills
+# the 4.5MB budget at quality 95, about twice the bytes of 85 for a page
+# Textract reads the same
+TEXT_MAX_QUALITY = 85
+
+# Weights of Pillow's RGB -> L conversion (ITU-R 601-2, 16-bit fixed point)
+L_WEIGHTS = (19595 / 65536, 38470 / 65536, 7471 / 65536)
+
+
+def _blend_lut(degenerate, factor):
+    # Image.blend(degenerate, image, factor) on every value, with the float
+    # arithmetic and truncation of Pillow's C implementation
+    values = np.arange(256, dtype=np.float32)
+    blended = np.float32(degenerate) + np.float32(factor) * (values - np.float32(degenerate))
+    return np.clip(blended, 0, 255).astype(np.uint8)
+
+
+class PointOperation:
+    """Per-value operation, fused with its neighbours into one lookup pass"""
+
+    def luts(self, histograms):
+        """One 256-entry table per band, computed from the band histograms"""
+        raise NotImplementedError
+
+
+class AutoContrast(PointOperation):
+    """ImageOps.autocontrast(image, cutoff)"""
+
+    def __init__(self, cutoff=0):
+        self.cutoff = cutoff
+        self.name = f'autocontrast({cutoff})'
+
+    def _lut(self, histogram):
+        h = list(histogram)
+        if self.cutoff:
+            low_cut, high_cut = self.cutoff if isinstance(self.cutoff, tuple) else (self.cutoff, self.cutoff)
+            n = sum(h)
+            for cut, values in ((int(n * low_cut // 100), range(256)), (int(n * high_cut // 100), range(255, -1, -1))):
+                for ix in values:
+                    if cut > h[ix]:
+                        cut -= h[ix]
+                        h[ix] = 0
+                    else:
+                        h[ix] -= cut
+                        cut = 0
+                    if cut <= 0:
+                        break
+        lo = next((ix for ix in range(256) if h[ix]), 255)
+        hi = next((ix for ix in range(255, -1, -1) if h[ix]), 0)
+        if hi <= lo:
+            return np.arange(256, dtype=np.uint8)
+        scale = 255.0 / (hi - lo)
+        offset = -lo * scale
+        return np.array([min(255, max(0, int(ix * scale + offset))) for ix in range(256)], dtype=np.uint8)
+
+    def luts(self, histograms):
+        return [self._lut(histogram) for histogram in histograms]
+
+
+class Contrast(PointOperation):
+    """ImageEnhance.Contrast(image).enhance(factor)"""
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.name = f'contrast({factor})'
+
+    def luts(self, histograms):
+        values = np.arange(256)
+        means = [float((values * histogram).sum()) / max(1, int(histogram.sum())) for histogram in histograms]
+        mean_l = means[0] if len(means) == 1 else sum(w * m for w, m in zip(L_WEIGHTS, means))
+        lut = _blend_lut(int(mean_l + 0.5), self.factor)
+        return [lut] * len(histograms)
+
+
+class Brightness(PointOperation):
+    """ImageEnhance.Brightness(image).enhance(factor)"""
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.name = f'brightness({factor})'
+
+    def luts(self, histograms):
+        return [_blend_lut(0, self.factor)] * len(histograms)
+
+
+class Sharpness:
+    """ImageEnhance.Sharpness(image).enhance(factor) as one kernel pass"""
+
+    def __init__(self, factor):
+        self.factor = factor
+        self.name = f'sharpness({factor})'
+        # factor * image + (1 - factor) * SMOOTH(image); the offset matches the
+        # rounding of the two-pass version (integer smooth, truncating blend)
+        side = (1 - factor) / 13
+        self.kernel = ImageFilter.Kernel((3, 3), [side] * 4 + [factor + 5 * side] + [side] * 4,
+                                         scale=1, offset=factor / 2 - 1)
+
+    def __call__(self, image):
+        return image.filter(self.kernel)
+
+
+class UnsharpMask:
+    def __init__(self, radius, percent, threshold):
+        self.filter = ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold)
+        self.name = f'unsharp({radius},{percent},{threshold})'
+
+    def __call__(self, image):
+        return image.filter(self.filter)
+
+
+class RotatePortrait:
+    """Rotate 90 degrees clockwise when the image is clearly taller than wide"""
+
+    def __init__(self, ratio=1.2):
+        self.ratio = ratio
+        self.name = 'rotate'
+
+    def __call__(self, image):
+        width, height = image.size
+        if height > width * self.ratio:
+            logger.debug(f"Image appears to be portrait ({width}x{height}), rotating 90 degrees clockwise")
+            image = image.rotate(-90, expand=True)
+        return image
+
+
+class AdaptiveBinarize:
+    """
+    Black text on white with a local (Gaussian weighted) threshold, so
+    shadows and uneven lighting of phone photos do not swallow the text
+
+    Args:
+        block_size: Odd neighbourhood size, default about 1% of the long side
+        offset: Constant subtracted from the local mean
+    """
+
+    def __init__(self, block_size=None, offset=15):
+        self.block_size = block_size
+        self.offset = offset
+        self.name = 'binarize'
+
+    def __call__(self, image):
+        if image.mode != 'L':
+            image = image.convert('L')
+        if not OPENCV_AVAILABLE:
+            logger.warning("OpenCV not available, binarize stage skipped (grayscale kept)")
+            return image
+        block_size = self.block_size or max(15, (max(image.size) // 100) | 1)
+        pixels = cv2.adaptiveThreshold(np.asarray(image), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                       cv2.THRESH_BINARY, block_size, self.offset)
+        return Image.fromarray(pixels)
+
+
+class Resolution:
+    """
+    Bring the image into the resolution range Textract reads best
+
+    Args:
+        min_long_side: Upscale when the longer side is below
+        max_long_side: Downscale when the longer side is above
+        min_short_side: Upscale when either side is below
+        upscale_sharpen: Stage applied after an upscale
+    """
+
+    def __init__(self, min_long_side=None, max_long_side=None, min_short_side=None, upscale_sharpen=None):
+        self.min_long_side = min_long_side
+        self.max_long_side = max_long_side
+        self.min_short_side = min_short_side
+        self.upscale_sharpen = upscale_sharpen
+        self.name = 'resolution'
+
+    def __call__(self, image):
+        width, height = image.size
+        long_side = max(width, height)
+        scale_factor = 1.0
+        if self.min_long_side and long_side < self.min_long_side:
+            scale_factor = self.min_long_side / long_side
+        elif self.min_short_side and min(width, height) < self.min_short_side:
+            scale_factor = max(self.min_short_side / width, self.min_short_side / height)
+        elif self.max_long_side and long_side > self.max_long_side:
+            scale_factor = self.max_long_side / long_side
+        if scale_factor == 1.0:
+            return image
+
+        new_size = (int(width * scale_factor), int(height * scale_factor))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+        logger.debug(f"Scaled from ({width}, {height}) to {new_size}")
+        if scale_factor > 1.0 and self.upscale_sharpen is not None:
+            # Re-apply sharpening after upscale
+            image = self.upscale_sharpen(image)
+        return image
+
+
+class Profile:
+    """
+    Preprocessing of one document type
+
+    Args:
+        name: Profile name (logs)
+        stages: Ordered stages, see the classes above
+        grayscale: Process and encode 8-bit L instead of RGB
+        bilevel: The stages end black and white, encode a 1-bit PNG
+        min_quality, max_quality, min_scale, resize_quality, resize_sharpen, encode_options:
+            Options of encode_to_size() for the final image
+    """
+
+    def __init__(self, name, stages, grayscale=False, bilevel=False, min_quality=70, max_quality=95,
+                 min_scale=0.6, resize_quality=None, resize_sharpen=None, encode_options=None):
+        self.name = name
+        self.stages = stages
+        self.grayscale = grayscale or bilevel
+        self.bilevel = bilevel
+        self.min_quality = min_quality
+        self.max_quality = max_quality
+        self.min_scale = min_scale
+        self.resize_quality = resize_quality
+        self.resize_sharpen = resize_sharpen
+        self.encode_options = encode_options or {}
+        # Decode no larger than the resolution stage keeps
+        self.max_side = next((stage.max_long_side for stage in stages
+                              if isinstance(stage, Resolution) and stage.max_long_side), None)
+
+    @property
+    def mode(self):
+        return 'L' if self.grayscale else 'RGB'
+
+    def variant(self, mode):
+        """This profile in one of PREPROCESS_MODES"""
+        if mode not in PREPROCESS_MODES:
+            raise ValueError(f"Unknown preprocessing mode: {mode}. Supported: {PREPROCESS_MODES}")
+        if mode == 'color':
+            return self
+        stages = list(self.stages)
+        if mode == 'binary':
+            stages.append(AdaptiveBinarize())
+        return Profile(f'{self.name}/{mode}', stages, grayscale=True, bilevel=mode == 'binary',
+                       min_quality=self.min_quality, max_quality=max(self.min_quality, TEXT_MAX_QUALITY),
+                       min_scale=self.min_scale,
+                       resize_quality=self.resize_quality, resize_sharpen=self.resize_sharpen,
+                       encode_options=self.encode_options)
+
+
+def _apply_points(image, operations):
+    histogram = image.histogram()
+    histograms = [np.array(histogram[band:band + 256], dtype=np.int64) for band in range(0, len(histogram), 256)]
+    total = [np.arange(256, dtype=np.uint8) for _ in histograms]
+    for operation in operations:
+        luts = operation.luts(histograms)
+        total = [lut[table] for lut, table in zip(luts, total)]
+        # Histogram of the image as it would be after this operation
+        histograms = [np.bincount(lut, weights=histogram, minlength=256).astype(np.int64)
+                      for lut, histogram in zip(luts, histograms)]
+    return image.point(np.concatenate(total).tolist())
+
+
+def apply_stages(image, stages, timings=None):
+    """Run stages on an image, fusing consecutive point operations"""
+    timings = timings if timings is not None else []
+    index = 0
+    while index < len(stages):
+        start = time.perf_counter()
+        if isinstance(stages[index], PointOperation):
+            end = index
+            while end < len(stages) and isinstance(stages[end], PointOperation):
+                end += 1
+            group = stages[index:end]
+            image = _apply_points(image, group)
+            timings.append(('+'.join(stage.name for stage in group), time.perf_counter() - start))
+            index = end
+        else:
+            image = stages[index](image)
+            timings.append((stages[index].name, time.perf_counter() - start))
+            index += 1
+    return image
+
+
+def _format_timings(timings):
+    return ', '.join(f"{name} {seconds * 1000:.0f}ms" for name, seconds in timings)
+
+
+def process_image(image, profile, filename='', timings=None, max_size_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Run a profile on a decoded image and encode it under max_size_bytes
+
+    Returns:
+        tuple: (bytes, quality, scale) as encode_to_size(), quality None
+               for a bilevel PNG
+    """
+    timings = timings if timings is not None else []
+    if image.mode != profile.mode:
+        image = image.convert(profile.mode)
+    image = apply_stages(image, profile.stages, timings)
+
+    start = time.perf_counter()
+    data = None
+    if profile.bilevel:
+        output = io.BytesIO()
+        image.convert('1', dither=Image.Dither.NONE).save(output, format='PNG', compress_level=6)
+        data, quality, scale = output.getvalue(), None, 1.0
+        if len(data) > max_size_bytes:
+            # Too much texture for PNG (photo background): grayscale JPEG
+            logger.debug(f"Bilevel PNG of {filename} is {len(data) / 1024 / 1024:.2f}MB, encoding JPEG")
+            data = None
+    if data is None:
+        data, quality, scale = encode_to_size(
+            image, max_size_bytes, min_quality=profile.min_quality, max_quality=profile.max_quality,
+            min_scale=profile.min_scale,
+            resize_quality=profile.resize_quality, sharpen=profile.resize_sharpen, **profile.encode_options
+        )
+    timings.append(('encode', time.perf_counter() - start))
+
+    logger.debug(f"Preprocessed {filename} ({profile.name}, {profile.mode}) in "
+                 f"{sum(seconds for _, seconds in timings) * 1000:.0f}ms: {_format_timings(timings)}")
+    return data, quality, scale
+
+
+def preprocess_document(image_bytes, profile, filename='', timings=None):
+    """
+    Decode, preprocess and encode a document image with a profile
+
+    Returns:
+        bytes: JPEG (PNG for bilevel profiles) under the Textract size limit
+    """
+    timings = timings if timings is not None else []
+    start = time.perf_counter()
+    max_size = (profile.max_side, profile.max_side) if profile.max_side else None
+    image = load_image(image_bytes, max_size=max_size, mode=profile.mode)
+    timings.append(('decode', time.perf_counter() - start))
+    logger.debug(f"Decoded {filename}: {image.size}, mode: {image.mode}")
+
+    data, quality, scale = process_image(image, profile, filename, timings)
+    logger.info(f"Preprocessing complete for {filename}: {len(data) / (1024 * 1024):.2f}MB "
+                f"(quality={quality}, scale={scale:.2f})")
+    return data
+
+
+# Sharpening of images scaled up or down for the size limit
+_TEXT_EDGES = UnsharpMask(radius=1.0, percent=100, threshold=2)
+
+PROFILES = {
+    # Passports: upright landscape, strong sharpening for the MRZ
+    'passport': Profile('passport', [
+        RotatePortrait(1.2),
+        AutoContrast(1),
+        Contrast(1.4),
+        Sharpness(2.0),
+        Brightness(1.02),
+        UnsharpMask(radius=2.0, percent=150, threshold=2),
+        Resolution(min_long_side=2000, max_long_side=4000, upscale_sharpen=_TEXT_EDGES),
+    ], resize_sharpen=_TEXT_EDGES),
+    # Printed certificates and transcripts with tables
+    'certificado': Profile('certificado', [
+        AutoContrast(0.5),
+        Contrast(1.3),
+        Sharpness(1.8),
+        Brightness(1.02),
+        UnsharpMask(radius=1.5, percent=120, threshold=2),
+        Resolution(min_long_side=2000, max_long_side=4000, upscale_sharpen=_TEXT_EDGES),
+    ], resize_sharpen=_TEXT_EDGES),
+    # Degree certificates: brightness first to wash out watermarks, then
+    # contrast to recover the text
+    'titulo': Profile('titulo', [
+        Brightness(1.5),
+        AutoContrast(1),
+        Contrast(1.6),
+        Sharpness(2.0),
+        UnsharpMask(radius=1.5, percent=150, threshold=2),
+        Resolution(min_long_side=2500, max_long_side=4500, upscale_sharpen=_TEXT_EDGES),
+    ], resize_sharpen=_TEXT_EDGES),
+    # Birth certificates: mild enhancement, at least 1500px on both sides
+    'acta': Profile('acta', [
+        Contrast(1.3),
+        Sharpness(1.5),
+        Brightness(1.05),
+        UnsharpMask(radius=1.5, percent=100, threshold=2),
+        Resolution(min_short_side=1500),
+    ], min_quality=60, min_scale=0.5, resize_sharpen=UnsharpMask(radius=1.0, percent=80, threshold=2)),
+    # Uploaded PDF pages rendered at 300 DPI
+    'pdf_page': Profile('pdf_page', [
+        Sharpness(1.2),
+    ], min_scale=0.5, resize_quality=80, resize_sharpen=Sharpness(1.3), encode_options={'dpi': (300, 300)}),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_profile(document_type, mode=None):
+    """
+    Profile an analyzer uses for its document type, in the variant set by
+    TEXTRACT_PREPROCESS_MODE_<TYPE> (default TEXTRACT_PREPROCESS_MODE)
+    """
+    if mode is None:
+        mode = config(f'TEXTRACT_PREPROCESS_MODE_{document_type.upper()}', default=DEFAULT_PREPROCESS_MODE)
+    return PROFILES[document_type].variant(mode)
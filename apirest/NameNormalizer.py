@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Name normalization helpers for sanctions screening
+Shared by the screening index and anything that compares prospect names
+against the restrictiva table
+"""
+
+import re
+from unidecode import unidecode
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]+')
+
+
+def normalize_name(value):
+    """
+    Upper-case, strip accents and collapse punctuation/whitespace
+
+    Args:
+        value: Raw name (any type, None allowed)
+
+    Returns:
+        str: Normalized name, e.g. 'José  Pérez-Díaz' -> 'JOSE PEREZ DIAZ'
+    """
+    if not value:
+        return ''
+    text = unidecode(str(value)).upper()
+    return _NON_ALNUM.sub(' ', text).strip()
+
+
+def name_tokens(normalized):
+    """Split an already normalized name into its tokens"""
+    return normalized.split() if normalized else []
+
+
+def char_ngrams(normalized, size=3):
+    """
+    Character n-grams of a normalized name, padded with one space on each side
+    so that short tokens and word boundaries still produce grams
+
+    Args:
+        normalized: Output of normalize_name()
+        size: Gram length (default 3)
+
+    Returns:
+        set: Distinct n-grams
+    """
+    if not normalized:
+        return set()
+    padded = f' {normalized} '
+    if len(padded) <= size:
+        return {padded}
+    return {padded[i:i + size] for i in range(len(padded) - size + 1)}
+
+
+def sorted_name(normalized):
+    """Tokens in alphabetical order, so 'PEREZ JUAN' and 'JUAN PEREZ' match"""
+    return ' '.join(sorted(name_tokens(normalized)))
+
+
+# Ordered rewrites for the phonetic key, tuned for Spanish and transliterated
+# names: equivalent spellings collapse to the same key
+_PHONETIC_RULES = [
+    (re.compile(r'X'), 'KS'),
+    (re.compile(r'CH'), 'X'),
+    (re.compile(r'PH'), 'F'),
+    (re.compile(r'LL'), 'Y'),
+    (re.compile(r'QU'), 'K'),
+    (re.compile(r'C([EI])'), r'S\1'),
+    (re.compile(r'G([EI])'), r'J\1'),
+    (re.compile(r'[CQ]'), 'K'),
+    (re.compile(r'Z'), 'S'),
+    (re.compile(r'V'), 'B'),
+    (re.compile(r'W'), 'U'),
+    (re.compile(r'Y'), 'I'),
+    (re.compile(r'(?<!S)H|(?<=^)H'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+
+
+def phonetic_key(normalized):
+    """
+    Phonetic key of a normalized name, token by token
+
+    Args:
+        normalized: Output of normalize_name()
+
+    Returns:
+        str: e.g. 'MOHAMMED HASSAN' and 'MOHAMED HASAN' -> 'MOAMED ASAN'
+    """
+    keys = []
+    for token in name_tokens(normalized):
+        for pattern, replacement in _PHONETIC_RULES:
+            token = pattern.sub(replacement, token)
+        if token:
+            keys.append(token)
+    return ' '.join(keys)
+
+
+_ALIAS_SEPARATORS = re.compile(r'[;|\n]+')
+_ALIAS_PREFIX = re.compile(r'^\s*(?:[afn]\.?\s*k\.?\s*a\.?|alias)\s*', re.IGNORECASE)
+
+
+def split_aliases(also_known_as):
+    """
+    Split an also_known_as field into individual aliases
+
+    Handles OFAC style values such as "a.k.a. 'JUAN P'; f.k.a. 'J. PEREZ'"
+
+    Returns:
+        list: Alias strings without prefixes or quotes, duplicates removed
+    """
+    if not also_known_as:
+        return []
+    aliases = []
+    for part in _ALIAS_SEPARATORS.split(str(also_known_as)):
+        alias = _ALIAS_PREFIX.sub('', part).strip().strip('"\'').strip()
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def name_variants(name, also_known_as):
+    """
+    Searchable forms of a listed entry: its name followed by its aliases
+
+    Returns:
+        list: dicts with tipo ('name'/'aka'), valor, normalizado, ordenado
+              and fonetico, ready for restrictiva_nombre
+    """
+    variants = []
+    seen = set()
+    for tipo, valor in [('name', name)] + [('aka', alias) for alias in split_aliases(also_known_as)]:
+        normalizado = normalize_name(valor)
+        if not normalizado or normalizado in seen:
+            continue
+        seen.add(normalizado)
+        variants.append({
+            'tipo': tipo,
+            'valor': str(valor)[:255],
+            'normalizado': normalizado,
+            'ordenado': sorted_name(normalizado),
+            'fonetico': phonetic_key(normalizado),
+        })
+    return variants
@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""
+Tiered QR decoding engine used by QRCodeReader
+
+A single pyzbar pass at full resolution is slow on large photos and misses
+codes that are small, skewed, shadowed or printed on a document (CURP on
+an ID photo). decode_qr() works on 8-bit grayscale in two tiers:
+
+1. fast: pyzbar on the image reduced to QR_FAST_SIDE, which decodes the
+   common case (QR clearly visible) in a few milliseconds
+2. only on a miss, these strategies run concurrently and the first one
+   that decodes wins (the others stop at their next step):
+   - full: pyzbar at ESCALATION_SIDE, then at full resolution (small codes)
+   - crops: regions around the finder patterns (three nested squares),
+     cropped at full resolution, padded and upscaled
+   - threshold: Otsu and adaptive binarization (shadows, low contrast)
+   - rotations: pyzbar on the image rotated by QR_ROTATIONS degrees
+   - opencv: cv2 QR detector (Aruco based when available)
+
+Strategies are only handed to the shared QR pool when one of its threads
+is free (QR_DECODE_WORKERS slots); the calling thread runs the rest itself,
+so no call waits behind other images' escalations and its deadline only
+counts decoding time.
+
+Symbols come back in the coordinates of the image given to decode_qr().
+
+locate_qr() only finds the candidate regions, for callers that can fetch
+them again at a higher resolution (PDF pages re-rendered by clip).
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import cv2
+import numpy as np
+from decouple import config
+from pyzbar import pyzbar
+
+logger = logging.getLogger('apirest.qr')
+
+# Long side of the fast first pass
+QR_FAST_SIDE = config('QR_FAST_SIDE', default=1280, cast=int)
+# Threads running the escalation strategies (shared by all requests)
+QR_WORKERS = config('QR_DECODE_WORKERS', default=4, cast=int)
+# Give up on an image after this many seconds of escalation
+QR_DECODE_TIMEOUT = config('QR_DECODE_TIMEOUT', default=10.0, cast=float)
+QR_ROTATIONS = (15, -15, 30, -30, 45)
+# Long side strategies other than full/crops work at
+ESCALATION_SIDE = 2000
+MAX_CROPS = 6
+
+_executor = None
+_executor_lock = threading.Lock()
+# Free threads of the pool; a strategy is only submitted holding one
+_slots = threading.BoundedSemaphore(QR_WORKERS)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=QR_WORKERS, thread_name_prefix='qr')
+        return _executor
+
+
+class QRSymbol:
+    """Decoded code: type, data (bytes), polygon [(x, y)] and pyzbar extras"""
+
+    def __init__(self, type, data, polygon, quality=None, orientation=None):
+        self.type = type
+        self.data = data
+        self.polygon = polygon
+        self.quality = quality
+        self.orientation = orientation
+
+    @property
+    def rect(self):
+        """(left, top, width, height) bounding the polygon"""
+        xs = [x for x, _ in self.polygon]
+        ys = [y for _, y in self.polygon]
+        return min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys)
+
+    def mapped(self, transform):
+        points = [transform(x, y) for x, y in self.polygon]
+        return QRSymbol(self.type, self.data, [(int(round(x)), int(round(y))) for x, y in points],
+                        self.quality, self.orientation)
+
+
+def _scale_transform(factor, offset=(0, 0)):
+    return lambda x, y: (x / factor + offset[0], y / factor + offset[1])
+
+
+def _resize(gray, long_side):
+    """Gray image with its long side reduced to long_side, and the factor"""
+    height, width = gray.shape
+    factor = min(1.0, long_side / max(width, height))
+    if factor == 1.0:
+        return gray, 1.0
+    size = (max(1, int(width * factor)), max(1, int(height * factor)))
+    return cv2.resize(gray, size, interpolation=cv2.INTER_AREA), factor
+
+
+def _zbar(gray):
+    symbols = []
+    for code in pyzbar.decode(gray):
+        symbols.append(QRSymbol(code.type, code.data, [(point.x, point.y) for point in code.polygon],
+                                getattr(code, 'quality', None), getattr(code, 'orientation', None)))
+    return symbols
+
+
+def _zbar_scaled(gray, factor, offset=(0, 0)):
+    return [symbol.mapped(_scale_transform(factor, offset)) for symbol in _zbar(gray)]
+
+
+def _strategy_full(gray, stop):
+    small, factor = _resize(gray, ESCALATION_SIDE)
+    if factor != 1.0:
+        symbols = _zbar_scaled(small, factor)
+        if symbols or stop.is_set():
+            return symbols
+    return _zbar(gray)
+
+
+def _strategy_threshold(gray, stop):
+    small, factor = _resize(gray, ESCALATION_SIDE)
+    blurred = cv2.GaussianBlur(small, (3, 3), 0)
+    _, otsu = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    symbols = _zbar_scaled(otsu, factor)
+    if symbols or stop.is_set():
+        return symbols
+    block_size = max(31, (max(small.shape) // 40) | 1)
+    adaptive = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, 5)
+    return _zbar_scaled(adaptive, factor)
+
+
+def _strategy_rotations(gray, stop):
+    small, factor = _resize(gray, ESCALATION_SIDE)
+    height, width = small.shape
+    for angle in QR_ROTATIONS:
+        if stop.is_set():
+            break
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), angle, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        new_width, new_height = int(height * sin + width * cos), int(height * cos + width * sin)
+        matrix[0, 2] += new_width / 2 - width / 2
+        matrix[1, 2] += new_height / 2 - height / 2
+        rotated = cv2.warpAffine(small, matrix, (new_width, new_height), borderValue=255)
+        symbols = _zbar(rotated)
+        if symbols:
+            inverse = cv2.invertAffineTransform(matrix)
+
+            def transform(x, y, inverse=inverse):
+                rx = inverse[0, 0] * x + inverse[0, 1] * y + inverse[0, 2]
+                ry = inverse[1, 0] * x + inverse[1, 1] * y + inverse[1, 2]
+                return rx / factor, ry / factor
+            return [symbol.mapped(transform) for symbol in symbols]
+    return []
+
+
+def _finder_regions(gray):
+    """Full resolution (x0, y0, x1, y1) regions around finder pattern groups"""
+    small, factor = _resize(gray, ESCALATION_SIDE)
+    binary = cv2.adaptiveThreshold(cv2.GaussianBlur(small, (3, 3), 0), 255, cv2.ADAPTIVE_THRESH_MEAN_C,
+                                   cv2.THRESH_BINARY_INV, max(15, (max(small.shape) // 60) | 1), 7)
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return []
+    hierarchy = hierarchy[0]
+
+    finders = []
+    for index, contour in enumerate(contours):
+        # Finder pattern: a square with a square inside a square
+        child = hierarchy[index][2]
+        if child < 0 or hierarchy[child][2] < 0:
+            continue
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 7 or h < 7 or not 0.7 < w / h < 1.4:
+            continue
+        if cv2.contourArea(contour) < 0.5 * w * h:
+            continue
+        finders.append((x + w / 2, y + h / 2, max(w, h)))
+
+    # Finders of one code lie within a few code widths of each other
+    groups = []
+    for finder in sorted(finders, key=lambda f: -f[2]):
+        for group in groups:
+            cx, cy, size = group[0]
+            if abs(finder[2] - size) < 0.5 * size and abs(finder[0] - cx) < 12 * size and abs(finder[1] - cy) < 12 * size:
+                group.append(finder)
+                break
+        else:
+            groups.append([finder])
+    groups.sort(key=len, reverse=True)
+
+    regions = []
+    height, width = gray.shape
+    for group in groups[:MAX_CROPS]:
+        size = max(f[2] for f in group)
+        xs = [f[0] for f in group]
+        ys = [f[1] for f in group]
+        # Three finders bound the code, fewer only locate one corner
+        margin = size * (1.5 if len(group) >= 3 else 7)
+        x0, y0 = max(0, (min(xs) - margin) / factor), max(0, (min(ys) - margin) / factor)
+        x1, y1 = min(width, (max(xs) + margin) / factor), min(height, (max(ys) + margin) / factor)
+        regions.append((int(x0), int(y0), int(x1), int(y1)))
+    return regions
+
+
+def _strategy_crops(gray, stop):
+    for x0, y0, x1, y1 in _finder_regions(gray):
+        if stop.is_set():
+            break
+        crop = gray[y0:y1, x0:x1]
+        if crop.size == 0:
+            continue
+        # Small codes decode better upscaled, with a white quiet zone
+        factor = 2.0 if max(crop.shape) < 400 else 1.0
+        if factor != 1.0:
+            crop = cv2.resize(crop, None, fx=factor, fy=factor, interpolation=cv2.INTER_CUBIC)
+        pad = 16
+        crop = cv2.copyMakeBorder(crop, pad, pad, pad, pad, cv2.BORDER_CONSTANT, value=255)
+        symbols = _zbar(crop)
+        if symbols:
+            return [symbol.mapped(lambda x, y: ((x - pad) / factor + x0, (y - pad) / factor + y0))
+                    for symbol in symbols]
+    return []
+
+
+def _strategy_opencv(gray, stop):
+    small, factor = _resize(gray, ESCALATION_SIDE)
+    detector = cv2.QRCodeDetectorAruco() if hasattr(cv2, 'QRCodeDetectorAruco') else cv2.QRCodeDetector()
+    found, points = detector.detectMulti(small)
+    if not found or points is None or stop.is_set():
+        return []
+    found, texts, points = detector.decodeMulti(small, points)
+    if not found or points is None:
+        return []
+    symbols = []
+    for text, quad in zip(texts, points):
+        if text:
+            symbol = QRSymbol('QRCODE', text.encode('utf-8'), [(float(x), float(y)) for x, y in quad])
+            symbols.append(symbol.mapped(_scale_transform(factor)))
+    return symbols
+
+
+ESCALATION_STRATEGIES = (
+    ('full', _strategy_full),
+    ('crops', _strategy_crops),
+    ('threshold', _strategy_threshold),
+    ('rotations', _strategy_rotations),
+    ('opencv', _strategy_opencv),
+)
+
+
+def _run_in_slot(strategy, gray, stop):
+    try:
+        return strategy(gray, stop)
+    finally:
+        _slots.release()
+
+
+def decode_qr(gray, timeout=None):
+    """
+    Decode the QR codes of a grayscale image
+
+    Args:
+        gray: 2D uint8 NumPy array (or PIL Image in mode L)
+        timeout: Seconds allowed to the escalation (default QR_DECODE_TIMEOUT)
+
+    Returns:
+        tuple: (list of QRSymbol, name of the strategy that decoded them or None)
+    """
+    gray = np.asarray(gray)
+    if gray.ndim == 3:
+        gray = cv2.cvtColor(gray, cv2.COLOR_RGB2GRAY)
+    start = time.perf_counter()
+
+    small, factor = _resize(gray, QR_FAST_SIDE)
+    symbols = _zbar_scaled(small, factor)
+    if symbols:
+        logger.debug(f"QR decoded by the fast pass in {(time.perf_counter() - start) * 1000:.0f}ms")
+        return symbols, 'fast'
+
+    stop = threading.Event()
+    escalation_timeout = QR_DECODE_TIMEOUT if timeout is None else timeout
+    deadline = time.perf_counter() + escalation_timeout
+    # Strategies check stop between steps, so they also end at the deadline
+    timer = threading.Timer(escalation_timeout, stop.set)
+    timer.daemon = True
+    timer.start()
+    queue = list(ESCALATION_STRATEGIES)
+    names = {}
+    pending = set()
+    try:
+        while (queue or pending) and not stop.is_set():
+            # Hand strategies to the pool only while it has a free thread
+            while queue and _slots.acquire(blocking=False):
+                name, strategy = queue.pop(0)
+                future = _get_executor().submit(_run_in_slot, strategy, gray, stop)
+                names[future] = name
+                pending.add(future)
+            if queue and not pending:
+                # Pool busy with other images: run the next strategy here
+                name, strategy = queue.pop(0)
+                done = [(name, _run_strategy(name, strategy, gray, stop))]
+            else:
+                finished, pending = wait(pending, timeout=max(0, deadline - time.perf_counter()),
+                                         return_when=FIRST_COMPLETED)
+                done = [(names[future], _future_symbols(names[future], future)) for future in finished]
+            for name, symbols in done:
+                if symbols:
+                    logger.debug(f"QR decoded by {name} in {(time.perf_counter() - start) * 1000:.0f}ms")
+                    return symbols, name
+        if stop.is_set():
+            logger.warning(f"QR decoding timed out after {time.perf_counter() - start:.1f}s")
+    finally:
+        stop.set()
+        timer.cancel()
+    return [], None
+
+
+def _run_strategy(name, strategy, gray, stop):
+    try:
+        return strategy(gray, stop)
+    except Exception as e:
+        logger.warning(f"QR strategy {name} failed: {type(e).__name__}: {str(e)}")
+        return []
+
+
+def _future_symbols(name, future):
+    try:
+        return future.result()
+    except Exception as e:
+        logger.warning(f"QR strategy {name} failed: {type(e).__name__}: {str(e)}")
+        return []
+
+
+def _merge_regions(regions):
+    """Union overlapping (x0, y0, x1, y1) boxes"""
+    merged = []
+    for box in sorted(regions, key=lambda r: (r[2] - r[0]) * (r[3] - r[1]), reverse=True):
+        for index, other in enumerate(merged):
+            if box[0] < other[2] and other[0] < box[2] and box[1] < other[3] and other[1] < box[3]:
+                merged[index] = (min(box[0], other[0]), min(box[1], other[1]),
+                                 max(box[2], other[2]), max(box[3], other[3]))
+                break
+        else:
+            merged.append(box)
+    return merged
+
+
+def locate_qr(gray):
+    """
+    Regions likely to hold a QR code, without needing it to decode
+
+    Used on low resolution previews (PDF pages): codes that already decode
+    there, quads found by the OpenCV detector and finder pattern groups,
+    each with a quiet zone margin.
+
+    Returns:
+        list: (x0, y0, x1, y1) regions in the coordinates of gray, at most MAX_CROPS
+    """
+    gray = np.asarray(gray)
+    height, width = gray.shape
+    quads = [symbol.polygon for symbol in _zbar(gray)]
+    try:
+        found, points = cv2.QRCodeDetector().detectMulti(gray)
+        if found and points is not None:
+            quads.extend([(float(x), float(y)) for x, y in quad] for quad in points)
+    except cv2.error as e:
+        logger.debug(f"QR detector failed on preview: {str(e)}")
+
+    regions = []
+    for quad in quads:
+        xs = [x for x, _ in quad]
+        ys = [y for _, y in quad]
+        margin = 0.25 * max(max(xs) - min(xs), max(ys) - min(ys), 8)
+        regions.append((max(0, int(min(xs) - margin)), max(0, int(min(ys) - margin)),
+                        min(width, int(max(xs) + margin + 1)), min(height, int(max(ys) + margin + 1))))
+    regions.extend(_finder_regions(gray))
+    return _merge_regions(regions)[:MAX_CROPS]
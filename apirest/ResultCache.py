@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache for Rekognition and Textract responses
+
+Entries are keyed by (operation, S3 ETag or content hash, preprocessing
+parameters), so a client retrying the same file gets the stored AWS response
+instead of paying for (and waiting on) the call again. Two tiers:
+
+- local: per-process LRU bounded by RESULT_CACHE_LOCAL_ENTRIES / _BYTES
+- shared: RESULT_CACHE_BACKEND = 'django' (a CACHES alias) or 'sqlite'
+  (one file shared by the workers of a host), or 'none'
+
+Both expire entries after RESULT_CACHE_TTL seconds. Only successful AWS
+responses are stored; exceptions propagate and are never cached.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from decouple import config
+
+from apirest.BatchExecutor import call_aws, PageTimeout
+
+logger = logging.getLogger('apirest.aws')
+
+CACHE_ENABLED = config('RESULT_CACHE_ENABLED', default=True, cast=bool)
+CACHE_TTL = config('RESULT_CACHE_TTL', default=86400, cast=int)
+LOCAL_MAX_ENTRIES = config('RESULT_CACHE_LOCAL_ENTRIES', default=256, cast=int)
+LOCAL_MAX_BYTES = config('RESULT_CACHE_LOCAL_BYTES', default=64 * 1024 * 1024, cast=int)
+SHARED_BACKEND = config('RESULT_CACHE_BACKEND', default='none')
+DJANGO_CACHE_ALIAS = config('RESULT_CACHE_DJANGO_ALIAS', default='default')
+SQLITE_PATH = config('RESULT_CACHE_SQLITE_PATH', default='logs/result_cache.sqlite3')
+SQLITE_MAX_ENTRIES = config('RESULT_CACHE_SQLITE_ENTRIES', default=20000, cast=int)
+
+
+def content_digest(data):
+    """Digest of the file content, for callers that already have the bytes"""
+    return 'sha256:' + hashlib.sha256(data).hexdigest()
+
+
+def s3_digest(s3_client, bucket, key):
+    """
+    Digest of an S3 object from its ETag (one HEAD request, no download),
+    for calls that hand AWS an S3Object instead of the bytes
+
+    Returns:
+        str or None: None when caching is disabled or the object cannot be
+                     inspected, which simply disables caching for that call
+    """
+    if not CACHE_ENABLED:
+        return None
+    try:
+        head = call_aws('s3', s3_client.head_object, Bucket=bucket, Key=key)
+    except PageTimeout:
+        raise
+    except Exception as e:
+        logger.debug(f"Result cache: no ETag for {bucket}/{key}: {str(e)}")
+        return None
+    return etag_digest(bucket, head.get('ETag'))
+
+
+def etag_digest(bucket, etag):
+    """Digest from an ETag already returned by get_object/head_object"""
+    if not etag:
+        return None
+    etag = etag.strip('"')
+    return f"etag:{bucket}:{etag}"
+
+
+class LocalTier:
+    """Thread-safe LRU of pickled values, bounded by entries and bytes"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires, blob = entry
+            if expires < time.time():
+                self._pop(key)
+                return None
+            self._data.move_to_end(key)
+            return blob
+
+    def set(self, key, blob, ttl):
+        if len(blob) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._pop(key)
+            self._data[key] = (time.time() + ttl, blob)
+            self._bytes += len(blob)
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                self._pop(next(iter(self._data)))
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _pop(self, key):
+        _, blob = self._data.pop(key)
+        self._bytes -= len(blob)
+
+
+class DjangoTier:
+    """Shared tier on a Django cache backend (Redis, Memcached, database...)"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def get(self, key):
+        from django.core.cache import caches
+        return caches[self.alias].get(key)
+
+    def set(self, key, blob, ttl):
+        from django.core.cache import caches
+        caches[self.alias].set(key, blob, ttl)
+
+    def clear(self):
+        # Entries share the backend with other data: let them expire
+        pass
+
+
+class SqliteTier:
+    """Shared tier in a SQLite file, one connection per thread"""
+
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS result_cache '
+                         '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL, created REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS result_cache_created ON result_cache (created)')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connection().execute(
+            'SELECT value FROM result_cache WHERE key = ? AND expires >= ?', (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, blob, ttl):
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO result_cache (key, value, expires, created) VALUES (?, ?, ?, ?)',
+                         (key, blob, now + ttl, now))
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._evict(now)
+
+    def _evict(self, now):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM result_cache WHERE expires < ?', (now,))
+            conn.execute('DELETE FROM result_cache WHERE key IN (SELECT key FROM result_cache '
+                         'ORDER BY created DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def clear(self):
+        with self._connection() as conn:
+            conn.execute('DELETE FROM result_cache')
+
+
+def _shared_tier():
+    if SHARED_BACKEND == 'django':
+        return DjangoTier(DJANGO_CACHE_ALIAS)
+    if SHARED_BACKEND == 'sqlite':
+        try:
+            return SqliteTier(SQLITE_PATH, SQLITE_MAX_ENTRIES)
+        except Exception as e:
+            logger.warning(f"Result cache: SQLite tier disabled ({SQLITE_PATH}): {str(e)}")
+    return None
+
+
+_local_tier = LocalTier(LOCAL_MAX_ENTRIES, LOCAL_MAX_BYTES)
+_shared = None
+_shared_lock = threading.Lock()
+_shared_ready = False
+
+
+def _get_shared():
+    global _shared, _shared_ready
+    if not _shared_ready:
+        with _shared_lock:
+            if not _shared_ready:
+                _shared = _shared_tier()
+                _shared_ready = True
+    return _shared
+
+
+def cache_key(operation, digest, params=None):
+    material = json.dumps([operation, digest, params or {}], sort_keys=True, default=str)
+    return 'rc:' + hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def cached_call(operation, digest, params, call):
+    """
+    AWS response for (operation, digest, params), calling AWS only on a miss
+
+    Args:
+        operation: Name of the call, e.g. 'textract.analyze_id'
+        digest: content_digest()/s3_digest()/etag_digest() of the input, None disables caching
+        params: Dict of everything else that changes the response
+                (preprocessing, feature types...)
+        call: Function performing the AWS request (and any preprocessing)
+
+    Returns:
+        The response of call(), a fresh copy on every cache hit
+    """
+    if not CACHE_ENABLED or digest is None:
+        return call()
+
+    key = cache_key(operation, digest, params)
+    blob = _local_tier.get(key)
+    tier = 'local'
+    if blob is None:
+        shared = _get_shared()
+        if shared is not None:
+            try:
+                blob = shared.get(key)
+                tier = 'shared'
+            except Exception as e:
+                logger.warning(f"Result cache: shared tier read failed: {str(e)}")
+            if blob is not None:
+                _local_tier.set(key, blob, CACHE_TTL)
+
+    if blob is not None:
+        try:
+            response = pickle.loads(blob)
+            logger.info(f"Result cache hit ({tier}) for {operation} {digest}")
+            return response
+        except Exception as e:
+            logger.warning(f"Result cache: discarding unreadable entry for {operation}: {str(e)}")
+
+    response = call()
+    try:
+        blob = pickle.dumps(response, protocol=pickle.HIGHEST_PROTOCOL)
+        _local_tier.set(key, blob, CACHE_TTL)
+        shared = _get_shared()
+        if shared is not None:
+            shared.set(key, blob, CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Result cache: could not store {operation} response: {str(e)}")
+    return response
+
+
+def clear_result_cache():
+    """Drop every cached response (local tier and SQLite tier)"""
+    _local_tier.clear()
+    shared = _get_shared()
+    if shared is not None:
+        shared.clear()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Typed results of the analyzers (consult2, consult45, consult46, consult47)
+Rows are plain dicts (TypedDict) or slotted dataclasses kept in a ResultList,
+which serializes straight to the list of dicts the views respond with.
+pandas is only imported when a caller really asks for a DataFrame.
+"""
+
+from dataclasses import dataclass
+from typing import TypedDict
+
+NO_MATCH = 'No Match'
+
+
+class ScreeningHit(TypedDict):
+    """consult2 hit, keys in the order of the API response"""
+    nombres: str
+    Puntos: int
+    Base_de_Datos: str
+    Prospecto: str
+    id: int
+    Coincidencia: str
+
+
+@dataclass(slots=True)
+class FaceResult:
+    """consult46/consult47 response row"""
+    cod: str
+    coincidencia: str
+
+    def to_dict(self):
+        return {'cod': self.cod, 'coincidencia': self.coincidencia}
+
+
+class ResultList(list):
+    """List of result rows with the bits of the DataFrame API the views used"""
+    __slots__ = ()
+
+    @property
+    def empty(self):
+        return not self
+
+    def to_dicts(self):
+        """Rows as new dicts, ready for Response()"""
+        return [row.to_dict() if hasattr(row, 'to_dict') else dict(row) for row in self]
+
+    def to_dataframe(self):
+        """Rows as a pandas DataFrame, for tabular export only"""
+        import pandas as pd
+        return pd.DataFrame(self.to_dicts())
+
+
+def replace_no_match(rows, row):
+    """
+    Add a face result, dropping the initial 'No Match' row
+    (what df[df['coincidencia'] != 'No Match'] + concat used to do)
+    """
+    return ResultList([r for r in rows if r.coincidencia != NO_MATCH] + [row])
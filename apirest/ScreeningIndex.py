@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory screening index for the restrictiva (sanctions) table
+Built once per worker process from the precomputed restrictiva_nombre rows
+(names and aliases) and kept up to date incrementally, so that
+consult2.comparar only runs fuzzy scoring on a small candidate set instead
+of scanning the whole table on every request
+
+snapshot() returns an immutable view of the index for long readers (bulk
+screening): the structures are shared until the next upsert/remove, which
+copies them first (copy-on-write), so a snapshot never sees an edit made
+after it was taken.
+"""
+
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+
+from decouple import config
+from django.db import connection, transaction
+from django.db.models import Count, Max, Q
+
+from apirest.models import restrictiva_nombre, lista_version
+from apirest.NameNormalizer import normalize_name, name_tokens, char_ngrams, phonetic_key, sorted_name
+
+# Configure logger for screening operations
+logger = logging.getLogger('apirest.screening')
+
+
+class ScreeningIndex:
+    """
+    Character n-gram / token blocking index over restrictiva names and aliases
+
+    Candidate selection is a blocking step only: callers still compute the
+    exact fuzzy score on the returned candidates.
+    """
+
+    def __init__(self, ngram_size=3):
+        self.ngram_size = ngram_size
+        # Prospects shorter than this (normalized) do not carry enough grams
+        # for blocking, every listed name is scored instead
+        self.min_blocking_length = config('SCREENING_MIN_BLOCKING_LENGTH', default=5, cast=int)
+        # How often to compare the table fingerprint with the loaded data
+        self.check_interval = config('SCREENING_INDEX_CHECK_SECONDS', default=60, cast=int)
+        # Full rebuild period, catches edits made by other worker processes
+        self.max_age = config('SCREENING_INDEX_MAX_AGE', default=3600, cast=int)
+
+        self._lock = threading.RLock()
+        # restrictiva_nombre id -> (upper-cased text, grams, tokens, restrictiva id)
+        self._entries = {}
+        # restrictiva id -> (upper-cased name, list, restrictiva_nombre ids)
+        self._records = {}
+        self._gram_postings = defaultdict(set)
+        self._token_postings = defaultdict(set)
+        self._built_at = None
+        self._checked_at = 0
+        self._fingerprint = None
+        # Bumped on every change; identifies the content of a snapshot
+        self.generation = 0
+        # Structures shared with a snapshot, copied before the next edit
+        self._shared = False
+        self._frozen = False
+
+    def __getstate__(self):
+        # Locks cannot be pickled; snapshots shipped to worker processes
+        # are read-only anyway
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def snapshot(self):
+        """Immutable view of the current content, see the module docstring"""
+        with self._lock:
+            frozen = ScreeningIndex.__new__(ScreeningIndex)
+            frozen.__setstate__(self.__getstate__())
+            frozen._frozen = True
+            self._shared = True
+            return frozen
+
+    def _unshare(self):
+        if self._frozen:
+            raise RuntimeError('Screening index snapshots are read-only')
+        if not self._shared:
+            return
+        # Record tuples and entry grams/tokens are never edited in place;
+        # the dicts and posting sets are
+        self._entries = dict(self._entries)
+        self._records = dict(self._records)
+        self._gram_postings = defaultdict(set, {gram: set(nids) for gram, nids in self._gram_postings.items()})
+        self._token_postings = defaultdict(set, {token: set(nids) for token, nids in self._token_postings.items()})
+        self._shared = False
+
+    @property
+    def is_built(self):
+        return self._built_at is not None
+
+    def __len__(self):
+        return len(self._records)
+
+    def _table_fingerprint(self):
+        # restrictiva_nombre rows are recreated on every edit, so the max id
+        # also moves when an existing entry changes; a new lista_version
+        # means load_sanctions_list replaced a whole list
+        stats = restrictiva_nombre.objects.aggregate(total=Count('id'), last_id=Max('id'))
+        last_version = lista_version.objects.aggregate(last=Max('id'))['last']
+        return stats['total'], stats['last_id'], last_version
+
+    def build(self):
+        """Load every restrictiva name and alias into a fresh index and swap it in"""
+        started = time.monotonic()
+        fingerprint = self._table_fingerprint()
+
+        fresh = ScreeningIndex(self.ngram_size)
+        rows = (restrictiva_nombre.objects
+                .order_by('restrictiva_id', 'id')
+                .values_list('id', 'restrictiva_id', 'valor', 'normalizado', 'fonetico',
+                             'restrictiva__name', 'restrictiva__list')
+                .iterator(chunk_size=5000))
+        for nid, rid, valor, normalizado, fonetico, name, lista in rows:
+            if rid not in fresh._records:
+                fresh._records[rid] = (str(name).upper(), lista, [])
+            fresh._add(nid, rid, valor, normalizado, fonetico)
+
+        with self._lock:
+            if self._frozen:
+                raise RuntimeError('Screening index snapshots are read-only')
+            self._entries = fresh._entries
+            self._records = fresh._records
+            self._gram_postings = fresh._gram_postings
+            self._token_postings = fresh._token_postings
+            self._shared = False
+            self.generation += 1
+            self._fingerprint = fingerprint
+            self._built_at = time.monotonic()
+            self._checked_at = self._built_at
+
+        logger.info(f"Screening index built with {len(self._records)} entries / {len(self._entries)} names "
+                    f"in {(time.monotonic() - started) * 1000:.0f}ms")
+
+    def ensure_fresh(self):
+        """Build on first use and rebuild when the table changed underneath us"""
+        if self._frozen:
+            return
+        now = time.monotonic()
+        if not self.is_built:
+            self.build()
+            return
+        if now - self._built_at >= self.max_age:
+            logger.debug("Screening index reached max age, rebuilding")
+            self.build()
+            return
+        if now - self._checked_at < self.check_interval:
+            return
+
+        self._checked_at = now
+        if self._table_fingerprint() != self._fingerprint:
+            logger.info("restrictiva table changed, rebuilding screening index")
+            self.build()
+
+    def _add(self, nid, rid, valor, normalizado, fonetico):
+        grams = char_ngrams(normalizado, self.ngram_size)
+        tokens = set(name_tokens(normalizado))
+        tokens.update(f'~{token}' for token in name_tokens(fonetico))
+
+        self._entries[nid] = (str(valor).upper(), grams, tokens, rid)
+        self._records[rid][2].append(nid)
+        for gram in grams:
+            self._gram_postings[gram].add(nid)
+        for token in tokens:
+            self._token_postings[token].add(nid)
+
+    def _discard(self, rid):
+        record = self._records.pop(rid, None)
+        if record is None:
+            return
+        for nid in record[2]:
+            _, grams, tokens, _ = self._entries.pop(nid)
+            for gram in grams:
+                postings = self._gram_postings.get(gram)
+                if postings is not None:
+                    postings.discard(nid)
+                    if not postings:
+                        del self._gram_postings[gram]
+            for token in tokens:
+                postings = self._token_postings.get(token)
+                if postings is not None:
+                    postings.discard(nid)
+                    if not postings:
+                        del self._token_postings[token]
+
+    def upsert(self, rid, name, lista, nombres):
+        """
+        Insert or refresh a single restrictiva row
+
+        Args:
+            rid: restrictiva id
+            name: restrictiva name
+            lista: restrictiva list
+            nombres: restrictiva_nombre rows of the entry
+        """
+        with self._lock:
+            self._unshare()
+            self.generation += 1
+            self._discard(rid)
+            self._records[rid] = (str(name).upper(), lista, [])
+            for nombre in nombres:
+                self._add(nombre.id, rid, nombre.valor, nombre.normalizado, nombre.fonetico)
+            if self._fingerprint is not None:
+                _, last_id, last_version = self._fingerprint
+                last_id = max([last_id or 0] + [nombre.id for nombre in nombres])
+                self._fingerprint = (len(self._entries), last_id, last_version)
+
+    def remove(self, rid):
+        """Drop a restrictiva row from the index"""
+        with self._lock:
+            self._unshare()
+            self.generation += 1
+            self._discard(rid)
+            if self._fingerprint is not None:
+                _, last_id, last_version = self._fingerprint
+                self._fingerprint = (len(self._entries), last_id, last_version)
+
+    def _min_shared_grams(self, gram_count, threshold):
+        """
+        Minimum number of shared grams for a pair to be worth scoring.
+        Each substituted character removes at most ngram_size grams, and a
+        score of `threshold` allows roughly (1 - threshold/100) substitutions
+        per character of the shorter name.
+        """
+        ratio = max(0.2, 1 - self.ngram_size * (1 - threshold / 100))
+        return max(1, int(gram_count * ratio))
+
+    def candidates(self, prospect, threshold):
+        """
+        Select the listed names and aliases that may score at least
+        `threshold` against the prospect
+
+        Args:
+            prospect: Raw prospect name
+            threshold: Minimum fuzzy score (0-100) the caller will accept
+
+        Returns:
+            list: (restrictiva id, upper-cased name or alias, list,
+                   upper-cased restrictiva name) tuples, names before aliases
+        """
+        normalized = normalize_name(prospect)
+        if not normalized:
+            return []
+
+        grams = char_ngrams(normalized, self.ngram_size)
+        tokens = set(name_tokens(normalized))
+        tokens.update(f'~{token}' for token in name_tokens(phonetic_key(normalized)))
+
+        with self._lock:
+            if len(normalized) < self.min_blocking_length:
+                selected = self._entries.keys()
+            else:
+                selected = set()
+                for token in tokens:
+                    selected.update(self._token_postings.get(token, ()))
+
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._gram_postings.get(gram, ()))
+
+                for nid, count in shared.items():
+                    entry_grams = len(self._entries[nid][1])
+                    if count >= self._min_shared_grams(min(len(grams), entry_grams), threshold):
+                        selected.add(nid)
+
+            result = []
+            for nid in sorted(selected, key=lambda nid: (self._entries[nid][3], nid)):
+                texto, _, _, rid = self._entries[nid]
+                name, lista, _ = self._records[rid]
+                result.append((rid, texto, lista, name))
+
+        logger.debug(f"Screening index selected {len(result)} of {len(self._entries)} names for '{prospect}'")
+        return result
+
+
+class DatabaseScreening:
+    """
+    Candidate selection done by PostgreSQL with the pg_trgm GIN indexes of
+    restrictiva_nombre, for deployments that prefer not to keep the lists in
+    every worker's memory (SCREENING_BACKEND=database)
+    """
+    is_built = True
+    generation = 0
+
+    def ensure_fresh(self):
+        pass
+
+    def snapshot(self):
+        # Nothing held in memory: every lookup reads the current table
+        return self
+
+    def candidates(self, prospect, threshold):
+        """Same contract as ScreeningIndex.candidates"""
+        normalized = normalize_name(prospect)
+        if not normalized:
+            return []
+
+        # word_similarity is the trigram counterpart of partial_ratio: the
+        # best match of the prospect against any extent of the listed name
+        limit = max(0.2, 1 - 3 * (1 - threshold / 100))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s", [limit])
+            rows = (restrictiva_nombre.objects
+                    .filter(Q(normalizado__trigram_word_similar=normalized)
+                            | Q(ordenado__trigram_word_similar=sorted_name(normalized))
+                            | Q(fonetico=phonetic_key(normalized)))
+                    .order_by('restrictiva_id', 'id')
+                    .values_list('restrictiva_id', 'valor', 'restrictiva__list', 'restrictiva__name'))
+            return [(rid, str(valor).upper(), lista, str(name).upper()) for rid, valor, lista, name in rows]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_screening_index():
+    """Return the per-process screening index, building it on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                if config('SCREENING_BACKEND', default='memory') == 'database':
+                    _index = DatabaseScreening()
+                else:
+                    _index = ScreeningIndex()
+    _index.ensure_fresh()
+    return _index
+
+
+def get_loaded_index():
+    """Return the per-process in-memory index only if it has already been built"""
+    if isinstance(_index, ScreeningIndex) and _index.is_built:
+        return _index
+    return None
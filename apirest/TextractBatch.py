@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel batch engine shared by the Textract document analyzers
+
+Every page of a batch goes through the same three stages: S3 download,
+Pillow preprocessing and the Textract call. Pages run concurrently on the
+bounded pool of BatchExecutor.run_ordered, so while one page waits on
+Textract the next ones are downloading or being preprocessed:
+
+- downloads and Textract calls run on threads (I/O bound), rate limited
+  per service and retried with backoff when AWS throttles
+- preprocessing runs on a persistent process pool, so the CPU-heavy
+  enhancement of several pages is not serialized by the GIL
+
+A page whose Textract response is already in the result cache skips the
+preprocessing stage entirely. Results come back in page order.
+"""
+
+import functools
+import logging
+import os
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from decouple import config
+
+from apirest.BatchExecutor import run_ordered, get_process_pool, reset_process_pool, page_time_left, PageTimeout
+
+logger = logging.getLogger('apirest.aws')
+
+# Processes for page preprocessing, 0 runs it in the page thread instead
+PREPROCESS_WORKERS = config('TEXTRACT_PREPROCESS_WORKERS', default=min(4, os.cpu_count() or 1), cast=int)
+
+
+def _run_preprocessor(analyzer_class, method_name, image_bytes, filename):
+    # The preprocessing methods only use other methods of the analyzer, so an
+    # instance without __init__ (no AWS clients, nothing to pickle) is enough
+    analyzer = analyzer_class.__new__(analyzer_class)
+    return getattr(analyzer, method_name)(image_bytes, filename)
+
+
+def preprocessor(analyzer, method_name):
+    """Picklable preprocessing function for the process pool"""
+    return functools.partial(_run_preprocessor, type(analyzer), method_name)
+
+
+def preprocess_in_pool(preprocess, image_bytes, filename):
+    """
+    Run a preprocessor on the process pool, in this thread as a fallback
+
+    Raises:
+        PageTimeout: The batch deadline passed while waiting for the pool
+    """
+    if PREPROCESS_WORKERS > 0:
+        timeout = page_time_left()
+        try:
+            future = get_process_pool('textract', PREPROCESS_WORKERS).submit(preprocess, image_bytes, filename)
+            return future.result(timeout=timeout)
+        except FuturesTimeout:
+            # A page already running in a process finishes there unread
+            future.cancel()
+            raise PageTimeout(f'Preprocessing of {filename} did not finish before the batch deadline')
+        except BrokenProcessPool as e:
+            logger.warning(f"Preprocessing pool broken, preprocessing {filename} in thread: {str(e)}")
+            reset_process_pool('textract')
+    return preprocess(image_bytes, filename)
+
+
+def run_document_batch(photos, fetch, analyze, preprocess=None, workers=None):
+    """
+    Process the pages of a document batch concurrently
+
+    Args:
+        photos: S3 keys of the pages, in page order
+        fetch: fetch(photo) -> bytes of the page, or a result dict on error
+        analyze: analyze(photo, original_bytes, preprocess_page) -> result dict;
+                 preprocess_page() preprocesses on the pool and returns the
+                 bytes (None when it failed). analyze() calls it only on a
+                 result cache miss; it is None without a preprocess
+        preprocess: Picklable preprocess(image_bytes, filename) -> bytes
+                    (see preprocessor()); None sends the original bytes
+        workers: Pages processed at once (default BATCH_WORKERS)
+
+    Returns:
+        list: One result dict per page, in the order of photos
+    """
+    def process_page(index, photo):
+        original_bytes = fetch(photo)
+        if isinstance(original_bytes, dict):
+            return original_bytes
+        if preprocess is None:
+            return analyze(photo, original_bytes, None)
+
+        def preprocess_page():
+            try:
+                return preprocess_in_pool(preprocess, original_bytes, photo)
+            except PageTimeout:
+                raise
+            except Exception as e:
+                # analyze() preprocesses again and reports the failure the
+                # same way the single-page method does
+                logger.warning(f"Preprocessing of {photo} failed in pool: {str(e)}")
+                return None
+
+        # Deferred so a cached page never pays for the preprocessing
+        return analyze(photo, original_bytes, preprocess_page)
+
+    results = []
+    for photo, (result, error) in zip(photos, run_ordered(process_page, photos, workers=workers)):
+        if error is not None:
+            logger.error(f"Exception processing {photo}: {str(error)}")
+            result = {
+                'success': False,
+                'error': str(error),
+                'error_code': '504_Page_Timeout' if isinstance(error, PageTimeout) else '500_Processing_Error'
+            }
+        results.append(result)
+    return results
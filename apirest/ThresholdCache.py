@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Process-local cache for the single-row score thresholds
+(puntaje, puntaje_ocr and puntaje_face, always pk=1)
+
+Values are kept for THRESHOLD_CACHE_TTL seconds. Saves in this process
+invalidate immediately through signals; other workers pick admin edits up
+when their TTL expires.
+"""
+
+import logging
+import threading
+import time
+
+from decouple import config
+
+from apirest.models import puntaje, puntaje_ocr, puntaje_face
+
+logger = logging.getLogger('apirest.aws')
+
+THRESHOLD_CACHE_TTL = config('THRESHOLD_CACHE_TTL', default=30, cast=int)
+THRESHOLD_MODELS = (puntaje, puntaje_ocr, puntaje_face)
+
+_values = {}
+_lock = threading.Lock()
+
+
+def get_threshold(model, default=None):
+    """
+    Current puntaje_Max of a threshold model
+
+    Args:
+        model: puntaje, puntaje_ocr or puntaje_face
+        default: Value stored (and returned) when the row does not exist;
+                 without it a missing row raises model.DoesNotExist
+
+    Returns:
+        int: Threshold value
+    """
+    cached = _values.get(model)
+    if cached is not None and time.monotonic() - cached[1] < THRESHOLD_CACHE_TTL:
+        return cached[0]
+
+    value = model.objects.filter(pk=1).values_list('puntaje_Max', flat=True).first()
+    if value is None:
+        if default is None:
+            raise model.DoesNotExist(f"{model.__name__} pk=1 does not exist")
+        logger.warning(f"{model.__name__} threshold not found in database, creating default {default}")
+        model.objects.get_or_create(pk=1, defaults={'puntaje_Max': default})
+        value = default
+
+    value = int(value)
+    with _lock:
+        _values[model] = (value, time.monotonic())
+    return value
+
+
+def invalidate_threshold(model=None):
+    """Forget one cached threshold, or all of them"""
+    with _lock:
+        if model is None:
+            _values.clear()
+        else:
+            _values.pop(model, None)
+
+
+def warm_thresholds():
+    """Load every threshold up front, called once per worker at startup"""
+    for model in THRESHOLD_MODELS:
+        try:
+            get_threshold(model)
+        except model.DoesNotExist:
+            logger.warning(f"{model.__name__} threshold row is missing")
+        except Exception as e:
+            # Database not reachable yet: requests will load it lazily
+            logger.warning(f"Could not preload {model.__name__} threshold: {str(e)}")
+            return
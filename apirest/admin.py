@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Lista, llegadas, resultados,llegadas2,llegaface,puntaje,restrictiva
+from .models import Lista, llegadas, resultados,llegadas2,llegaface,puntaje,restrictiva,batch_job
 
 # Register your models here.
 admin.site.register(Lista)
@@ -10,3 +10,4 @@ admin.site.register(llegadas2)
 admin.site.register(llegaface)
 admin.site.register(puntaje)
 admin.site.register(restrictiva)
+admin.site.register(batch_job)
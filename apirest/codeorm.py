@@ -1,6 +1,8 @@
-from apirest.models import restrictiva, puntaje
-import pandas as pd
-from fuzzywuzzy import fuzz
+from apirest.models import puntaje
+from apirest.ThresholdCache import get_threshold
+from apirest.ScreeningIndex import get_screening_index
+from apirest.BulkScreening import screen_prospects
+from apirest.Results import ResultList, ScreeningHit
 # -*- coding: utf-8 -*-
 
 
@@ -12,31 +14,30 @@ class consult2:
         return name_algo
 
     def comparar(self, n1):
-        indices = [0]
         sancionados = {'nombres': "", 'Puntos': 0, 'Base_de_Datos': "", 'Prospecto': ''}
-        puntos = int(puntaje.objects.get(pk=1).puntaje_Max)
-        df = pd.DataFrame(data=sancionados, index=indices)
-        self.sancionados = df
-        for name in restrictiva.objects.all():
-            c = str(name.name)
-            ca = c.upper()
-            a = str(n1)
-            aa = a.upper()
-            listas = name.list
-            result = fuzz.partial_ratio(aa, ca)
-            if result >= puntos:
-                nuevo_registro = {'id': int(name.id), 'nombres': ca,
-                                  'Puntos': result, 'Base_de_Datos': listas,
-                                  'Prospecto': n1}
-                df = pd.concat([df, pd.DataFrame([nuevo_registro])], ignore_index=True)
-                self.sancionados = df[df.Puntos != 0]
-            else:
-                pass
-        self.sancionados = df[df.Puntos != 0]
+        puntos = get_threshold(puntaje)
+        # Only names/aliases sharing enough tokens/grams with the prospect
+        # can reach the threshold, the rest of the table is never scored
+        hits = screen_prospects(get_screening_index(), [n1], puntos)[0]
+        self.sancionados = ResultList(
+            ScreeningHit(nombres=hit['nombres'], Puntos=hit['Puntos'], Base_de_Datos=hit['Base_de_Datos'],
+                         Prospecto=hit['Prospecto'], id=hit['id'], Coincidencia=hit['Coincidencia'])
+            for hit in hits if hit['Puntos'] != 0
+        )
         return sancionados
 
-
-
-
-
-
+    def comparar_lote(self, prospectos):
+        """
+        Screen several prospects at once against the sanctions lists
+
+        Args:
+            prospectos: List of prospect names
+
+        Returns:
+            list: One list of hit dicts (id, nombres, Puntos, Base_de_Datos,
+                  Prospecto, Coincidencia) per prospect, in the same order
+        """
+        puntos = get_threshold(puntaje)
+        resultados = screen_prospects(get_screening_index(), prospectos, puntos)
+        self.resultados = resultados
+        return resultados
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the preprocessing variants (color, gray, binary) of a document type
+
+For every page and variant it reports the payload sent to Textract and the
+preprocessing/encode time; with --textract it also sends each variant to
+detect_document_text (one request per page and variant) and reports the
+mean word confidence, the word count and the share of the color words
+found again, to check that a lighter variant does not lose text before
+enabling it with TEXTRACT_PREPROCESS_MODE_<TYPE>.
+
+Usage:
+    python manage.py benchmark_preprocessing certificado pagina1.jpg pagina2.jpg
+    python manage.py benchmark_preprocessing titulo --s3 titulos/a.jpg titulos/b.jpg --textract
+"""
+
+import os
+import time
+from collections import Counter
+
+from decouple import config
+from django.core.management.base import BaseCommand, CommandError
+
+from apirest.AWSClients import get_client
+from apirest.BatchExecutor import call_aws
+from apirest.ImagePipeline import PREPROCESS_MODES, get_profile, preprocess_document
+
+DOCUMENT_TYPES = ['passport', 'certificado', 'titulo', 'acta']
+
+
+def _words(response):
+    return [block for block in response.get('Blocks', []) if block.get('BlockType') == 'WORD']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark payload size, time and Textract confidence of the preprocessing variants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_type', choices=DOCUMENT_TYPES, help='Perfil de preprocesamiento')
+        parser.add_argument('paths', nargs='*', help='Imágenes locales')
+        parser.add_argument('--s3', nargs='*', default=[], dest='keys', help='Imágenes en S3')
+        parser.add_argument('--bucket', default=config('AWS_S3_BUCKET', default='onboarding-uisep'),
+                            help='Bucket de las imágenes --s3')
+        parser.add_argument('--modes', default=','.join(PREPROCESS_MODES),
+                            help='Variantes a comparar (default: color,gray,binary)')
+        parser.add_argument('--textract', action='store_true',
+                            help='Enviar cada variante a Textract detect_document_text')
+
+    def handle(self, *args, **options):
+        modes = [mode.strip() for mode in options['modes'].split(',') if mode.strip()]
+        for mode in modes:
+            if mode not in PREPROCESS_MODES:
+                raise CommandError(f"Unknown mode: {mode}. Supported: {', '.join(PREPROCESS_MODES)}")
+        if not options['paths'] and not options['keys']:
+            raise CommandError("Give local images and/or --s3 keys")
+
+        credentials = {
+            'aws_access_key_id': config('AWS_ACCESS_KEY_ID'),
+            'aws_secret_access_key': config('AWS_SECRET_ACCESS_KEY'),
+            'region_name': config('AWS_DEFAULT_REGION', default='us-east-1'),
+        } if options['keys'] or options['textract'] else {}
+        textract_client = get_client('textract', **credentials) if options['textract'] else None
+
+        pages = []
+        for path in options['paths']:
+            if not os.path.exists(path):
+                raise CommandError(f"File not found: {path}")
+            with open(path, 'rb') as f:
+                pages.append((path, f.read()))
+        if options['keys']:
+            s3_client = get_client('s3', **credentials)
+            for key in options['keys']:
+                response = call_aws('s3', s3_client.get_object, Bucket=options['bucket'], Key=key)
+                pages.append((key, response['Body'].read()))
+
+        totals = {mode: Counter() for mode in modes}
+        for name, image_bytes in pages:
+            self.stdout.write(f"{name} ({len(image_bytes) / 1024:.0f}KB)")
+            reference_words = None
+            for mode in modes:
+                timings = []
+                start = time.perf_counter()
+                data = preprocess_document(image_bytes, get_profile(options['document_type'], mode), name, timings)
+                elapsed = time.perf_counter() - start
+                encode = sum(seconds for stage, seconds in timings if stage == 'encode')
+                kind = 'PNG' if data[:4] == b'\x89PNG' else 'JPEG'
+                line = f"  {mode:<6} {len(data) / 1024:8.0f}KB {kind:<4} {elapsed * 1000:6.0f}ms (encode {encode * 1000:.0f}ms)"
+                total = totals[mode]
+                total.update(pages=1, size=len(data), ms=elapsed * 1000, encode_ms=encode * 1000)
+
+                if textract_client is not None:
+                    words = _words(call_aws('textract', textract_client.detect_document_text, Document={'Bytes': data}))
+                    texts = Counter(word.get('Text', '') for word in words)
+                    confidence = sum(word.get('Confidence', 0) for word in words) / len(words) if words else 0.0
+                    if reference_words is None:
+                        reference_words = texts
+                    found = sum((texts & reference_words).values()) / max(1, sum(reference_words.values()))
+                    line += f"  {len(words)} words, confidence {confidence:.1f}, {found * 100:.0f}% of {modes[0]} words"
+                    total.update(words=len(words), confidence=confidence, found=found * 100)
+                self.stdout.write(line)
+
+        self.stdout.write('')
+        self.stdout.write(f"Average over {len(pages)} pages ({options['document_type']}):")
+        for mode in modes:
+            total = totals[mode]
+            count = max(1, total['pages'])
+            line = (f"  {mode:<6} {total['size'] / count / 1024:8.0f}KB {total['ms'] / count:6.0f}ms "
+                    f"(encode {total['encode_ms'] / count:.0f}ms)")
+            if textract_client is not None:
+                line += (f"  {total['words'] / count:.0f} words, confidence {total['confidence'] / count:.1f}, "
+                         f"{total['found'] / count:.0f}% of {modes[0]} words")
+            self.stdout.write(line)
+        self.stdout.write(self.style.SUCCESS('Benchmark finished'))
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Load a sanctions list (OFAC/UN/EU style CSV or XML) into restrictiva
+
+The file is streamed record by record and written in chunks, so memory use
+does not depend on the size of the list and every chunk commits on its own.
+Entries are upserted by a stable key (source list + source id); entries of
+the same list missing from the new file are removed. Each load records a
+lista_version row, which is what screening workers watch to rebuild their
+in-memory index.
+
+Usage:
+    python manage.py load_sanctions_list sdn.xml --list OFAC
+    python manage.py load_sanctions_list consolidated.csv --list UN --key reference_number
+"""
+
+import csv
+import hashlib
+import logging
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from apirest.models import restrictiva, restrictiva_nombre, lista_version
+from apirest.NameNormalizer import name_variants, normalize_name
+
+logger = logging.getLogger('apirest.screening')
+
+# restrictiva columns filled from the file
+FIELDS = [
+    'name', 'also_known_as', 'type', 'title', 'program', 'remarks', 'date_of_birth', 'edad',
+    'place_of_birth', 'nationality', 'citizenship', 'addresses', 'street', 'city',
+    'state_province', 'postal_code', 'country', 'sanction_list', 'hiperlik',
+]
+
+# Common source column / element names for those columns
+ALIASES = {
+    'aka': 'also_known_as', 'akas': 'also_known_as', 'alias': 'also_known_as',
+    'aliases': 'also_known_as', 'akalist': 'also_known_as',
+    'sdn_name': 'name', 'full_name': 'name', 'whole_name': 'name',
+    'sdn_type': 'type', 'sdntype': 'type', 'programs': 'program', 'programlist': 'program',
+    'dob': 'date_of_birth', 'dateofbirth': 'date_of_birth', 'dateofbirthlist': 'date_of_birth',
+    'pob': 'place_of_birth', 'placeofbirth': 'place_of_birth', 'placeofbirthlist': 'place_of_birth',
+    'address': 'addresses', 'addresslist': 'addresses', 'stateorprovince': 'state_province',
+    'postalcode': 'postal_code', 'nationalitylist': 'nationality', 'citizenshiplist': 'citizenship',
+    'url': 'hiperlik', 'link': 'hiperlik',
+}
+
+# Sub-elements that do not describe the entry itself
+XML_SKIP = {'uid', 'type', 'category', 'mainentry'}
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _column(header):
+    key = header.strip().lower().replace(' ', '_').replace('-', '_')
+    return ALIASES.get(key, ALIASES.get(key.replace('_', ''), key))
+
+
+class Command(BaseCommand):
+    help = 'Carga masiva de una lista restrictiva (CSV o XML) en restrictiva'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo CSV o XML de la lista')
+        parser.add_argument('--list', required=True, dest='lista',
+                            help='Nombre de la lista, se guarda en restrictiva.list (ej: OFAC)')
+        parser.add_argument('--format', choices=['csv', 'xml'],
+                            help='Formato del archivo (por defecto según la extensión)')
+        parser.add_argument('--key', default='uid',
+                            help='Columna/elemento con el id estable de cada registro (default: uid)')
+        parser.add_argument('--record-tag', default='sdnEntry',
+                            help='Elemento XML de cada registro (default: sdnEntry)')
+        parser.add_argument('--columns',
+                            help='Encabezados separados por coma para CSV sin fila de encabezado')
+        parser.add_argument('--delimiter', default=',', help='Separador CSV (default: ,)')
+        parser.add_argument('--encoding', default='utf-8', help='Codificación del archivo')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Registros por lote')
+        parser.add_argument('--keep-missing', action='store_true',
+                            help='No eliminar registros de la lista ausentes en el archivo')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f"File not found: {path}")
+
+        lista = options['lista']
+        file_format = options['format'] or ('xml' if path.lower().endswith('.xml') else 'csv')
+        chunk_size = options['chunk_size']
+
+        current = lista_version.objects.filter(lista=lista).aggregate(last=Max('version'))['last']
+        version = (current or 0) + 1
+        started = time.time()
+
+        if file_format == 'xml':
+            records = self._read_xml(path, options['record_tag'])
+        else:
+            records = self._read_csv(path, options)
+
+        total = 0
+        batch = {}
+        for record in records:
+            row = self._to_row(record, lista, options['key'])
+            if row is None:
+                continue
+            batch[row['clave']] = row
+            if len(batch) >= chunk_size:
+                total += self._flush(batch.values(), lista, version)
+                batch = {}
+                self.stdout.write(f"  {total} registros cargados...")
+        if batch:
+            total += self._flush(batch.values(), lista, version)
+
+        if total == 0:
+            raise CommandError("No records found, the list was not modified")
+
+        removed = 0
+        if not options['keep_missing']:
+            removed = self._remove_missing(lista, version)
+
+        # New version row: screening workers rebuild their index when they see it
+        lista_version.objects.create(lista=lista, version=version, archivo=os.path.basename(path)[:255],
+                                     registros=total, eliminados=removed)
+
+        elapsed = time.time() - started
+        logger.info(f"Sanctions list {lista} v{version} loaded: {total} records, {removed} removed in {elapsed:.1f}s")
+        self.stdout.write(self.style.SUCCESS(
+            f"Lista {lista} v{version}: {total} registros cargados, {removed} eliminados en {elapsed:.1f}s"
+        ))
+
+    def _read_csv(self, path, options):
+        with open(path, newline='', encoding=options['encoding']) as handle:
+            fieldnames = options['columns'].split(',') if options['columns'] else None
+            reader = csv.DictReader(handle, fieldnames=fieldnames, delimiter=options['delimiter'])
+            for record in reader:
+                yield {_column(key): value for key, value in record.items() if key}
+
+    def _read_xml(self, path, record_tag):
+        context = ET.iterparse(path, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event != 'end' or _local(elem.tag) != record_tag:
+                continue
+            yield self._xml_record(elem)
+            # Drop parsed records so memory stays flat
+            root.clear()
+
+    def _xml_record(self, elem):
+        record = {}
+        for child in elem:
+            tag = _local(child.tag)
+            if len(child) == 0:
+                record[_column(tag)] = (child.text or '').strip()
+                continue
+            values = []
+            for item in child:
+                if len(item) == 0:
+                    text = (item.text or '').strip()
+                else:
+                    parts = {_local(part.tag): (part.text or '').strip() for part in item}
+                    if parts.get('firstName') or parts.get('lastName'):
+                        text = ' '.join(filter(None, [parts.get('firstName'), parts.get('lastName')]))
+                    else:
+                        text = ', '.join(value for key, value in parts.items()
+                                         if value and key.lower() not in XML_SKIP)
+                if text:
+                    values.append(text)
+            record[_column(tag)] = '; '.join(values)
+        return record
+
+    def _to_row(self, record, lista, key_field):
+        name = record.get('name') or ' '.join(
+            filter(None, [record.get('firstname'), record.get('lastname')]))
+        if not name or not name.strip():
+            return None
+
+        row = {field: (record.get(field) or '').strip()[:255] or None for field in FIELDS}
+        row['name'] = name.strip()[:255]
+        # Not cut: aliases past 255 chars must still be indexed and matched
+        row['also_known_as'] = (record.get('also_known_as') or '').strip() or None
+
+        source_id = (record.get(_column(key_field)) or '').strip()
+        if not source_id:
+            # No stable id in the source: derive one from the identity fields
+            identity = f"{normalize_name(name)}|{row['date_of_birth'] or ''}"
+            source_id = hashlib.sha1(identity.encode('utf-8')).hexdigest()[:20]
+        row['clave'] = f"{lista}:{source_id}"[:255]
+        return row
+
+    def _flush(self, rows, lista, version):
+        objs = [restrictiva(list=lista, version=version, **row) for row in rows]
+        with transaction.atomic():
+            restrictiva.objects.bulk_create(
+                objs,
+                update_conflicts=True,
+                unique_fields=['clave'],
+                update_fields=FIELDS + ['list', 'version'],
+            )
+            ids = dict(restrictiva.objects.filter(clave__in=[obj.clave for obj in objs])
+                       .values_list('clave', 'id'))
+            restrictiva_nombre.objects.filter(restrictiva_id__in=ids.values()).delete()
+            restrictiva_nombre.objects.bulk_create([
+                restrictiva_nombre(restrictiva_id=ids[obj.clave], **variant)
+                for obj in objs
+                for variant in name_variants(obj.name, obj.also_known_as)
+            ], batch_size=5000)
+        return len(objs)
+
+    def _remove_missing(self, lista, version):
+        stale = restrictiva.objects.filter(list=lista, clave__isnull=False).exclude(version=version)
+        with transaction.atomic():
+            restrictiva_nombre.objects.filter(restrictiva__in=stale).delete()
+            removed, _ = stale.delete()
+        return removed
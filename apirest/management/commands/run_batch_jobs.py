@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""
+Dedicated worker for the batch OCR job queue (see apirest.BatchJobs)
+
+Runs job worker threads outside the web processes, so batch work never
+competes with short requests for gunicorn workers. Set BATCH_JOB_WORKERS=0
+in the web containers when this command runs alongside them.
+
+Usage:
+    python manage.py run_batch_jobs
+    python manage.py run_batch_jobs --threads 4
+"""
+
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from apirest.BatchJobs import worker_loop
+
+
+class Command(BaseCommand):
+    help = 'Process queued batch OCR jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=2,
+                            help='Jobs processed at once by this worker (default 2)')
+
+    def handle(self, *args, **options):
+        stop_event = threading.Event()
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the jobs in progress...')
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        threads = [
+            threading.Thread(target=worker_loop, args=(stop_event,), name=f'batch-job-{number}')
+            for number in range(max(1, options['threads']))
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'Batch job worker running with {len(threads)} threads')
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
+        self.stdout.write(self.style.SUCCESS('Batch job worker stopped'))
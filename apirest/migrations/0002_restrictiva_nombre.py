@@ -0,0 +1,122 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:04
+
+import re
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.deletion
+from unidecode import unidecode
+
+
+# Frozen copy of apirest.NameNormalizer as of this migration, so later
+# changes to the live module do not change what the backfill writes
+
+_NON_ALNUM = re.compile(r'[^A-Z0-9]+')
+_PHONETIC_RULES = [
+    (re.compile(r'X'), 'KS'),
+    (re.compile(r'CH'), 'X'),
+    (re.compile(r'PH'), 'F'),
+    (re.compile(r'LL'), 'Y'),
+    (re.compile(r'QU'), 'K'),
+    (re.compile(r'C([EI])'), r'S\1'),
+    (re.compile(r'G([EI])'), r'J\1'),
+    (re.compile(r'[CQ]'), 'K'),
+    (re.compile(r'Z'), 'S'),
+    (re.compile(r'V'), 'B'),
+    (re.compile(r'W'), 'U'),
+    (re.compile(r'Y'), 'I'),
+    (re.compile(r'(?<!S)H|(?<=^)H'), ''),
+    (re.compile(r'(.)\1+'), r'\1'),
+]
+_ALIAS_SEPARATORS = re.compile(r'[;|\n]+')
+_ALIAS_PREFIX = re.compile(r'^\s*(?:[afn]\.?\s*k\.?\s*a\.?|alias)\s*', re.IGNORECASE)
+
+
+def _normalize_name(value):
+    if not value:
+        return ''
+    text = unidecode(str(value)).upper()
+    return _NON_ALNUM.sub(' ', text).strip()
+
+
+def _phonetic_key(normalized):
+    keys = []
+    for token in normalized.split():
+        for pattern, replacement in _PHONETIC_RULES:
+            token = pattern.sub(replacement, token)
+        if token:
+            keys.append(token)
+    return ' '.join(keys)
+
+
+def _split_aliases(also_known_as):
+    if not also_known_as:
+        return []
+    aliases = []
+    for part in _ALIAS_SEPARATORS.split(str(also_known_as)):
+        alias = _ALIAS_PREFIX.sub('', part).strip().strip('"\'').strip()
+        if alias and alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def _name_variants(name, also_known_as):
+    variants = []
+    seen = set()
+    for tipo, valor in [('name', name)] + [('aka', alias) for alias in _split_aliases(also_known_as)]:
+        normalizado = _normalize_name(valor)
+        if not normalizado or normalizado in seen:
+            continue
+        seen.add(normalizado)
+        variants.append({
+            'tipo': tipo,
+            'valor': str(valor)[:255],
+            'normalizado': normalizado,
+            'ordenado': ' '.join(sorted(normalizado.split())),
+            'fonetico': _phonetic_key(normalizado),
+        })
+    return variants
+
+
+def backfill_nombres(apps, schema_editor):
+    restrictiva = apps.get_model('apirest', 'restrictiva')
+    restrictiva_nombre = apps.get_model('apirest', 'restrictiva_nombre')
+
+    batch = []
+    for pk, name, also_known_as in restrictiva.objects.values_list('id', 'name', 'also_known_as').iterator(chunk_size=5000):
+        for variant in _name_variants(name, also_known_as):
+            batch.append(restrictiva_nombre(restrictiva_id=pk, **variant))
+        if len(batch) >= 5000:
+            restrictiva_nombre.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        restrictiva_nombre.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apirest', '0001_initial'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='restrictiva_nombre',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('name', 'Nombre'), ('aka', 'Alias')], default='name', max_length=4)),
+                ('valor', models.CharField(max_length=255)),
+                ('normalizado', models.CharField(max_length=255)),
+                ('ordenado', models.CharField(max_length=255)),
+                ('fonetico', models.CharField(db_index=True, max_length=255)),
+                ('restrictiva', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='nombres', to='apirest.restrictiva')),
+            ],
+            options={
+                'db_table': 'apirest_restrictiva_nombre',
+                'indexes': [django.contrib.postgres.indexes.GinIndex(fields=['normalizado'], name='restrictiva_nombre_trgm', opclasses=['gin_trgm_ops']), django.contrib.postgres.indexes.GinIndex(fields=['ordenado'], name='restrictiva_ordenado_trgm', opclasses=['gin_trgm_ops'])],
+            },
+        ),
+        migrations.RunPython(backfill_nombres, migrations.RunPython.noop),
+    ]
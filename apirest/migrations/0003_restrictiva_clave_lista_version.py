@@ -0,0 +1,39 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apirest', '0002_restrictiva_nombre'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='restrictiva',
+            name='clave',
+            field=models.CharField(blank=True, max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='restrictiva',
+            name='version',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='lista_version',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lista', models.CharField(max_length=255)),
+                ('version', models.IntegerField()),
+                ('archivo', models.CharField(max_length=255)),
+                ('registros', models.IntegerField(default=0)),
+                ('eliminados', models.IntegerField(default=0)),
+                ('cargado', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'apirest_lista_version',
+                'unique_together': {('lista', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.16 on 2026-10-18 02:24
+
+import django.core.serializers.json
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apirest', '0003_restrictiva_clave_lista_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='batch_job',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tipo', models.CharField(max_length=20)),
+                ('estado', models.CharField(choices=[('queued', 'En cola'), ('running', 'En proceso'), ('done', 'Terminado'), ('failed', 'Fallido')], default='queued', max_length=10)),
+                ('parametros', models.JSONField(default=dict, encoder=django.core.serializers.json.DjangoJSONEncoder)),
+                ('paginas_total', models.IntegerField(default=0)),
+                ('paginas_procesadas', models.IntegerField(default=0)),
+                ('resultado', models.JSONField(blank=True, encoder=django.core.serializers.json.DjangoJSONEncoder, null=True)),
+                ('codigo_http', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('intentos', models.IntegerField(default=0)),
+                ('creado', models.DateTimeField(auto_now_add=True)),
+                ('iniciado', models.DateTimeField(blank=True, null=True)),
+                ('actualizado', models.DateTimeField(blank=True, null=True)),
+                ('terminado', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'apirest_batch_job',
+                'indexes': [models.Index(fields=['estado', 'creado'], name='batch_job_estado_creado')],
+            },
+        ),
+    ]
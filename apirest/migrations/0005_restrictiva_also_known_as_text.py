@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apirest', '0004_batch_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='restrictiva',
+            name='also_known_as',
+            field=models.TextField(blank=True, null=True),
+        ),
+    ]
@@ -1,6 +1,10 @@
 
+import uuid
+
 from django.db import models
 from django.core.validators import MinLengthValidator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.postgres.indexes import GinIndex
 
 
 class Lista(models.Model):
@@ -50,7 +54,8 @@ class resultados(models.Model):
 
 class restrictiva(models.Model):
     name = models.CharField(max_length=255)
-    also_known_as = models.CharField(max_length=255, blank=True, null=True)
+    # Full alias list: every alias is indexed in restrictiva_nombre
+    also_known_as = models.TextField(blank=True, null=True)
     type = models.CharField(max_length=255, blank=True, null=True)
     title = models.CharField(max_length=255, blank=True, null=True)
     program = models.CharField(max_length=255, blank=True, null=True)
@@ -69,6 +74,9 @@ class restrictiva(models.Model):
     country = models.CharField(max_length=255, blank=True, null=True)
     sanction_list = models.CharField(max_length=255, blank=True, null=True)
     hiperlik = models.CharField(max_length=255, blank=True, null=True)
+    # Stable id of the entry in its source list, used by load_sanctions_list
+    clave = models.CharField(max_length=255, unique=True, blank=True, null=True)
+    version = models.IntegerField(blank=True, null=True)
 
     class Meta:
         db_table = 'apirest_restrictiva'
@@ -77,6 +85,45 @@ class restrictiva(models.Model):
         return self.name
 
 
+class restrictiva_nombre(models.Model):
+    """Normalized searchable form of a restrictiva name or alias"""
+    TIPOS = [('name', 'Nombre'), ('aka', 'Alias')]
+
+    restrictiva = models.ForeignKey(restrictiva, on_delete=models.CASCADE, related_name='nombres')
+    tipo = models.CharField(max_length=4, choices=TIPOS, default='name')
+    valor = models.CharField(max_length=255)
+    normalizado = models.CharField(max_length=255)
+    ordenado = models.CharField(max_length=255)
+    fonetico = models.CharField(max_length=255, db_index=True)
+
+    class Meta:
+        db_table = 'apirest_restrictiva_nombre'
+        indexes = [
+            GinIndex(fields=['normalizado'], opclasses=['gin_trgm_ops'], name='restrictiva_nombre_trgm'),
+            GinIndex(fields=['ordenado'], opclasses=['gin_trgm_ops'], name='restrictiva_ordenado_trgm'),
+        ]
+
+    def __str__(self):
+        return self.valor
+
+
+class lista_version(models.Model):
+    """One row per load of a sanctions list"""
+    lista = models.CharField(max_length=255)
+    version = models.IntegerField()
+    archivo = models.CharField(max_length=255)
+    registros = models.IntegerField(default=0)
+    eliminados = models.IntegerField(default=0)
+    cargado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'apirest_lista_version'
+        unique_together = [('lista', 'version')]
+
+    def __str__(self):
+        return f"{self.lista} v{self.version}"
+
+
 class puntaje(models.Model):
     puntaje_Max = models.IntegerField()
 
@@ -118,3 +165,29 @@ class llegaface(models.Model):
         return f"Face: {self.faceselfie} - OCR: {self.ocrident}"
 
 
+class batch_job(models.Model):
+    """Batch OCR request queued in job mode, processed by apirest.BatchJobs"""
+    ESTADOS = [('queued', 'En cola'), ('running', 'En proceso'), ('done', 'Terminado'), ('failed', 'Fallido')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    tipo = models.CharField(max_length=20)
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='queued')
+    parametros = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    paginas_total = models.IntegerField(default=0)
+    paginas_procesadas = models.IntegerField(default=0)
+    resultado = models.JSONField(blank=True, null=True, encoder=DjangoJSONEncoder)
+    codigo_http = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, default='')
+    intentos = models.IntegerField(default=0)
+    creado = models.DateTimeField(auto_now_add=True)
+    iniciado = models.DateTimeField(blank=True, null=True)
+    # Heartbeat of the worker processing the job, used to requeue stale jobs
+    actualizado = models.DateTimeField(blank=True, null=True)
+    terminado = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'apirest_batch_job'
+        indexes = [models.Index(fields=['estado', 'creado'], name='batch_job_estado_creado')]
+
+    def __str__(self):
+        return f"{self.tipo} {self.id} ({self.estado})"
@@ -1,3 +1,4 @@
+import json
 from rest_framework import serializers
 from .models import llegadas, resultados, llegadas2, llegaface, puntaje, puntaje_ocr, puntaje_face, restrictiva
 
@@ -201,7 +202,7 @@ class QRCodeSerializer(serializers.Serializer):
         """
         Validar que el nombre del archivo tenga una extensión válida
         """
-        valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif']
+        valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif', '.pdf']
         
         if not value:
             raise serializers.ValidationError("El nombre del archivo no puede estar vacío")
@@ -244,7 +245,7 @@ class QRCodeBatchSerializer(serializers.Serializer):
         """
         Validar que todos los archivos tengan extensiones válidas
         """
-        valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif']
+        valid_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.gif', '.pdf']
         
         for filename in value:
             if not filename:
@@ -264,3 +265,59 @@ class QRCodeBatchSerializer(serializers.Serializer):
         return value
 
 
+
+
+class BulkScreeningSerializer(serializers.Serializer):
+    """
+    Serializer para screening masivo contra listas restrictivas
+    Acepta una lista de nombres o un archivo NDJSON (un prospecto por línea)
+    """
+    MAX_PROSPECTS = 10000
+
+    prospects = serializers.ListField(
+        child=serializers.CharField(max_length=255, min_length=7),
+        min_length=1,
+        max_length=MAX_PROSPECTS,
+        help_text="Lista de nombres a evaluar (ej: ['JUAN PEREZ LOPEZ', 'MARIA GARCIA'])",
+        required=False
+    )
+
+    file = serializers.FileField(
+        help_text="Archivo NDJSON: cada línea es un string o un objeto con 'string_income'",
+        required=False
+    )
+
+    def _parse_ndjson(self, uploaded_file):
+        prospects = []
+        for line_number, raw_line in enumerate(uploaded_file, start=1):
+            line = raw_line.decode('utf-8').strip() if isinstance(raw_line, bytes) else raw_line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError:
+                raise serializers.ValidationError(f"Línea {line_number}: JSON inválido")
+            if isinstance(item, dict):
+                item = item.get('string_income')
+            if not isinstance(item, str) or len(item.strip()) < 7:
+                raise serializers.ValidationError(
+                    f"Línea {line_number}: se esperaba un nombre de al menos 7 caracteres"
+                )
+            prospects.append(item.strip()[:255])
+            if len(prospects) > self.MAX_PROSPECTS:
+                raise serializers.ValidationError(
+                    f"El archivo excede el máximo de {self.MAX_PROSPECTS} prospectos"
+                )
+        return prospects
+
+    def validate(self, data):
+        has_list = bool(data.get('prospects'))
+        has_file = data.get('file') is not None
+        if has_list == has_file:
+            raise serializers.ValidationError("Debe enviar 'prospects' o 'file', no ambos")
+
+        if has_file:
+            data['prospects'] = self._parse_ndjson(data.pop('file'))
+            if not data['prospects']:
+                raise serializers.ValidationError("El archivo no contiene prospectos")
+        return data
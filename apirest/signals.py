@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Model signal handlers for the apirest app
+Keeps restrictiva_nombre and the in-process screening index in sync with
+restrictiva writes, and drops cached thresholds when they are edited
+"""
+
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from apirest.models import restrictiva, restrictiva_nombre, puntaje, puntaje_ocr, puntaje_face
+from apirest.NameNormalizer import name_variants
+from apirest.ScreeningIndex import get_loaded_index
+from apirest.ThresholdCache import invalidate_threshold
+
+
+def sync_nombres(instance):
+    """Regenerate the normalized name/alias rows of a restrictiva entry"""
+    restrictiva_nombre.objects.filter(restrictiva=instance).delete()
+    return restrictiva_nombre.objects.bulk_create([
+        restrictiva_nombre(restrictiva=instance, **variant)
+        for variant in name_variants(instance.name, instance.also_known_as)
+    ])
+
+
+@receiver(post_save, sender=restrictiva)
+def restrictiva_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    nombres = sync_nombres(instance)
+    index = get_loaded_index()
+    if index is not None:
+        transaction.on_commit(lambda: index.upsert(instance.pk, instance.name, instance.list, nombres))
+
+
+@receiver(post_delete, sender=restrictiva)
+def restrictiva_deleted(sender, instance, **kwargs):
+    index = get_loaded_index()
+    if index is not None:
+        pk = instance.pk
+        transaction.on_commit(lambda: index.remove(pk))
+
+
+@receiver(post_save, sender=puntaje)
+@receiver(post_save, sender=puntaje_ocr)
+@receiver(post_save, sender=puntaje_face)
+@receiver(post_delete, sender=puntaje)
+@receiver(post_delete, sender=puntaje_ocr)
+@receiver(post_delete, sender=puntaje_face)
+def threshold_changed(sender, **kwargs):
+    invalidate_threshold(sender)
@@ -1,11 +1,591 @@
+# -*- coding: utf-8 -*-
+"""
+Behaviour tests of the apirest modules
 
+Run with `python manage.py test apirest`. Nothing here calls AWS.
+"""
 
+import io
+import random
+import threading
+from datetime import timedelta
+from unittest import mock
 
+import numpy as np
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from fuzzywuzzy import fuzz
+from PIL import Image, ImageDraw, ImageEnhance, ImageOps
+from unidecode import unidecode
 
+from apirest import BatchJobs, FuzzyScorer, ResultCache
+from apirest.BulkScreening import screen_prospects
+from apirest.CedulaExtractor import extract_cedula
+from apirest.codeorm import consult2
+from apirest.ImageEncoder import encode_to_size
+from apirest.ImagePipeline import apply_stages, get_profile, AutoContrast, Brightness, Contrast
+from apirest.models import batch_job, puntaje, restrictiva, restrictiva_nombre
+from apirest.ScreeningIndex import ScreeningIndex
+from apirest.ThresholdCache import invalidate_threshold
 
+LISTED = [
+    ('JUAN CARLOS PEREZ GOMEZ', 'Juanito Perez; El Flaco', 'OFAC'),
+    ('MARIA FERNANDA LOPEZ', None, 'ONU'),
+    ('PEDRO ANTONIO RAMIREZ', 'Pedro Ramirez Diaz', 'OFAC'),
+    ('ANA LUCIA TORRES VEGA', 'Lucia Torres', 'PEP'),
+    ('CARLOS ALBERTO MENDOZA', None, 'ONU'),
+    ('JOSE LUIS ESPINOZA CEDENO', 'Pepe Espinoza', 'OFAC'),
+]
+PROSPECTS = ['Juan Carlos Perez Gomez', 'JUAN CARLOS PERES GOMES', 'maria fernanda lopes',
+             'Pedro Ramires', 'Lucia Torres Vega', 'Jose Espinosa', 'Roberto Sanchez', 'ANA']
 
 
+def load_listed():
+    """Create the LISTED entries (post_save fills restrictiva_nombre) and index them"""
+    for name, also_known_as, lista in LISTED:
+        restrictiva.objects.create(name=name, also_known_as=also_known_as, list=lista)
+    index = ScreeningIndex()
+    index.build()
+    return index
 
 
+def brute_force(prospect, threshold):
+    """(restrictiva id, name or alias) -> fuzz.partial_ratio of every pair reaching the threshold"""
+    scores = {}
+    for nombre in restrictiva_nombre.objects.all():
+        score = fuzz.partial_ratio(prospect.upper(), nombre.valor.upper())
+        if score >= threshold:
+            scores[(nombre.restrictiva_id, nombre.valor.upper())] = score
+    return scores
 
 
+def document_image(size=(1200, 1600), mode='RGB', seed=1):
+    """Noisy off-white page with lines of dark text"""
+    rng = np.random.default_rng(seed)
+    pixels = (200 + rng.normal(0, 12, (size[1], size[0], 3))).clip(0, 255).astype(np.uint8)
+    pixels[..., 2] = (pixels[..., 2] * 0.9).astype(np.uint8)
+    image = Image.fromarray(pixels)
+    draw = ImageDraw.Draw(image)
+    for y in range(40, size[1] - 40, 30):
+        draw.text((40, y), 'REPUBLICA DEL ECUADOR  Nombre: JUAN PEREZ 0912345678 ' * 3, fill=(30, 30, 60))
+    return image.convert(mode)
+
+
+class FuzzyScorerTests(SimpleTestCase):
+    NAMES = ['JUAN CARLOS PEREZ GOMEZ', 'MARIA FERNANDA LOPEZ', 'PEDRO ANTONIO RAMIREZ', 'ANA LUCIA TORRES VEGA',
+             'CARLOS ALBERTO MENDOZA', 'JOSE LUIS ESPINOZA CEDENO', 'JUANITO PEREZ', 'LUCIA TORRES',
+             'PEPE ESPINOZA', 'PEDRO RAMIREZ DIAZ', 'ROBERTO SANCHEZ']
+    PROSPECTS = ['JUAN CARLOS PERES GOMES', 'MARIA FERNANDA LOPES', 'PEDRO RAMIRES', 'LUCIA TORRES VEGA',
+                 'JOSE ESPINOSA', 'ESPINOZA CEDENO JOSE', 'CARLOS MENDOZA', 'ANA']
+
+    def brute_force(self, threshold):
+        """fuzz.partial_ratio of every prospect against every name"""
+        results = []
+        for prospect in self.PROSPECTS:
+            scores = {position: fuzz.partial_ratio(prospect, name) for position, name in enumerate(self.NAMES)}
+            results.append({position: score for position, score in scores.items() if score >= threshold})
+        return results
+
+    def test_score_many_matches_partial_ratio(self):
+        for threshold in (60, 75, 86):
+            results = FuzzyScorer.score_many(self.PROSPECTS, self.NAMES, threshold, workers=1)
+            self.assertEqual([dict(hits) for hits in results], self.brute_force(threshold), threshold)
+
+    def test_scores_rounding_up_to_the_threshold_are_kept(self):
+        # rapidfuzz scores this pair 85.71, fuzzywuzzy rounds it to 86
+        prospect, name = 'ESPINOZA CEDENO JOSE', 'JOSE LUIS ESPINOZA CEDENO'
+        self.assertEqual(FuzzyScorer.score_many([prospect], [name], 86, workers=1), [[(0, 86)]])
+        self.assertEqual(FuzzyScorer.score_many([prospect], [name], 87, workers=1), [[]])
+
+    def test_chunks_keep_name_positions(self):
+        expected = FuzzyScorer.score_many(self.PROSPECTS, self.NAMES, 70, workers=1)
+        with mock.patch.object(FuzzyScorer, 'SCORER_CHUNK_SIZE', 3):
+            self.assertEqual(FuzzyScorer.score_many(self.PROSPECTS, self.NAMES, 70, workers=1), expected)
+
+    def test_empty_inputs(self):
+        self.assertEqual(FuzzyScorer.score_many(['ANA'], [], 80), [[]])
+        self.assertEqual(FuzzyScorer.score_many([], self.NAMES, 80), [])
+
+
+class ComparaLoteTests(TestCase):
+    LISTED = [
+        ('JUAN CARLOS PEREZ GOMEZ', 'Juanito Perez; El Flaco', 'OFAC'),
+        ('MARIA FERNANDA LOPEZ', None, 'ONU'),
+        ('PEDRO ANTONIO RAMIREZ', 'Pedro Ramirez Diaz', 'OFAC'),
+        ('JOSE LUIS ESPINOZA CEDENO', 'Pepe Espinoza', 'OFAC'),
+    ]
+    PROSPECTS = ['Juan Carlos Peres Gomes', 'maria fernanda lopes', 'Pedro Ramires', 'Roberto Sanchez']
+
+    def setUp(self):
+        for name, also_known_as, lista in self.LISTED:
+            restrictiva.objects.create(name=name, also_known_as=also_known_as, list=lista)
+        puntaje.objects.create(pk=1, puntaje_Max=80)
+        invalidate_threshold()
+        self.addCleanup(invalidate_threshold)
+        index = ScreeningIndex()
+        index.build()
+        patcher = mock.patch('apirest.codeorm.get_screening_index', return_value=index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_comparar_lote_matches_comparar_per_prospect(self):
+        resultados = consult2().comparar_lote(self.PROSPECTS)
+        self.assertEqual(len(resultados), len(self.PROSPECTS))
+        self.assertTrue(all(resultados[:-1]))
+        self.assertEqual(resultados[-1], [])
+        for prospect, hits in zip(self.PROSPECTS, resultados):
+            single = consult2()
+            single.comparar(prospect)
+            self.assertEqual(sorted((hit['id'], hit['Puntos']) for hit in hits),
+                             sorted((hit['id'], hit['Puntos']) for hit in single.sancionados), prospect)
+            for hit in hits:
+                self.assertGreaterEqual(hit['Puntos'], 80)
+                self.assertEqual(hit['Puntos'], fuzz.partial_ratio(prospect.upper(), hit['Coincidencia']))
+
+
+class ScreeningIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = load_listed()
+
+    def test_candidates_keep_every_match(self):
+        for threshold in (70, 85):
+            for prospect in PROSPECTS:
+                selected = {(rid, texto) for rid, texto, _, _ in self.index.candidates(prospect, threshold)}
+                expected = set(brute_force(prospect, threshold))
+                self.assertLessEqual(expected, selected, (prospect, threshold))
+
+    def test_upsert_and_remove(self):
+        entry = restrictiva.objects.create(name='ROBERTO SANCHEZ', also_known_as='Beto Sanchez', list='OFAC')
+        self.index.upsert(entry.pk, entry.name, entry.list, list(entry.nombres.all()))
+        selected = {texto for rid, texto, _, _ in self.index.candidates('Roberto Sanches', 85) if rid == entry.pk}
+        self.assertEqual(selected, {'ROBERTO SANCHEZ', 'BETO SANCHEZ'})
+
+        self.index.remove(entry.pk)
+        self.assertNotIn(entry.pk, {rid for rid, _, _, _ in self.index.candidates('Roberto Sanches', 85)})
+
+
+class BulkScreeningTests(TestCase):
+
+    def setUp(self):
+        self.index = load_listed()
+
+    def test_screen_prospects_matches_brute_force(self):
+        for threshold in (70, 85):
+            results = screen_prospects(self.index, PROSPECTS, threshold, workers=1)
+            self.assertGreaterEqual(sum(1 for hits in results if hits), 5)
+            for prospect, hits in zip(PROSPECTS, results):
+                # One hit per listed entry, with its best name or alias
+                best = {}
+                for (rid, _), score in brute_force(prospect, threshold).items():
+                    best[rid] = max(score, best.get(rid, score))
+                found = {hit['id']: hit['Puntos'] for hit in hits}
+                self.assertEqual(found, best, (prospect, threshold))
+
+    def test_snapshot_does_not_see_later_edits(self):
+        snapshot = self.index.snapshot()
+        entry = restrictiva.objects.create(name='ROBERTO SANCHEZ', list='OFAC')
+        self.index.upsert(entry.pk, entry.name, entry.list, list(entry.nombres.all()))
+
+        self.assertEqual(screen_prospects(snapshot, ['Roberto Sanchez'], 85, workers=1), [[]])
+        hits = screen_prospects(self.index, ['Roberto Sanchez'], 85, workers=1)[0]
+        self.assertEqual([hit['id'] for hit in hits], [entry.pk])
+        self.assertNotEqual(snapshot.generation, self.index.generation)
+        with self.assertRaises(RuntimeError):
+            snapshot.remove(entry.pk)
+
+
+def legacy_cedula(text_detections, puntos):
+    """
+    The if/elif chain consult45.detect_text used before CedulaExtractor,
+    with the per-token pd.concat replaced by a list of confidences
+    """
+    ciudadania = Id = Tipo_Ciudadania = Nombre = Apellidos = ""
+    Fecha_de_Nacimiento = Lugar_de_Nacimiento = expedida = expira = Nacionalidad = ""
+    sexo = Idword = Idwordexpedida = Idwordexpira = ""
+    Id_prox = 0
+    confidences = []
+
+    for text in text_detections:
+        cadena = text['DetectedText']
+        Tipo = text['Type']
+        Rep3 = cadena
+        name1 = cadena[2:4]
+
+        if cadena.count('-') > 0:
+            indice_g1 = cadena.index('-') + 1
+            Id_verifica = cadena[indice_g1:indice_g1 + 3]
+        if Id_prox > 0:
+            Id_prox = 1 + Id_prox
+        if "PANAM" in Rep3 and Tipo == 'LINE' and not Nacionalidad:
+            Nacionalidad = "REPUBLICA DE PANAMA"
+            confidences.append(int(text['Confidence']))
+        elif "CARNE" in Rep3 and Tipo == 'LINE' and not Tipo_Ciudadania:
+            Tipo_Ciudadania = 'CEDULA EXTRANJERO'
+            ciudadania = ''
+            confidences.append(int(text['Confidence']))
+        elif ("TRIBUNA" in Rep3 or "ELECTO" in Rep3) and Tipo == 'LINE' and not Tipo_Ciudadania:
+            Tipo_Ciudadania = 'CEDULA PANAMEÑA'
+            ciudadania = 'PANAMEÑA'
+            confidences.append(int(text['Confidence']))
+        elif name1.islower() and not Nombre:
+            Nombre = ' '.join(text['DetectedText'].split(' ')[:4])
+            confidences.append(int(text['Confidence']))
+        elif name1.islower() and not Apellidos:
+            Apellidos = ' '.join(text['DetectedText'].split(' ')[:2])
+            confidences.append(int(text['Confidence']))
+        elif "NACIMIENTO:" in Rep3 and Tipo == 'LINE' and not Lugar_de_Nacimiento:
+            if not Tipo_Ciudadania == "CEDULA PANAMEÑA":
+                Lugar_Nac_toda = text['DetectedText']
+                if Lugar_Nac_toda.count('DE DE') > 0:
+                    indice_az = Lugar_Nac_toda.index('NACIMIENTO: NACIMIENTO:') + 23
+                    Lugar_de_Nacimiento = cadena[indice_az + 1:indice_az + 12]
+                elif Lugar_Nac_toda.count('LUGAR DE NACIMIENTO') > 0:
+                    Lugar_Nac_toda1 = Lugar_Nac_toda.split(' ')
+                    if len(Lugar_Nac_toda1) > 1 and Id_verifica.isalpha():
+                        Lugar_de_Nacimiento = Lugar_Nac_toda1[3]
+                        confidences.append(int(text['Confidence']))
+            else:
+                Lugar_de_Nacimiento = 'PANAMA'
+        elif 'EXPEDIDA' in Rep3 and Tipo == 'LINE' and not expedida:
+            if ':' in Rep3:
+                expedida_ = Rep3.split(':')
+                expedida = expedida_[1][1:12]
+                if len(expedida_) > 2:
+                    expira = expedida_[2][1:12]
+                confidences.append(int(text['Confidence']))
+        elif "NACIONA" in Rep3 and Tipo == 'LINE' and not ciudadania:
+            pass
+        elif "SEX" in Rep3 and Tipo == 'LINE':
+            if Rep3.count('SEXO') > 0:
+                sex_todo1 = Rep3.split(' ')
+                if len(sex_todo1) > 1 and len(sex_todo1[1]) == 1:
+                    if sex_todo1[1] in ('F', 'M'):
+                        sexo = sex_todo1[1]
+                        confidences.append(int(text['Confidence']))
+                    elif sex_todo1[1] in ('I', 'l'):
+                        sexo = 'F'
+                        confidences.append(int(text['Confidence']))
+                    elif sex_todo1[1] in ('N', 'H'):
+                        sexo = 'M'
+                        confidences.append(int(text['Confidence']))
+                elif len(sex_todo1) == 1 and sex_todo1[0] == 'SEXO:F':
+                    sexo = 'F'
+        elif "-" in Rep3 and Tipo == 'WORD' and not Fecha_de_Nacimiento and Id_verifica.isalpha():
+            indice_g1 = Rep3.split('-')
+            Id_verifica = indice_g1[1]
+            mes = unidecode(Id_verifica, errors='preserve')
+            if 'OST' in mes:
+                mes = 'OCT'
+            if Id_verifica.isalpha():
+                if "NACIMIENTO:" in indice_g1[0]:
+                    Fecha_de_Nacimiento = indice_g1[0].split(':')[1] + '-' + mes + '-' + indice_g1[2]
+                else:
+                    Fecha_de_Nacimiento = indice_g1[0] + '-' + mes + '-' + indice_g1[2]
+            confidences.append(int(text['Confidence']))
+        elif "-" in Rep3 and Tipo == 'WORD' and not Id:
+            indice_g1 = Rep3.index('-') + 1
+            Id_verifica = cadena[indice_g1:indice_g1 + 3]
+            if not Id_verifica.isalpha():
+                Id = text['DetectedText']
+                confidences.append(int(text['Confidence']))
+        elif 'EXPEDIDA' in Rep3 and Tipo == 'WORD' and not expedida:
+            Idwordexpedida = text['ParentId']
+        elif Tipo == 'WORD' and text['ParentId'] == Idwordexpedida and not expedida:
+            expedida = Rep3[0:11]
+            confidences.append(int(text['Confidence']))
+        elif 'EXPIRA' in Rep3 and Tipo == 'WORD' and not expira:
+            Idwordexpira = text['ParentId']
+        elif Tipo == 'WORD' and text['ParentId'] == Idwordexpira and not expira:
+            expira = Rep3[0:11]
+            confidences.append(int(text['Confidence']))
+        elif "LUGAR" in Rep3 and Tipo == 'WORD' and not Lugar_de_Nacimiento:
+            Id_prox = 1 + Id_prox
+        elif Id_prox == 4 and Tipo == 'WORD' and not Lugar_de_Nacimiento:
+            if not Tipo_Ciudadania == 'CEDULA PANAMEÑA':
+                Lugar_de_Nacimiento = text['DetectedText']
+                Id_prox = 0
+            else:
+                Lugar_de_Nacimiento = 'PANAMA'
+        elif "NACIONALIDAD" in Rep3 and Tipo == 'WORD' and not ciudadania:
+            Idword = text['ParentId']
+        elif Tipo == 'WORD' and text['ParentId'] == Idword and not ciudadania:
+            ciudadania = text['DetectedText']
+            Tipo_Ciudadania = 'CEDULA EXTRANJERA'
+        elif "SEXO" in Rep3 and Tipo == 'WORD' and not sexo:
+            Idword = text['ParentId']
+        elif Tipo == 'WORD' and text['ParentId'] == Idword and not sexo:
+            sex_todo = text['DetectedText']
+            if sex_todo in ('F', 'M'):
+                sexo = sex_todo
+                confidences.append(int(text['Confidence']))
+            elif sex_todo in ('I', 'l'):
+                sexo = 'F'
+                confidences.append(int(text['Confidence']))
+            elif sex_todo in ('N', 'H'):
+                sexo = 'M'
+                confidences.append(int(text['Confidence']))
+
+    # df2[df2['avg'] != 0]['avg'].mean(), NaN when nothing was kept
+    confidences = [c for c in confidences if c != 0]
+    xx = sum(confidences) / len(confidences) if confidences else float('nan')
+    if not Id or not Tipo_Ciudadania or not Nombre or not Apellidos or not Fecha_de_Nacimiento \
+            or not Lugar_de_Nacimiento or not expedida or not expira or not sexo or not ciudadania:
+        x = '400_Bad Quality_image'
+    else:
+        x = '200_OK'
+    if xx < puntos:
+        x = '400_Bad Quality_image'
+    return {'cod': x, 'Numero_de_Documento': Id, 'Expedicion': expedida, 'Expira': expira,
+            'Pais_de_Residencia': Nacionalidad, 'Nombres': Nombre, 'Apellidos': Apellidos,
+            'Fecha_de_Nacimiento': Fecha_de_Nacimiento, 'Lugar_de_Nacimiento': Lugar_de_Nacimiento,
+            'Genero': sexo, 'Nacionalidad': ciudadania}
+
+
+def text_detections(lines, confidence=97.5):
+    """Rekognition detect_text response: every LINE, then its WORDs with the line as ParentId"""
+    detections = [{'Id': i, 'Type': 'LINE', 'DetectedText': line, 'Confidence': confidence}
+                  for i, line in enumerate(lines)]
+    for i, line in enumerate(lines):
+        detections.extend({'Id': len(detections), 'ParentId': i, 'Type': 'WORD', 'DetectedText': word,
+                           'Confidence': confidence} for word in line.split(' '))
+    return detections
+
+
+class CedulaExtractorTests(SimpleTestCase):
+    CARDS = {
+        'cedula': [
+            'REPUBLICA DE PANAMA', 'TRIBUNAL ELECTORAL', 'Juan Carlos', 'Perez Gomez',
+            'NOMBRE USUAL:', 'FECHA DE NACIMIENTO: 12-MAR-1985', 'LUGAR DE NACIMIENTO: PANAMA, PANAMA',
+            'SEXO: M', 'EXPEDIDA: 05-ENE-2020 EXPIRA: 05-ENE-2030', '8-765-4321',
+        ],
+        'carne': [
+            'REPUBLICA DE PANAMA', 'CARNE DE RESIDENTE PERMANENTE', 'Maria Fernanda', 'Lopez Rios',
+            'FECHA DE NACIMIENTO: 03-AGO-1990', 'LUGAR DE NACIMIENTO: CARACAS VENEZUELA',
+            'NACIONALIDAD: VENEZOLANA', 'SEXO: l', 'E-8-123456', 'EXPEDIDA: 10-FEB-2021', 'EXPIRA: 10-FEB-2031',
+        ],
+        'carne_split_words': [
+            'REPUBLICA DE PANAMA', 'CARNE DE RESIDENTE', 'Ana Lucia', 'Torres Vega',
+            'NACIMIENTO:21-OST-1979', 'LUGAR DE NACIMIENTO', 'BOGOTA', 'NACIONALIDAD COLOMBIANA',
+            'SEXO H', 'E-8-99887', 'EXPEDIDA 01-JUN-2019', 'EXPIRA 01-JUN-2029',
+        ],
+        'incomplete': ['REPUBLICA DE PANAMA', 'TRIBUNAL ELECTORAL', 'Pedro Ramirez', 'SEXO:F', '8-111-222'],
+    }
+
+    def assert_same_fields(self, detections, threshold, msg=None):
+        result = extract_cedula(detections, threshold).to_dict()
+        self.assertEqual(result, legacy_cedula(detections, threshold), msg)
+        return result
+
+    def test_cards_match_previous_chain(self):
+        for card, lines in self.CARDS.items():
+            for threshold in (80, 99):
+                self.assert_same_fields(text_detections(lines), threshold, (card, threshold))
+
+        cedula = self.assert_same_fields(text_detections(self.CARDS['cedula']), 80)
+        self.assertEqual((cedula['cod'], cedula['Numero_de_Documento'], cedula['Genero']),
+                         ('200_OK', '8-765-4321', 'M'))
+        carne = self.assert_same_fields(text_detections(self.CARDS['carne']), 80)
+        self.assertEqual((carne['cod'], carne['Nacionalidad'], carne['Genero'], carne['Expira']),
+                         ('200_OK', 'VENEZOLANA', 'F', '10-FEB-2031'))
+
+    def test_shuffled_detections_match_previous_chain(self):
+        rng = random.Random(7)
+        for card, lines in self.CARDS.items():
+            for _ in range(200):
+                detections = text_detections(lines, confidence=rng.choice((0, 60.2, 85.0, 99.9)))
+                rng.shuffle(detections)
+                # The previous chain needs a '-' before a place of birth line
+                detections.insert(0, {'Id': -1, 'Type': 'LINE', 'DetectedText': 'REF-ABC', 'Confidence': 90.0})
+                self.assert_same_fields(detections, 80, card)
+
+
+class ImageEncoderTests(SimpleTestCase):
+
+    def test_encode_to_size_stays_under_limit(self):
+        image = document_image()
+        # The last limit only fits once the page is scaled down
+        for limit in (600 * 1024, 300 * 1024, 180 * 1024):
+            data, quality, scale = encode_to_size(image, limit)
+            self.assertLessEqual(len(data), limit, limit)
+            self.assertEqual(Image.open(io.BytesIO(data)).format, 'JPEG')
+        self.assertLess(scale, 1.0)
+
+    def test_small_image_keeps_best_quality(self):
+        data, quality, scale = encode_to_size(document_image((300, 200)), 4 * 1024 * 1024, max_quality=95)
+        self.assertEqual((quality, scale), (95, 1.0))
+
+
+class ImagePipelineTests(SimpleTestCase):
+    CHAINS = [
+        [('autocontrast', 1), ('contrast', 1.4), ('brightness', 1.02)],
+        [('brightness', 1.5), ('autocontrast', 1), ('contrast', 1.6)],
+        [('autocontrast', 0.5), ('contrast', 1.3)],
+        [('contrast', 1.3), ('brightness', 1.05)],
+    ]
+
+    @staticmethod
+    def sequential(image, chain):
+        for operation, value in chain:
+            if operation == 'autocontrast':
+                image = ImageOps.autocontrast(image, cutoff=value)
+            elif operation == 'contrast':
+                image = ImageEnhance.Contrast(image).enhance(value)
+            else:
+                image = ImageEnhance.Brightness(image).enhance(value)
+        return image
+
+    @staticmethod
+    def fused(image, chain):
+        stages = {'autocontrast': AutoContrast, 'contrast': Contrast, 'brightness': Brightness}
+        return apply_stages(image, [stages[operation](value) for operation, value in chain])
+
+    def test_fused_point_operations_match_pillow(self):
+        for mode in ('RGB', 'L'):
+            image = document_image((600, 800), mode)
+            for chain in self.CHAINS:
+                expected = np.asarray(self.sequential(image, chain), dtype=np.int16)
+                actual = np.asarray(self.fused(image, chain), dtype=np.int16)
+                self.assertEqual(actual.shape, expected.shape)
+                # Same arithmetic as Pillow, contrast means within one grey level
+                self.assertLessEqual(int(np.abs(actual - expected).max()), 1, (mode, chain))
+
+
+class BatchJobTests(TestCase):
+
+    def setUp(self):
+        self.job = BatchJobs.submit_job('raw', ['a.jpg', 'b.jpg'], 'bucket')
+
+    def make_stale(self):
+        batch_job.objects.filter(pk=self.job.pk).update(
+            actualizado=timezone.now() - timedelta(seconds=BatchJobs.STALE_AFTER + 1))
+
+    def test_claim_takes_each_job_once(self):
+        claimed = BatchJobs.claim_next_job()
+        self.assertEqual(claimed.pk, self.job.pk)
+        self.assertEqual((claimed.estado, claimed.intentos), ('running', 1))
+        self.assertIsNone(BatchJobs.claim_next_job())
+
+    def test_stale_job_is_requeued_and_old_attempt_fenced(self):
+        first = BatchJobs.claim_next_job()
+        self.make_stale()
+        BatchJobs.requeue_stale()
+        self.assertEqual(batch_job.objects.get(pk=self.job.pk).estado, 'queued')
+
+        second = BatchJobs.claim_next_job()
+        self.assertEqual(second.intentos, 2)
+        # The first worker's writes no longer apply
+        self.assertEqual(BatchJobs._attempt(first).update(paginas_procesadas=1), 0)
+        self.assertEqual(BatchJobs._attempt(second).update(paginas_procesadas=1), 1)
+
+    def test_fresh_job_is_not_requeued(self):
+        BatchJobs.claim_next_job()
+        BatchJobs.requeue_stale()
+        self.assertEqual(batch_job.objects.get(pk=self.job.pk).estado, 'running')
+
+    def test_stale_job_fails_after_max_attempts(self):
+        batch_job.objects.filter(pk=self.job.pk).update(intentos=BatchJobs.MAX_ATTEMPTS - 1)
+        BatchJobs.claim_next_job()
+        self.make_stale()
+        BatchJobs.requeue_stale()
+        job = batch_job.objects.get(pk=self.job.pk)
+        self.assertEqual(job.estado, 'failed')
+        self.assertIsNone(BatchJobs.claim_next_job())
+
+    def test_run_job_stores_result(self):
+        job = BatchJobs.claim_next_job()
+        with mock.patch.dict(BatchJobs.JOB_TYPES, {'raw': f'{__name__}.FakeBatchView'}):
+            BatchJobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual((job.estado, job.codigo_http, job.resultado), ('done', 200, {'pages': ['a.jpg', 'b.jpg']}))
+
+    def test_run_job_discards_result_of_lost_attempt(self):
+        job = BatchJobs.claim_next_job()
+
+        def requeue_and_reclaim(file_list, bucket_name, options):
+            self.make_stale()
+            BatchJobs.requeue_stale()
+            BatchJobs.claim_next_job()
+            return {'pages': file_list}, 200
+
+        with mock.patch.dict(BatchJobs.JOB_TYPES, {'raw': f'{__name__}.FakeBatchView'}), \
+                mock.patch.object(FakeBatchView, 'process_batch', side_effect=requeue_and_reclaim):
+            BatchJobs.run_job(job)
+        stored = batch_job.objects.get(pk=job.pk)
+        self.assertEqual((stored.estado, stored.intentos, stored.resultado), ('running', 2, None))
+
+    def test_idle_worker_requeues_stale_jobs(self):
+        BatchJobs.claim_next_job()
+        self.make_stale()
+        stop_event = threading.Event()
+        # One idle poll, without closing the test transaction's connection
+        with mock.patch.object(BatchJobs, 'close_old_connections'), \
+                mock.patch.object(BatchJobs._wakeup, 'wait', side_effect=lambda timeout: stop_event.set()):
+            BatchJobs.worker_loop(stop_event)
+        self.assertEqual(batch_job.objects.get(pk=self.job.pk).estado, 'queued')
+
+
+class FakeBatchView:
+    """Stands in for a batch-ocr view in the job tests"""
+
+    def process_batch(self, file_list, bucket_name, options):
+        return {'pages': file_list}, 200
+
+
+class ResultCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        ResultCache.clear_result_cache()
+        self.addCleanup(ResultCache.clear_result_cache)
+
+    def test_keys_separate_operations_digests_and_variants(self):
+        digest = ResultCache.content_digest(b'page')
+        color = {'preprocess': get_profile('passport', 'color').name}
+        gray = {'preprocess': get_profile('passport', 'gray').name}
+        binary = {'preprocess': get_profile('passport', 'binary').name}
+        keys = {
+            ResultCache.cache_key('textract.detect_document_text.passport', digest, color),
+            ResultCache.cache_key('textract.detect_document_text.passport', digest, gray),
+            ResultCache.cache_key('textract.detect_document_text.passport', digest, binary),
+            ResultCache.cache_key('textract.detect_document_text.passport', digest, None),
+            ResultCache.cache_key('textract.analyze_document.titulo', digest, color),
+            ResultCache.cache_key('textract.detect_document_text.passport', ResultCache.content_digest(b'other'),
+                                  color),
+        }
+        self.assertEqual(len(keys), 6)
+        self.assertEqual(ResultCache.cache_key('op', digest, {'a': 1, 'b': 2}),
+                         ResultCache.cache_key('op', digest, {'b': 2, 'a': 1}))
+
+    def test_cached_call_hits_only_the_same_variant(self):
+        calls = []
+
+        def call():
+            calls.append(1)
+            return {'Blocks': [len(calls)]}
+
+        digest = ResultCache.etag_digest('bucket', '"abc"')
+        gray = {'preprocess': get_profile('titulo', 'gray').name}
+        color = {'preprocess': get_profile('titulo', 'color').name}
+        first = ResultCache.cached_call('textract.analyze_document.titulo', digest, gray, call)
+        again = ResultCache.cached_call('textract.analyze_document.titulo', digest, gray, call)
+        other = ResultCache.cached_call('textract.analyze_document.titulo', digest, color, call)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(again, first)
+        self.assertIsNot(again, first)
+        self.assertNotEqual(other, first)
+
+    def test_no_digest_disables_caching(self):
+        calls = []
+        for _ in range(2):
+            ResultCache.cached_call('textract.analyze_id', None, None, lambda: calls.append(1) or {})
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_are_not_cached(self):
+        def fail():
+            raise RuntimeError('throttled')
+
+        digest = ResultCache.content_digest(b'page')
+        with self.assertRaises(RuntimeError):
+            ResultCache.cached_call('op', digest, None, fail)
+        self.assertEqual(ResultCache.cached_call('op', digest, None, lambda: {'ok': True}), {'ok': True})
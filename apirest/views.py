@@ -2,9 +2,13 @@ from __future__ import unicode_literals
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.response import Response
-from apirest.serializers import llegaSerializer2, llegafaceSerializer2, FileUploadSerializer, TextractAnalysisSerializer, BatchOCRSerializer, QRCodeSerializer, QRCodeBatchSerializer
-from django.http import HttpResponse
+from apirest.serializers import llegaSerializer2, llegafaceSerializer2, FileUploadSerializer, TextractAnalysisSerializer, BatchOCRSerializer, QRCodeSerializer, QRCodeBatchSerializer, BulkScreeningSerializer
+from django.http import HttpResponse, StreamingHttpResponse
 from .codeorm import consult2
+from .models import llegadas2, puntaje, batch_job
+from .ScreeningIndex import get_screening_index
+from .ThresholdCache import get_threshold
+from .BulkScreening import iter_screening
 from .AWSocr import consult45
 from .AWSocrRaw import consult45Raw
 from .AWScompare import consult46
@@ -16,6 +20,8 @@ from .AWSTextractPassport import TextractPassportAnalyzer
 from .AWSTextractCertificado import TextractCertificadoAnalyzer
 from .AWSTextractTitulo import TextractUniversityTitleAnalyzer
 from .HTMLtoPDF import HTMLToPDFConverter
+from .BatchJobs import submit_job, job_status
+from .AsyncViews import ASYNC_VIEWS, run_blocking
 from rest_framework import status
 from django.contrib.auth.models import User
 from django.contrib.auth.hashers import check_password
@@ -23,12 +29,19 @@ from rest_framework.decorators import api_view
 from rest_framework.authtoken.models import Token
 from rest_framework.permissions import IsAuthenticated
 from django.utils import timezone
+from django.core.serializers.json import DjangoJSONEncoder
+import asyncio
+import json
 import logging
+import time
 from decouple import config
 
 # Configure logger for API views
 logger = logging.getLogger('apirest.aws')
 
+# Seconds a batch-jobs/<id>/events/ stream stays open, under the nginx timeout
+JOB_STREAM_TIMEOUT = config('BATCH_JOB_STREAM_TIMEOUT', default=50, cast=int)
+
 @api_view(['GET'])
 def health_check(request):
     """Endpoint de salud para verificar que la API funciona"""
@@ -57,6 +70,92 @@ def login(request):
     return Response(token.key)
 
 
+def _job_mode(request):
+    """Batch endpoints run as a background job with "async": true (or ?async=1)"""
+    value = request.query_params.get('async', request.data.get('async', False))
+    if isinstance(value, str):
+        value = value.lower() in ('true', '1', 'yes')
+    return bool(value)
+
+
+def _submit_batch_job(tipo, file_list, bucket_name, options):
+    job = submit_job(tipo, file_list, bucket_name, options)
+    data = job_status(job, include_result=False)
+    data.update({
+        'success': True,
+        'status_url': f'/batch-jobs/{job.id}/',
+        'events_url': f'/batch-jobs/{job.id}/events/',
+    })
+    return Response(data, status=status.HTTP_202_ACCEPTED)
+
+
+def _job_not_found(job_id):
+    return Response({
+        'success': False,
+        'error': f'Batch job {job_id} not found',
+        'error_code': '404_Batch_Job_Not_Found'
+    }, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['GET'])
+def batch_job_detail(request, job_id):
+    """Estado de un job batch; incluye el resultado cuando termina"""
+    job = batch_job.objects.filter(pk=job_id).first()
+    if job is None:
+        return _job_not_found(job_id)
+    return Response(job_status(job), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+def batch_job_events(request, job_id):
+    """
+    Progreso de un job batch en NDJSON: una línea por cada cambio de estado
+    o de páginas procesadas, hasta que termina (la última línea trae el
+    resultado) o pasan BATCH_JOB_STREAM_TIMEOUT segundos; el cliente puede
+    volver a conectarse o consultar batch-jobs/<id>/
+    """
+    if not batch_job.objects.filter(pk=job_id).exists():
+        return _job_not_found(job_id)
+
+    def stream():
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+        last = None
+        while True:
+            line, last, finished = _job_event(job_id, last)
+            if line:
+                yield line
+            if finished or time.monotonic() > deadline:
+                return
+            time.sleep(1)
+
+    async def async_stream():
+        # ASGI: poll without holding a thread between checks
+        deadline = time.monotonic() + JOB_STREAM_TIMEOUT
+        last = None
+        while True:
+            line, last, finished = await run_blocking(_job_event, job_id, last)
+            if line:
+                yield line
+            if finished or time.monotonic() > deadline:
+                return
+            await asyncio.sleep(1)
+
+    return StreamingHttpResponse(async_stream() if ASYNC_VIEWS else stream(),
+                                 content_type='application/x-ndjson', status=status.HTTP_200_OK)
+
+
+def _job_event(job_id, last):
+    """One poll of a job: (NDJSON line or None if unchanged, new state, finished)"""
+    job = batch_job.objects.filter(pk=job_id).first()
+    if job is None:
+        return None, last, True
+    finished = job.estado in ('done', 'failed')
+    if (job.estado, job.paginas_procesadas) == last:
+        return None, last, finished
+    line = json.dumps(job_status(job, include_result=finished), cls=DjangoJSONEncoder) + '\n'
+    return line, (job.estado, job.paginas_procesadas), finished
+
+
 
 
 
@@ -76,7 +175,7 @@ class restric(generics.CreateAPIView):
             index2 = consult2()
             index2.comparar(str1)
             """recibo los datos en sancionados y los mando a un diccionario"""
-            df_dicts = index2.sancionados.T.to_dict().values()
+            df_dicts = index2.sancionados.to_dicts()
             """obtengo la longitud del diccionario"""
             lendic = len(df_dicts)
             if lendic == 0:
@@ -85,6 +184,53 @@ class restric(generics.CreateAPIView):
             return Response(df_dicts, status=status.HTTP_200_OK,)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+class restricBulk(generics.CreateAPIView):
+    """
+    Screening masivo contra listas restrictivas
+    Responde en NDJSON: una línea por prospecto a medida que se procesa
+    (el campo 'index' indica su posición en la entrada) y una línea final
+    con el resumen
+    """
+    serializer_class = BulkScreeningSerializer
+    #permission_classes = [IsAuthenticated]
+    def post(self, request, format=None):
+        serializer = BulkScreeningSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        prospects = serializer.validated_data['prospects']
+        llegadas2.objects.bulk_create([llegadas2(string_income=name) for name in prospects])
+
+        # Same snapshot and threshold for the whole batch: edits made while
+        # it streams go to the live index, not to this snapshot
+        index = get_screening_index().snapshot()
+        puntos = get_threshold(puntaje)
+        logger.info(f"Bulk screening requested for {len(prospects)} prospects")
+
+        def stream():
+            started = timezone.now()
+            with_hits = 0
+            for position, prospect, hits in iter_screening(index, prospects, puntos):
+                if hits:
+                    with_hits += 1
+                yield json.dumps({
+                    'index': position,
+                    'Prospecto': prospect,
+                    'total': len(hits),
+                    'resultados': hits,
+                }, ensure_ascii=False) + '\n'
+            yield json.dumps({
+                'summary': {
+                    'total_prospects': len(prospects),
+                    'with_results': with_hits,
+                    'threshold': puntos,
+                    'processing_time': (timezone.now() - started).total_seconds(),
+                }
+            }) + '\n'
+
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson', status=status.HTTP_200_OK)
+
 #------------desde aqui las consultas a Face AWS
 
 class ocr2(generics.CreateAPIView):
@@ -140,8 +286,8 @@ class ocr2(generics.CreateAPIView):
                     return Response({'error': 'OCR processing failed - no results generated'}, 
                                   status=status.HTTP_500_INTERNAL_SERVER_ERROR)
                 
-                logger.debug("Converting OCR results to dictionary format")
-                df_dicts = index2.sancionados.T.to_dict().values()
+                logger.debug("Serializing OCR results")
+                df_dicts = index2.sancionados.to_dicts()
                 lendic = len(df_dicts)
                 
                 logger.info(f"OCR processing completed - {lendic} results found")
@@ -192,7 +338,7 @@ class Compare3(generics.CreateAPIView):
                     
                     logger.debug("Face comparison completed, processing results")
                     """recibo los datos en sancionados y los mando a un diccionario"""
-                    df_dicts = index3.comparar.T.to_dict().values()
+                    df_dicts = index3.comparar.to_dicts()
 
                     """obtengo la longitud del diccionario"""
                     lendic = len(df_dicts)
@@ -320,9 +466,8 @@ class FileUploadView(generics.CreateAPIView):
                 # Get uploaded file
                 uploaded_file = serializer.validated_data['file']
                 filename = uploaded_file.name
-                file_content = uploaded_file.read()
                 
-                logger.info(f"Processing file upload - Name: {filename}, Size: {len(file_content)} bytes")
+                logger.info(f"Processing file upload - Name: {filename}, Size: {uploaded_file.size} bytes")
                 logger.debug(f"File details - Content type: {uploaded_file.content_type}, Size: {uploaded_file.size}")
                 
                 # Initialize file upload handler
@@ -331,7 +476,12 @@ class FileUploadView(generics.CreateAPIView):
                 
                 # Upload file with automatic conversion
                 logger.info(f"Starting upload process for: {filename}")
-                result = uploader.upload_file(file_content, filename)
+                if hasattr(uploaded_file, 'temporary_file_path'):
+                    # Large upload already spooled to disk by Django
+                    # (FILE_UPLOAD_MAX_MEMORY_SIZE): stream it from there
+                    result = uploader.upload_file_from_path(uploaded_file.temporary_file_path(), filename)
+                else:
+                    result = uploader.upload_file(uploaded_file.read(), filename)
                 
                 logger.info(f"Upload process completed - Success: {result.get('success', False)}")
                 
@@ -541,6 +691,7 @@ class BatchOCRRawView(generics.CreateAPIView):
     Endpoint para procesamiento batch de OCR Raw
     Procesa múltiples archivos de forma secuencial y devuelve resultado combinado
     Ideal para PDFs divididos en páginas o lotes de imágenes
+    Con "async": true se encola como job y responde 202 con job_id
     """
     serializer_class = BatchOCRSerializer
     #permission_classes = [IsAuthenticated]
@@ -565,32 +716,12 @@ class BatchOCRRawView(generics.CreateAPIView):
                 logger.info(f"Processing batch OCR for {len(file_list)} files in bucket: {bucket_name}")
                 logger.debug(f"Files to process: {file_list}")
                 
-                # Initialize batch processor
-                logger.debug("Initializing consult45Raw for batch processing")
-                processor = consult45Raw()
+                # Job mode: queue the batch and answer at once with the job id
+                if _job_mode(request):
+                    return _submit_batch_job('raw', file_list, bucket_name, {})
                 
-                # Process files in batch
-                logger.info("Starting batch OCR processing")
-                result = processor.detect_text_batch(file_list, bucket_name)
-                
-                logger.info(f"Batch OCR completed - Success: {result['success']}, "
-                          f"Processed: {result['files_processed']}, "
-                          f"Successful: {result['files_successful']}, "
-                          f"Failed: {result['files_failed']}")
-                
-                # Determine response status based on results
-                if result['success']:
-                    # All files processed successfully
-                    logger.info("All files processed successfully")
-                    return Response(result, status=status.HTTP_200_OK)
-                elif result['files_successful'] > 0:
-                    # Some files processed successfully, some failed
-                    logger.warning(f"Partial success: {result['files_failed']} files failed")
-                    return Response(result, status=status.HTTP_207_MULTI_STATUS)
-                else:
-                    # All files failed
-                    logger.error("All files failed to process")
-                    return Response(result, status=status.HTTP_400_BAD_REQUEST)
+                result, result_status = self.process_batch(file_list, bucket_name, {})
+                return Response(result, status=result_status)
                 
             except Exception as e:
                 logger.error(f"Unexpected error in Batch OCR endpoint: {str(e)}")
@@ -640,6 +771,41 @@ class BatchOCRRawView(generics.CreateAPIView):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def process_batch(self, file_list, bucket_name, options):
+        """
+        Process the batch and build the response
+        Also run by the batch job workers (apirest.BatchJobs) in job mode
+
+        Returns:
+            tuple: (response data, HTTP status)
+        """
+        # Initialize batch processor
+        logger.debug("Initializing consult45Raw for batch processing")
+        processor = consult45Raw()
+
+        # Process files in batch
+        logger.info("Starting batch OCR processing")
+        result = processor.detect_text_batch(file_list, bucket_name)
+
+        logger.info(f"Batch OCR completed - Success: {result['success']}, "
+                  f"Processed: {result['files_processed']}, "
+                  f"Successful: {result['files_successful']}, "
+                  f"Failed: {result['files_failed']}")
+
+        # Determine response status based on results
+        if result['success']:
+            # All files processed successfully
+            logger.info("All files processed successfully")
+            return result, status.HTTP_200_OK
+        elif result['files_successful'] > 0:
+            # Some files processed successfully, some failed
+            logger.warning(f"Partial success: {result['files_failed']} files failed")
+            return result, status.HTTP_207_MULTI_STATUS
+        else:
+            # All files failed
+            logger.error("All files failed to process")
+            return result, status.HTTP_400_BAD_REQUEST
+
 
 class QRCodeReaderView(generics.CreateAPIView):
     """
@@ -823,7 +989,8 @@ class BatchBirthCertificateOCRView(generics.CreateAPIView):
     {
         "file_list": ["archivo1.jpg", "archivo2.jpg"],  # Lista de archivos en S3
         "bucket_name": "nombre-bucket",                  # Opcional, usa default si no se especifica
-        "preprocess": true                               # Opcional, default true
+        "preprocess": true,                              # Opcional, default true
+        "async": true                                    # Opcional: responde 202 con job_id (ver batch-jobs/<id>/)
     }
     """
     serializer_class = BatchOCRSerializer
@@ -855,37 +1022,12 @@ class BatchBirthCertificateOCRView(generics.CreateAPIView):
                           f"in bucket: {bucket_name}, preprocess: {preprocess}")
                 logger.debug(f"Files to process: {file_list}")
                 
-                # Initialize birth certificate processor
-                logger.debug("Initializing TextractBirthCertificateAnalyzer for batch processing")
-                processor = TextractBirthCertificateAnalyzer()
+                # Job mode: queue the batch and answer at once with the job id
+                if _job_mode(request):
+                    return _submit_batch_job('acta', file_list, bucket_name, {'preprocess': preprocess})
                 
-                # Process files in batch using Textract
-                logger.info("Starting batch birth certificate OCR processing with Textract")
-                result = processor.analyze_birth_certificate_batch(
-                    file_list, 
-                    bucket_name, 
-                    preprocess=preprocess
-                )
-                
-                logger.info(f"Birth Certificate OCR completed - Success: {result['success']}, "
-                          f"Processed: {result['files_processed']}, "
-                          f"Successful: {result['files_successful']}, "
-                          f"Failed: {result['files_failed']}, "
-                          f"Avg Confidence: {result['metadata'].get('average_confidence', 0)}%")
-                
-                # Determine response status based on results
-                if result['success']:
-                    # All files processed successfully
-                    logger.info("All birth certificate files processed successfully")
-                    return Response(result, status=status.HTTP_200_OK)
-                elif result['files_successful'] > 0:
-                    # Some files processed successfully, some failed
-                    logger.warning(f"Partial birth certificate success: {result['files_failed']} files failed")
-                    return Response(result, status=status.HTTP_207_MULTI_STATUS)
-                else:
-                    # All files failed
-                    logger.error("All birth certificate files failed to process")
-                    return Response(result, status=status.HTTP_400_BAD_REQUEST)
+                result, result_status = self.process_batch(file_list, bucket_name, {'preprocess': preprocess})
+                return Response(result, status=result_status)
                 
             except Exception as e:
                 logger.error(f"Unexpected error in Birth Certificate OCR endpoint: {str(e)}")
@@ -941,6 +1083,48 @@ class BatchBirthCertificateOCRView(generics.CreateAPIView):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def process_batch(self, file_list, bucket_name, options):
+        """
+        Process the batch and build the response
+        Also run by the batch job workers (apirest.BatchJobs) in job mode
+
+        Returns:
+            tuple: (response data, HTTP status)
+        """
+        preprocess = options.get('preprocess', True)
+
+        # Initialize birth certificate processor
+        logger.debug("Initializing TextractBirthCertificateAnalyzer for batch processing")
+        processor = TextractBirthCertificateAnalyzer()
+
+        # Process files in batch using Textract
+        logger.info("Starting batch birth certificate OCR processing with Textract")
+        result = processor.analyze_birth_certificate_batch(
+            file_list, 
+            bucket_name, 
+            preprocess=preprocess
+        )
+
+        logger.info(f"Birth Certificate OCR completed - Success: {result['success']}, "
+                  f"Processed: {result['files_processed']}, "
+                  f"Successful: {result['files_successful']}, "
+                  f"Failed: {result['files_failed']}, "
+                  f"Avg Confidence: {result['metadata'].get('average_confidence', 0)}%")
+
+        # Determine response status based on results
+        if result['success']:
+            # All files processed successfully
+            logger.info("All birth certificate files processed successfully")
+            return result, status.HTTP_200_OK
+        elif result['files_successful'] > 0:
+            # Some files processed successfully, some failed
+            logger.warning(f"Partial birth certificate success: {result['files_failed']} files failed")
+            return result, status.HTTP_207_MULTI_STATUS
+        else:
+            # All files failed
+            logger.error("All birth certificate files failed to process")
+            return result, status.HTTP_400_BAD_REQUEST
+
 
 class BatchPassportOCRView(generics.CreateAPIView):
     """
@@ -958,7 +1142,8 @@ class BatchPassportOCRView(generics.CreateAPIView):
     Request body:
     {
         "file_list": ["pasaporte1.jpg", "pasaporte2.jpg"],  # Lista de archivos en S3
-        "bucket_name": "nombre-bucket"                       # Opcional, usa default si no se especifica
+        "bucket_name": "nombre-bucket",                      # Opcional, usa default si no se especifica
+        "async": true                                        # Opcional: responde 202 con job_id (ver batch-jobs/<id>/)
     }
     """
     serializer_class = BatchOCRSerializer
@@ -984,103 +1169,12 @@ class BatchPassportOCRView(generics.CreateAPIView):
                 logger.info(f"Processing passport OCR for {len(file_list)} files in bucket: {bucket_name}")
                 logger.debug(f"Files to process: {file_list}")
                 
-                # Initialize passport processor
-                logger.debug("Initializing TextractPassportAnalyzer for batch processing")
-                processor = TextractPassportAnalyzer()
-                
-                # Process files in batch using Textract
-                logger.info("Starting batch passport OCR processing with Textract")
-                result = processor.batch_analyze(file_list, bucket_name)
-                
-                # Format response similar to birth certificate endpoint
-                combined_lines = []
-                combined_words = []
-                full_texts = []
-                batch_metadata = []
-                errors = []
-                
-                for item in result.get('results', []):
-                    photo = item.get('photo', '')
-                    item_result = item.get('result', {})
-                    
-                    if item_result.get('success'):
-                        extracted = item_result.get('extracted_data', {})
-                        lines = extracted.get('lines', [])
-                        words = extracted.get('words', [])
-                        
-                        for line in lines:
-                            combined_lines.append({
-                                'Text': line.get('text', ''),
-                                'Confidence': line.get('confidence', 0),
-                                'Geometry': line.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        for word in words:
-                            combined_words.append({
-                                'Text': word.get('text', ''),
-                                'Confidence': word.get('confidence', 0),
-                                'Geometry': word.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        full_texts.append(extracted.get('full_text', ''))
-                        
-                        batch_metadata.append({
-                            'photo': photo,
-                            'line_count': extracted.get('line_count', 0),
-                            'word_count': extracted.get('word_count', 0),
-                            'average_confidence': extracted.get('average_confidence', 0),
-                            'mrz_detected': item_result.get('mrz_analysis', {}).get('mrz_detected', False),
-                            'mrz_lines': item_result.get('mrz_analysis', {}).get('mrz_lines', [])
-                        })
-                    else:
-                        errors.append({
-                            'photo': photo,
-                            'error': item_result.get('error', 'Unknown error'),
-                            'error_code': item_result.get('error_code', '500_Unknown')
-                        })
-                
-                # Calculate overall statistics
-                total_lines = len(combined_lines)
-                total_words = len(combined_words)
-                confidences = [line.get('Confidence', 0) for line in combined_lines]
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-                
-                response_data = {
-                    'success': result.get('successful', 0) > 0,
-                    'files_processed': result.get('total_processed', 0),
-                    'files_successful': result.get('successful', 0),
-                    'files_failed': result.get('errors', 0),
-                    'combined_response': {
-                        'Lines': combined_lines,
-                        'Words': combined_words,
-                        'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
-                        'BatchMetadata': batch_metadata
-                    },
-                    'errors': errors,
-                    'metadata': {
-                        'processing_type': 'batch_passport_textract',
-                        'total_lines': total_lines,
-                        'total_words': total_words,
-                        'average_confidence': round(avg_confidence, 2),
-                        'bucket': bucket_name
-                    }
-                }
-                
-                logger.info(f"Passport OCR completed - Success: {response_data['success']}, "
-                          f"Processed: {response_data['files_processed']}, "
-                          f"Successful: {response_data['files_successful']}, "
-                          f"Failed: {response_data['files_failed']}, "
-                          f"Avg Confidence: {avg_confidence:.2f}%")
+                # Job mode: queue the batch and answer at once with the job id
+                if _job_mode(request):
+                    return _submit_batch_job('passport', file_list, bucket_name, {})
                 
-                # Determine response status
-                if response_data['files_failed'] == 0:
-                    return Response(response_data, status=status.HTTP_200_OK)
-                elif response_data['files_successful'] > 0:
-                    return Response(response_data, status=status.HTTP_207_MULTI_STATUS)
-                else:
-                    return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+                result, result_status = self.process_batch(file_list, bucket_name, {})
+                return Response(result, status=result_status)
                 
             except Exception as e:
                 logger.error(f"Unexpected error in Passport OCR endpoint: {str(e)}")
@@ -1136,6 +1230,112 @@ class BatchPassportOCRView(generics.CreateAPIView):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def process_batch(self, file_list, bucket_name, options):
+        """
+        Process the batch and build the response
+        Also run by the batch job workers (apirest.BatchJobs) in job mode
+
+        Returns:
+            tuple: (response data, HTTP status)
+        """
+        # Initialize passport processor
+        logger.debug("Initializing TextractPassportAnalyzer for batch processing")
+        processor = TextractPassportAnalyzer()
+
+        # Process files in batch using Textract
+        logger.info("Starting batch passport OCR processing with Textract")
+        result = processor.batch_analyze(file_list, bucket_name)
+
+        # Format response similar to birth certificate endpoint
+        combined_lines = []
+        combined_words = []
+        full_texts = []
+        batch_metadata = []
+        errors = []
+
+        for item in result.get('results', []):
+            photo = item.get('photo', '')
+            item_result = item.get('result', {})
+
+            if item_result.get('success'):
+                extracted = item_result.get('extracted_data', {})
+                lines = extracted.get('lines', [])
+                words = extracted.get('words', [])
+
+                for line in lines:
+                    combined_lines.append({
+                        'Text': line.get('text', ''),
+                        'Confidence': line.get('confidence', 0),
+                        'Geometry': line.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                for word in words:
+                    combined_words.append({
+                        'Text': word.get('text', ''),
+                        'Confidence': word.get('confidence', 0),
+                        'Geometry': word.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                full_texts.append(extracted.get('full_text', ''))
+
+                batch_metadata.append({
+                    'photo': photo,
+                    'line_count': extracted.get('line_count', 0),
+                    'word_count': extracted.get('word_count', 0),
+                    'average_confidence': extracted.get('average_confidence', 0),
+                    'mrz_detected': item_result.get('mrz_analysis', {}).get('mrz_detected', False),
+                    'mrz_lines': item_result.get('mrz_analysis', {}).get('mrz_lines', [])
+                })
+            else:
+                errors.append({
+                    'photo': photo,
+                    'error': item_result.get('error', 'Unknown error'),
+                    'error_code': item_result.get('error_code', '500_Unknown')
+                })
+
+        # Calculate overall statistics
+        total_lines = len(combined_lines)
+        total_words = len(combined_words)
+        confidences = [line.get('Confidence', 0) for line in combined_lines]
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+
+        response_data = {
+            'success': result.get('successful', 0) > 0,
+            'files_processed': result.get('total_processed', 0),
+            'files_successful': result.get('successful', 0),
+            'files_failed': result.get('errors', 0),
+            'combined_response': {
+                'Lines': combined_lines,
+                'Words': combined_words,
+                'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
+                'BatchMetadata': batch_metadata
+            },
+            'errors': errors,
+            'metadata': {
+                'processing_type': 'batch_passport_textract',
+                'total_lines': total_lines,
+                'total_words': total_words,
+                'average_confidence': round(avg_confidence, 2),
+                'bucket': bucket_name
+            }
+        }
+
+        logger.info(f"Passport OCR completed - Success: {response_data['success']}, "
+                  f"Processed: {response_data['files_processed']}, "
+                  f"Successful: {response_data['files_successful']}, "
+                  f"Failed: {response_data['files_failed']}, "
+                  f"Avg Confidence: {avg_confidence:.2f}%")
+
+        # Determine response status
+        if response_data['files_failed'] == 0:
+            return response_data, status.HTTP_200_OK
+        elif response_data['files_successful'] > 0:
+            return response_data, status.HTTP_207_MULTI_STATUS
+        else:
+            return response_data, status.HTTP_400_BAD_REQUEST
+
 
 class BatchCertificadoOCRView(generics.CreateAPIView):
     """
@@ -1152,7 +1352,8 @@ class BatchCertificadoOCRView(generics.CreateAPIView):
     Request body:
     {
         "file_list": ["certificado1.jpg", "certificado2.jpg"],
-        "bucket_name": "nombre-bucket"  # Opcional
+        "bucket_name": "nombre-bucket",  # Opcional
+        "async": true                    # Opcional: responde 202 con job_id (ver batch-jobs/<id>/)
     }
     """
     serializer_class = BatchOCRSerializer
@@ -1178,132 +1379,12 @@ class BatchCertificadoOCRView(generics.CreateAPIView):
                 logger.info(f"Processing certificado OCR for {len(file_list)} files in bucket: {bucket_name}")
                 logger.debug(f"Files to process: {file_list}")
                 
-                # Initialize certificado processor
-                logger.debug("Initializing TextractCertificadoAnalyzer for batch processing")
-                processor = TextractCertificadoAnalyzer()
+                # Job mode: queue the batch and answer at once with the job id
+                if _job_mode(request):
+                    return _submit_batch_job('certificado', file_list, bucket_name, {})
                 
-                # Process files in batch
-                logger.info("Starting batch certificado OCR processing with Textract Tables")
-                result = processor.batch_analyze(file_list, bucket_name)
-                
-                # Format response
-                combined_lines = []
-                combined_words = []
-                full_texts = []
-                batch_metadata = []
-                all_tables = []
-                all_grades = []
-                student_info = {}
-                errors = []
-                
-                for item in result.get('results', []):
-                    photo = item.get('photo', '')
-                    item_result = item.get('result', {})
-                    
-                    if item_result.get('success'):
-                        extracted = item_result.get('extracted_data', {})
-                        lines = extracted.get('lines', [])
-                        words = extracted.get('words', [])
-                        
-                        for line in lines:
-                            combined_lines.append({
-                                'Text': line.get('text', ''),
-                                'Confidence': line.get('confidence', 0),
-                                'Geometry': line.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        for word in words:
-                            combined_words.append({
-                                'Text': word.get('text', ''),
-                                'Confidence': word.get('confidence', 0),
-                                'Geometry': word.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        full_texts.append(extracted.get('full_text', ''))
-                        
-                        # Collect tables
-                        tables = item_result.get('tables', [])
-                        all_tables.extend(tables)
-                        
-                        # Collect grades
-                        grades = item_result.get('grades', [])
-                        all_grades.extend(grades)
-                        
-                        # Get student info (from first successful page)
-                        if not student_info.get('nombre'):
-                            student_info = item_result.get('student_info', {})
-                        
-                        batch_metadata.append({
-                            'photo': photo,
-                            'line_count': extracted.get('line_count', 0),
-                            'word_count': extracted.get('word_count', 0),
-                            'average_confidence': extracted.get('average_confidence', 0),
-                            'tables_found': len(tables),
-                            'grades_extracted': len(grades)
-                        })
-                    else:
-                        errors.append({
-                            'photo': photo,
-                            'error': item_result.get('error', 'Unknown error'),
-                            'error_code': item_result.get('error_code', '500_Unknown')
-                        })
-                
-                # Calculate overall statistics
-                total_lines = len(combined_lines)
-                total_words = len(combined_words)
-                confidences = [line.get('Confidence', 0) for line in combined_lines]
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-                
-                # Format grades for easy consumption
-                formatted_grades = []
-                for grade in all_grades:
-                    formatted_grades.append({
-                        'Codigo': grade.get('codigo', ''),
-                        'Asignatura': grade.get('asignatura', ''),
-                        'Calificacion': grade.get('calificacion', ''),
-                        'RawData': grade.get('raw_row', [])
-                    })
-                
-                response_data = {
-                    'success': result.get('successful', 0) > 0,
-                    'files_processed': result.get('total_processed', 0),
-                    'files_successful': result.get('successful', 0),
-                    'files_failed': result.get('errors', 0),
-                    'combined_response': {
-                        'Lines': combined_lines,
-                        'Words': combined_words,
-                        'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
-                        'BatchMetadata': batch_metadata
-                    },
-                    'student_info': student_info,
-                    'grades': formatted_grades,
-                    'tables_data': all_tables,
-                    'errors': errors,
-                    'metadata': {
-                        'processing_type': 'batch_certificado_textract_tables',
-                        'total_lines': total_lines,
-                        'total_words': total_words,
-                        'average_confidence': round(avg_confidence, 2),
-                        'total_tables_found': len(all_tables),
-                        'total_grades_extracted': len(formatted_grades),
-                        'bucket': bucket_name
-                    }
-                }
-                
-                logger.info(f"Certificado OCR completed - Success: {response_data['success']}, "
-                          f"Processed: {response_data['files_processed']}, "
-                          f"Tables: {len(all_tables)}, Grades: {len(formatted_grades)}, "
-                          f"Avg Confidence: {avg_confidence:.2f}%")
-                
-                # Determine response status
-                if response_data['files_failed'] == 0:
-                    return Response(response_data, status=status.HTTP_200_OK)
-                elif response_data['files_successful'] > 0:
-                    return Response(response_data, status=status.HTTP_207_MULTI_STATUS)
-                else:
-                    return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+                result, result_status = self.process_batch(file_list, bucket_name, {})
+                return Response(result, status=result_status)
                 
             except Exception as e:
                 logger.error(f"Unexpected error in Certificado OCR endpoint: {str(e)}")
@@ -1365,6 +1446,141 @@ class BatchCertificadoOCRView(generics.CreateAPIView):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def process_batch(self, file_list, bucket_name, options):
+        """
+        Process the batch and build the response
+        Also run by the batch job workers (apirest.BatchJobs) in job mode
+
+        Returns:
+            tuple: (response data, HTTP status)
+        """
+        # Initialize certificado processor
+        logger.debug("Initializing TextractCertificadoAnalyzer for batch processing")
+        processor = TextractCertificadoAnalyzer()
+
+        # Process files in batch
+        logger.info("Starting batch certificado OCR processing with Textract Tables")
+        result = processor.batch_analyze(file_list, bucket_name)
+
+        # Format response
+        combined_lines = []
+        combined_words = []
+        full_texts = []
+        batch_metadata = []
+        all_tables = []
+        all_grades = []
+        student_info = {}
+        errors = []
+
+        for item in result.get('results', []):
+            photo = item.get('photo', '')
+            item_result = item.get('result', {})
+
+            if item_result.get('success'):
+                extracted = item_result.get('extracted_data', {})
+                lines = extracted.get('lines', [])
+                words = extracted.get('words', [])
+
+                for line in lines:
+                    combined_lines.append({
+                        'Text': line.get('text', ''),
+                        'Confidence': line.get('confidence', 0),
+                        'Geometry': line.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                for word in words:
+                    combined_words.append({
+                        'Text': word.get('text', ''),
+                        'Confidence': word.get('confidence', 0),
+                        'Geometry': word.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                full_texts.append(extracted.get('full_text', ''))
+
+                # Collect tables
+                tables = item_result.get('tables', [])
+                all_tables.extend(tables)
+
+                # Collect grades
+                grades = item_result.get('grades', [])
+                all_grades.extend(grades)
+
+                # Get student info (from first successful page)
+                if not student_info.get('nombre'):
+                    student_info = item_result.get('student_info', {})
+
+                batch_metadata.append({
+                    'photo': photo,
+                    'line_count': extracted.get('line_count', 0),
+                    'word_count': extracted.get('word_count', 0),
+                    'average_confidence': extracted.get('average_confidence', 0),
+                    'tables_found': len(tables),
+                    'grades_extracted': len(grades)
+                })
+            else:
+                errors.append({
+                    'photo': photo,
+                    'error': item_result.get('error', 'Unknown error'),
+                    'error_code': item_result.get('error_code', '500_Unknown')
+                })
+
+        # Calculate overall statistics
+        total_lines = len(combined_lines)
+        total_words = len(combined_words)
+        confidences = [line.get('Confidence', 0) for line in combined_lines]
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+
+        # Format grades for easy consumption
+        formatted_grades = []
+        for grade in all_grades:
+            formatted_grades.append({
+                'Codigo': grade.get('codigo', ''),
+                'Asignatura': grade.get('asignatura', ''),
+                'Calificacion': grade.get('calificacion', ''),
+                'RawData': grade.get('raw_row', [])
+            })
+
+        response_data = {
+            'success': result.get('successful', 0) > 0,
+            'files_processed': result.get('total_processed', 0),
+            'files_successful': result.get('successful', 0),
+            'files_failed': result.get('errors', 0),
+            'combined_response': {
+                'Lines': combined_lines,
+                'Words': combined_words,
+                'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
+                'BatchMetadata': batch_metadata
+            },
+            'student_info': student_info,
+            'grades': formatted_grades,
+            'tables_data': all_tables,
+            'errors': errors,
+            'metadata': {
+                'processing_type': 'batch_certificado_textract_tables',
+                'total_lines': total_lines,
+                'total_words': total_words,
+                'average_confidence': round(avg_confidence, 2),
+                'total_tables_found': len(all_tables),
+                'total_grades_extracted': len(formatted_grades),
+                'bucket': bucket_name
+            }
+        }
+
+        logger.info(f"Certificado OCR completed - Success: {response_data['success']}, "
+                  f"Processed: {response_data['files_processed']}, "
+                  f"Tables: {len(all_tables)}, Grades: {len(formatted_grades)}, "
+                  f"Avg Confidence: {avg_confidence:.2f}%")
+
+        # Determine response status
+        if response_data['files_failed'] == 0:
+            return response_data, status.HTTP_200_OK
+        elif response_data['files_successful'] > 0:
+            return response_data, status.HTTP_207_MULTI_STATUS
+        else:
+            return response_data, status.HTTP_400_BAD_REQUEST
+
 
 class BatchTituloOCRView(generics.CreateAPIView):
     """
@@ -1382,7 +1598,8 @@ class BatchTituloOCRView(generics.CreateAPIView):
     Request body:
     {
         "file_list": ["titulo1.jpg", "titulo2.jpg"],
-        "bucket_name": "nombre-bucket"  # Opcional
+        "bucket_name": "nombre-bucket",  # Opcional
+        "async": true                    # Opcional: responde 202 con job_id (ver batch-jobs/<id>/)
     }
     """
     serializer_class = BatchOCRSerializer
@@ -1408,133 +1625,12 @@ class BatchTituloOCRView(generics.CreateAPIView):
                 logger.info(f"Processing titulo OCR for {len(file_list)} files in bucket: {bucket_name}")
                 logger.debug(f"Files to process: {file_list}")
                 
-                # Initialize titulo processor
-                logger.debug("Initializing TextractUniversityTitleAnalyzer for batch processing")
-                processor = TextractUniversityTitleAnalyzer()
+                # Job mode: queue the batch and answer at once with the job id
+                if _job_mode(request):
+                    return _submit_batch_job('titulo', file_list, bucket_name, {})
                 
-                # Process files in batch
-                logger.info("Starting batch titulo OCR processing with Textract Tables")
-                result = processor.analyze_batch(file_list, bucket_name)
-                
-                # Format response
-                combined_lines = []
-                combined_words = []
-                full_texts = []
-                batch_metadata = []
-                all_tables = []
-                all_courses = []
-                degree_info = {}
-                errors = []
-                
-                for item in result.get('results', []):
-                    photo = item.get('photo', '')
-                    item_result = item.get('result', {})
-                    
-                    if item_result.get('success'):
-                        extracted = item_result.get('extracted_data', {})
-                        lines = extracted.get('lines', [])
-                        words = extracted.get('words', [])
-                        
-                        for line in lines:
-                            combined_lines.append({
-                                'Text': line.get('text', ''),
-                                'Confidence': line.get('confidence', 0),
-                                'Geometry': line.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        for word in words:
-                            combined_words.append({
-                                'Text': word.get('text', ''),
-                                'Confidence': word.get('confidence', 0),
-                                'Geometry': word.get('geometry', {}),
-                                'SourceFile': photo
-                            })
-                        
-                        full_texts.append(extracted.get('full_text', ''))
-                        
-                        # Collect tables
-                        tables = item_result.get('tables', [])
-                        all_tables.extend(tables)
-                        
-                        # Collect courses
-                        courses = item_result.get('courses', [])
-                        all_courses.extend(courses)
-                        
-                        # Get degree info (from first successful page)
-                        if not degree_info.get('titulo_nombre'):
-                            degree_info = item_result.get('degree_info', {})
-                        
-                        batch_metadata.append({
-                            'photo': photo,
-                            'line_count': extracted.get('line_count', 0),
-                            'word_count': extracted.get('word_count', 0),
-                            'average_confidence': extracted.get('average_confidence', 0),
-                            'tables_found': len(tables),
-                            'courses_extracted': len(courses)
-                        })
-                    else:
-                        errors.append({
-                            'photo': photo,
-                            'error': item_result.get('error', 'Unknown error'),
-                            'error_code': item_result.get('error_code', '500_Unknown')
-                        })
-                
-                # Calculate overall statistics
-                total_lines = len(combined_lines)
-                total_words = len(combined_words)
-                confidences = [line.get('Confidence', 0) for line in combined_lines]
-                avg_confidence = sum(confidences) / len(confidences) if confidences else 0
-                
-                # Format courses for easy consumption
-                formatted_courses = []
-                for course in all_courses:
-                    formatted_courses.append({
-                        'Codigo': course.get('codigo', ''),
-                        'Materia': course.get('nombre_materia', ''),
-                        'Creditos': course.get('creditos', ''),
-                        'Calificacion': course.get('calificacion', ''),
-                        'RawData': course.get('raw_row', [])
-                    })
-                
-                response_data = {
-                    'success': result.get('successful', 0) > 0,
-                    'files_processed': result.get('total_processed', 0),
-                    'files_successful': result.get('successful', 0),
-                    'files_failed': result.get('errors', 0),
-                    'combined_response': {
-                        'Lines': combined_lines,
-                        'Words': combined_words,
-                        'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
-                        'BatchMetadata': batch_metadata
-                    },
-                    'degree_info': degree_info,
-                    'courses': formatted_courses,
-                    'tables_data': all_tables,
-                    'errors': errors,
-                    'metadata': {
-                        'processing_type': 'batch_titulo_textract_tables',
-                        'total_lines': total_lines,
-                        'total_words': total_words,
-                        'average_confidence': round(avg_confidence, 2),
-                        'total_tables_found': len(all_tables),
-                        'total_courses_extracted': len(formatted_courses),
-                        'bucket': bucket_name
-                    }
-                }
-                
-                logger.info(f"Titulo OCR completed - Success: {response_data['success']}, "
-                          f"Processed: {response_data['files_processed']}, "
-                          f"Tables: {len(all_tables)}, Courses: {len(formatted_courses)}, "
-                          f"Avg Confidence: {avg_confidence:.2f}%")
-                
-                # Determine response status
-                if response_data['files_failed'] == 0:
-                    return Response(response_data, status=status.HTTP_200_OK)
-                elif response_data['files_successful'] > 0:
-                    return Response(response_data, status=status.HTTP_207_MULTI_STATUS)
-                else:
-                    return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
+                result, result_status = self.process_batch(file_list, bucket_name, {})
+                return Response(result, status=result_status)
                 
             except Exception as e:
                 logger.error(f"Unexpected error in Titulo OCR endpoint: {str(e)}")
@@ -1596,6 +1692,142 @@ class BatchTituloOCRView(generics.CreateAPIView):
                 }
             }, status=status.HTTP_400_BAD_REQUEST)
 
+    def process_batch(self, file_list, bucket_name, options):
+        """
+        Process the batch and build the response
+        Also run by the batch job workers (apirest.BatchJobs) in job mode
+
+        Returns:
+            tuple: (response data, HTTP status)
+        """
+        # Initialize titulo processor
+        logger.debug("Initializing TextractUniversityTitleAnalyzer for batch processing")
+        processor = TextractUniversityTitleAnalyzer()
+
+        # Process files in batch
+        logger.info("Starting batch titulo OCR processing with Textract Tables")
+        result = processor.analyze_batch(file_list, bucket_name)
+
+        # Format response
+        combined_lines = []
+        combined_words = []
+        full_texts = []
+        batch_metadata = []
+        all_tables = []
+        all_courses = []
+        degree_info = {}
+        errors = []
+
+        for item in result.get('results', []):
+            photo = item.get('photo', '')
+            item_result = item.get('result', {})
+
+            if item_result.get('success'):
+                extracted = item_result.get('extracted_data', {})
+                lines = extracted.get('lines', [])
+                words = extracted.get('words', [])
+
+                for line in lines:
+                    combined_lines.append({
+                        'Text': line.get('text', ''),
+                        'Confidence': line.get('confidence', 0),
+                        'Geometry': line.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                for word in words:
+                    combined_words.append({
+                        'Text': word.get('text', ''),
+                        'Confidence': word.get('confidence', 0),
+                        'Geometry': word.get('geometry', {}),
+                        'SourceFile': photo
+                    })
+
+                full_texts.append(extracted.get('full_text', ''))
+
+                # Collect tables
+                tables = item_result.get('tables', [])
+                all_tables.extend(tables)
+
+                # Collect courses
+                courses = item_result.get('courses', [])
+                all_courses.extend(courses)
+
+                # Get degree info (from first successful page)
+                if not degree_info.get('titulo_nombre'):
+                    degree_info = item_result.get('degree_info', {})
+
+                batch_metadata.append({
+                    'photo': photo,
+                    'line_count': extracted.get('line_count', 0),
+                    'word_count': extracted.get('word_count', 0),
+                    'average_confidence': extracted.get('average_confidence', 0),
+                    'tables_found': len(tables),
+                    'courses_extracted': len(courses)
+                })
+            else:
+                errors.append({
+                    'photo': photo,
+                    'error': item_result.get('error', 'Unknown error'),
+                    'error_code': item_result.get('error_code', '500_Unknown')
+                })
+
+        # Calculate overall statistics
+        total_lines = len(combined_lines)
+        total_words = len(combined_words)
+        confidences = [line.get('Confidence', 0) for line in combined_lines]
+        avg_confidence = sum(confidences) / len(confidences) if confidences else 0
+
+        # Format courses for easy consumption
+        formatted_courses = []
+        for course in all_courses:
+            formatted_courses.append({
+                'Codigo': course.get('codigo', ''),
+                'Materia': course.get('nombre_materia', ''),
+                'Creditos': course.get('creditos', ''),
+                'Calificacion': course.get('calificacion', ''),
+                'RawData': course.get('raw_row', [])
+            })
+
+        response_data = {
+            'success': result.get('successful', 0) > 0,
+            'files_processed': result.get('total_processed', 0),
+            'files_successful': result.get('successful', 0),
+            'files_failed': result.get('errors', 0),
+            'combined_response': {
+                'Lines': combined_lines,
+                'Words': combined_words,
+                'FullText': '\n\n--- PAGE BREAK ---\n\n'.join(full_texts),
+                'BatchMetadata': batch_metadata
+            },
+            'degree_info': degree_info,
+            'courses': formatted_courses,
+            'tables_data': all_tables,
+            'errors': errors,
+            'metadata': {
+                'processing_type': 'batch_titulo_textract_tables',
+                'total_lines': total_lines,
+                'total_words': total_words,
+                'average_confidence': round(avg_confidence, 2),
+                'total_tables_found': len(all_tables),
+                'total_courses_extracted': len(formatted_courses),
+                'bucket': bucket_name
+            }
+        }
+
+        logger.info(f"Titulo OCR completed - Success: {response_data['success']}, "
+                  f"Processed: {response_data['files_processed']}, "
+                  f"Tables: {len(all_tables)}, Courses: {len(formatted_courses)}, "
+                  f"Avg Confidence: {avg_confidence:.2f}%")
+
+        # Determine response status
+        if response_data['files_failed'] == 0:
+            return response_data, status.HTTP_200_OK
+        elif response_data['files_successful'] > 0:
+            return response_data, status.HTTP_207_MULTI_STATUS
+        else:
+            return response_data, status.HTTP_400_BAD_REQUEST
+
 
 class HTMLToPDFView(generics.CreateAPIView):
     """